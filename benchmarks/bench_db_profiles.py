@@ -0,0 +1,106 @@
+"""
+Benchmark zapisów (wstawianie i wykonywanie zleceń) dla profili silnika SQLite.
+
+Uruchomienie: python -m benchmarks.bench_db_profiles [--orders 2000] [--profiles legacy wal wal_unsafe]
+
+Każde zlecenie jest wstawiane i wykonywane we własnej transakcji, tak jak robią to
+handlery API i silnik zleceń. W tym czasie osobny wątek czyta salda (dashboard),
+żeby pokazać, czy czytelnicy blokują się z zapisującym.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from models.database import create_db_engine, SQLITE_PROFILES
+from models.user import Base, User, Portfolio, CurrencyBalance, OrderFuture, OrderStatus, AdvancedOrderType
+from services.crud import debit_balance, add_position
+
+USERS = 50
+
+
+def reader(session_factory, stop: threading.Event, stats: dict):
+    while not stop.is_set():
+        with session_factory() as db:
+            try:
+                db.execute(select(func.sum(CurrencyBalance.amount))).scalar()
+                stats["reads"] += 1
+            except OperationalError:
+                stats["read_errors"] += 1
+
+
+def run(profile: str, orders: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile=profile)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        with session_factory() as db:
+            for user_id in range(1, USERS + 1):
+                db.add(User(id=user_id, username=f"bench{user_id}", hashed_password="x",
+                            email=f"bench{user_id}@example.com"))
+                db.add(Portfolio(id=user_id, name="bench", user_id=user_id))
+                db.add(CurrencyBalance(user_id=user_id, currency="USDT", amount=10_000_000.0))
+            db.commit()
+
+        stats = {"reads": 0, "read_errors": 0}
+        stop = threading.Event()
+        thread = threading.Thread(target=reader, args=(session_factory, stop, stats))
+        thread.start()
+
+        started = time.perf_counter()
+        order_ids = []
+        for i in range(orders):
+            user_id = i % USERS + 1
+            with session_factory() as db:
+                order = OrderFuture(user_id=user_id, portfolio_id=user_id, symbol="BTCUSDT",
+                                    order_type=AdvancedOrderType.LIMIT, amount=0.01, price=100.0,
+                                    currency="USDT", status=OrderStatus.PENDING)
+                db.add(order)
+                db.commit()
+                order_ids.append((order.id, user_id))
+        insert_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for order_id, user_id in order_ids:
+            with session_factory() as db:
+                debit_balance(db, user_id, "USDT", 1.0)
+                add_position(db, user_id, "BTCUSDT", 0.01, 100.0, "USDT")
+                db.delete(db.get(OrderFuture, order_id))
+                db.commit()
+        execute_time = time.perf_counter() - started
+
+        stop.set()
+        thread.join()
+        engine.dispose()
+
+        return {
+            "inserts_per_s": orders / insert_time,
+            "executions_per_s": orders / execute_time,
+            "reads_per_s": stats["reads"] / (insert_time + execute_time),
+            "read_errors": stats["read_errors"],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    print(f"{args.orders} orders, one transaction per insert and per execution, concurrent balance reader")
+    for profile in args.profiles:
+        result = run(profile, args.orders)
+        print(
+            f"{profile:>10}: inserts {result['inserts_per_s']:8.1f}/s, "
+            f"executions {result['executions_per_s']:8.1f}/s, "
+            f"concurrent reads {result['reads_per_s']:8.1f}/s, read errors {result['read_errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
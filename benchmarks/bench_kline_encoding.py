@@ -0,0 +1,104 @@
+"""
+Porównanie formatów świec w pamięci podręcznej: dotychczasowy JSON (listy liczb jako tekst)
+i kodowanie kolumnowe (services.kline_store.encode_klines).
+
+Uruchomienie: python -m benchmarks.bench_kline_encoding [--sizes 100 1000 5000] [--redis redis://localhost:6379]
+
+Dla każdej wielkości okna mierzy rozmiar wartości, czas dekodowania trafienia oraz czas całej ścieżki
+trafienia aż do gotowej odpowiedzi (JSON albo binarnej). Jeśli Redis jest dostępny,
+podaje też MEMORY USAGE obu kluczy.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from services.history_service import KlineWindow, encode_window, decode_window
+from services.kline_store import from_binance, to_binance, encode_klines
+
+MINUTE = 60_000
+
+
+def make_rows(count: int):
+    """Świece 1m z błądzeniem losowym o wielkościach jak dla BTCUSDT."""
+    rng = np.random.default_rng(42)
+    close = 43000 + np.cumsum(rng.normal(0, 15, count))
+    rows = []
+    for i, price in enumerate(close):
+        open_time = 1_700_000_000_000 + i * MINUTE
+        volume = rng.uniform(1, 60)
+        rows.append([
+            open_time, f"{price - 3.21:.8f}", f"{price + 12.5:.8f}", f"{price - 14.02:.8f}", f"{price:.8f}",
+            f"{volume:.8f}", open_time + MINUTE - 1, f"{volume * price:.8f}", int(rng.integers(500, 5000)),
+            f"{volume / 2:.8f}", f"{volume * price / 2:.8f}", "0",
+        ])
+    return rows
+
+
+def timed(func, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def redis_memory(url: str, values: dict):
+    try:
+        import redis
+        client = redis.from_url(url, socket_connect_timeout=0.5)
+        client.ping()
+    except Exception:
+        return None
+    usage = {}
+    for name, value in values.items():
+        key = f"bench:klines:{name}"
+        client.set(key, value)
+        usage[name] = client.memory_usage(key)
+        client.delete(key)
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--redis", default="redis://localhost:6379")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        rows = make_rows(size)
+        klines = from_binance(rows)
+        old_value = json.dumps(rows)
+        new_value = encode_window(KlineWindow(0, 0, klines))
+
+        def old_hit():
+            data = json.loads(old_value)
+            return JSONResponse(jsonable_encoder({"symbol": "BTCUSDT", "interval": "1m", "data": data}))
+
+        def new_hit_json():
+            window = decode_window(new_value)
+            return JSONResponse({"symbol": "BTCUSDT", "interval": "1m", "data": to_binance(window.klines)})
+
+        def new_hit_binary():
+            return encode_klines(decode_window(new_value).klines)
+
+        print(f"{size} klines")
+        print(f"  value size:    json {len(old_value):>9} B   columnar {len(new_value):>9} B"
+              f"   ({len(old_value) / len(new_value):.1f}x smaller)")
+        print(f"  decode:        json {timed(lambda: json.loads(old_value), args.repeat):8.3f} ms"
+              f"   columnar {timed(lambda: decode_window(new_value), args.repeat):8.3f} ms")
+        print(f"  hit -> resp:   json {timed(old_hit, args.repeat):8.3f} ms"
+              f"   columnar->json {timed(new_hit_json, args.repeat):8.3f} ms"
+              f"   columnar->binary {timed(new_hit_binary, args.repeat):8.3f} ms")
+        usage = redis_memory(args.redis, {"json": old_value, "columnar": new_value})
+        if usage is None:
+            print("  redis memory:  (Redis unavailable, value size above is the payload stored)")
+        else:
+            print(f"  redis memory:  json {usage['json']:>9} B   columnar {usage['columnar']:>9} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Test obciążeniowy: opóźnienie pętli zdarzeń (a więc przekazywania wiadomości przez websocket)
+podczas zapisów do bazy wykonywanych przez handlery API.
+
+Uruchomienie: python -m benchmarks.bench_loop_latency [--writers 50] [--writes 20]
+
+Sonda co 5 ms wysyła "wiadomość" przez asyncio.Queue do konsumenta, tak jak relay websocket,
+i mierzy czas dostarczenia. Obciążenie to --writers równoległych "requestów" wykonujących
+po --writes wpłat przez update_user_balance (synchroniczna sesja w handlerze async)
+albo przez update_user_balance_async (AsyncSession).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, CurrencyBalance
+from services.crud import update_user_balance, update_user_balance_async
+
+PROBE_INTERVAL = 0.005
+
+
+async def probe(stop: asyncio.Event, latencies: list):
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def relay():
+        while True:
+            sent = await queue.get()
+            latencies.append((time.perf_counter() - sent) * 1000)
+
+    consumer = asyncio.create_task(relay())
+    while not stop.is_set():
+        queue.put_nowait(time.perf_counter())
+        await asyncio.sleep(PROBE_INTERVAL)
+    await asyncio.sleep(PROBE_INTERVAL)
+    consumer.cancel()
+
+
+async def run(mode: str, writers: int, writes: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        with session_factory() as db:
+            db.add_all([CurrencyBalance(user_id=i, currency="USDT", amount=0.0) for i in range(writers)])
+            db.commit()
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async_session_factory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        async def sync_writer(user_id):
+            for _ in range(writes):
+                with session_factory() as db:
+                    update_user_balance(db, user_id, "USDT", 1.0)
+                await asyncio.sleep(0)
+
+        async def async_writer(user_id):
+            for _ in range(writes):
+                async with async_session_factory() as db:
+                    await update_user_balance_async(db, user_id, "USDT", 1.0)
+
+        writer = sync_writer if mode == "sync" else async_writer
+        latencies = []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(stop, latencies))
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(i) for i in range(writers)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+        await async_engine.dispose()
+        engine.dispose()
+        return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.writers} concurrent writers x {args.writes} deposits")
+    for mode in ("sync", "async"):
+        elapsed, latencies = asyncio.run(run(mode, args.writers, args.writes))
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+        print(
+            f"{mode:>5}: writes {args.writers * args.writes / elapsed:7.1f}/s, "
+            f"relay latency p50 {statistics.median(latencies) if latencies else 0:7.2f} ms, "
+            f"p99 {p99:7.2f} ms, max {latencies[-1] if latencies else 0:7.2f} ms, samples {len(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Porównanie przepustowości silnika zleceń: wykonanie szeregowe vs współbieżne.
+
+Uruchomienie: python -m benchmarks.bench_order_execution [--orders 1000] [--users 100] [--latency 0.01]
+
+Wysyłka maila po wykonaniu zlecenia jest zastąpiona opóźnieniem --latency (symulacja SMTP),
+a ceny pochodzą z lokalnego FakePriceSource, więc benchmark działa bez sieci.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, User, Portfolio, CurrencyBalance, OrderFuture, OrderStatus, AdvancedOrderType
+from services import orders_service
+from services.price_feed import price_feed, FakePriceSource
+
+
+def prepare_database(path: str, orders: int, users: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for user_id in range(1, users + 1):
+        session.add(User(id=user_id, username=f"bench{user_id}", hashed_password="x",
+                         email=f"bench{user_id}@example.com"))
+        session.add(Portfolio(id=user_id, name="bench", user_id=user_id))
+        session.add(CurrencyBalance(user_id=user_id, currency="USDT", amount=10_000_000.0))
+    for i in range(orders):
+        user_id = i % users + 1
+        session.add(OrderFuture(user_id=user_id, portfolio_id=user_id, symbol="BTCUSDT",
+                                order_type=AdvancedOrderType.LIMIT, amount=0.01, price=200.0,
+                                currency="USDT", status=OrderStatus.PENDING))
+    session.commit()
+    session.close()
+    return engine
+
+
+async def run(concurrency: int, orders: int, users: int, latency: float):
+    async def slow_notify(*args, **kwargs):
+        await asyncio.sleep(latency)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = prepare_database(path, orders, users)
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        orders_service.AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+        orders_service.notify_order_execution = slow_notify
+        orders_service.order_executor.concurrency = concurrency
+
+        await orders_service.rebuild_order_index()
+        started = time.perf_counter()
+        await orders_service.process_tick()
+        elapsed = time.perf_counter() - started
+        await async_engine.dispose()
+
+        db = sessionmaker(bind=engine)()
+        remaining = db.query(OrderFuture).count()
+        db.close()
+        engine.dispose()
+        assert remaining == 0, f"{remaining} orders were not executed"
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    price_feed.set_source(FakePriceSource({"BTCUSDT": 100.0}))
+    print(f"{args.orders} triggered orders, {args.users} accounts, {args.latency * 1000:.0f} ms notification latency")
+    for label, concurrency in (("serial", 1), ("concurrent", args.concurrency)):
+        elapsed = asyncio.run(run(concurrency, args.orders, args.users, args.latency))
+        print(f"{label:>10} (limit {concurrency:>3}): {elapsed:7.2f} s, {args.orders / elapsed:8.1f} orders/s")
+
+
+if __name__ == "__main__":
+    main()
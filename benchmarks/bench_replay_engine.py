@@ -0,0 +1,125 @@
+"""
+Silnik zleceń na odtwarzanym przebiegu cen (services.market_replay) zamiast na żywym Binance.
+
+Uruchomienie: python -m benchmarks.bench_replay_engine [--recording zapis.mdr] [--speed 50] [--orders 500]
+
+Bez --recording używany jest syntetyczny zapis (błądzenie losowe). Zlecenia LIMIT kupna mają progi
+rozłożone między minimum a maksimum ceny z zapisu. Raport porównuje wykonane zlecenia z tymi, których
+próg przecięła któraś cena ze strumienia - różnica to przecięcia pominięte przy scalaniu cen
+w _drain_symbol (krótki spadek, po którym cena wróciła, zanim silnik przetworzył symbol).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from binance.ws.reconnecting_websocket import ReconnectingWebsocket
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from config import settings
+from models.user import Base, User, Portfolio, CurrencyBalance, OrderFuture, OrderStatus, AdvancedOrderType
+from services import binance_client, orders_service
+from services.market_replay import RecordType, ReplayServer, read_recording, write_random_walk
+from services.price_feed import price_feed, BinanceTickerSource
+
+
+def prepare_database(path: str, symbol: str, prices, orders: int, users: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    for user_id in range(1, users + 1):
+        session.add(User(id=user_id, username=f"bench{user_id}", hashed_password="x",
+                         email=f"bench{user_id}@example.com"))
+        session.add(Portfolio(id=user_id, name="bench", user_id=user_id))
+        session.add(CurrencyBalance(user_id=user_id, currency="USDT", amount=10_000_000.0))
+    low, high = min(prices), max(prices)
+    for i in range(orders):
+        user_id = i % users + 1
+        session.add(OrderFuture(user_id=user_id, portfolio_id=user_id, symbol=symbol,
+                                order_type=AdvancedOrderType.LIMIT, amount=0.01,
+                                price=low + (high - low) * i / orders, currency="USDT", status=OrderStatus.PENDING))
+    session.commit()
+    session.close()
+    return engine
+
+
+async def run(recording: str, symbol: str, prices, speed: float, orders: int, users: int):
+    async def notify(*args, **kwargs):
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = prepare_database(path, symbol, prices, orders, users)
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        orders_service.AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+        orders_service.notify_order_execution = notify
+
+        server = ReplayServer(recording, speed)
+        await server.start()
+        settings.BINANCE_API_URL = f"{server.url}/api"
+        settings.BINANCE_STREAM_URL = f"ws://{server.host}:{server.port}/"
+        received = []
+        price_feed.set_source(BinanceTickerSource())
+        price_feed.add_listener(lambda s, price: received.append(price))
+        price_feed.subscribe([symbol])
+        await price_feed.start()
+        engine_task = asyncio.create_task(orders_service.process_orders_in_background())
+        while server.subscriber_count == 0 or not price_feed.connected:
+            await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        server.play()
+        await server.finished.wait()
+        replayed = time.perf_counter() - started
+        # czekanie, aż silnik przetworzy zlecenia aktywowane ostatnimi cenami
+        while orders_service._streaming_symbols:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        engine_task.cancel()
+        await price_feed.stop()
+        await binance_client.close_async_client()
+        await server.stop()
+        await async_engine.dispose()
+
+        db = sessionmaker(bind=engine)()
+        remaining = db.query(OrderFuture).count()
+        db.close()
+        engine.dispose()
+        lowest = min(received) if received else float("inf")
+        crossed = sum(1 for i in range(orders) if min(prices) + (max(prices) - min(prices)) * i / orders >= lowest)
+        return replayed, elapsed, len(received), orders - remaining, crossed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording")
+    parser.add_argument("--symbol", default="BTCUSDT")
+    parser.add_argument("--ticks", type=int, default=3000)
+    parser.add_argument("--speed", type=float, default=50)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    # po końcu nagrania nie ma już wiadomości - zamknięcie strumienia nie czeka 10 s na kolejną
+    ReconnectingWebsocket.TIMEOUT = 1
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = args.recording
+        if recording is None:
+            recording = os.path.join(tmp, "walk.mdr")
+            write_random_walk(recording, args.symbol, ticks=args.ticks)
+        prices = [float(payload["c"]) for record_type, _, payload in read_recording(recording)
+                  if record_type == RecordType.TICKER and payload["s"] == args.symbol]
+        print(f"{len(prices)} ticks of {args.symbol} at {args.speed:g}x, {args.orders} limit orders")
+        replayed, elapsed, received, executed, crossed = asyncio.run(
+            run(recording, args.symbol, prices, args.speed, args.orders, args.users))
+    print(f"replay {replayed:6.2f} s, engine drained {elapsed:6.2f} s")
+    print(f"price updates received {received}/{len(prices)}")
+    print(f"orders executed {executed} of {crossed} crossed by a received price, {executed / elapsed:8.1f} orders/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 from pydantic import EmailStr
 
@@ -9,6 +11,58 @@ class Settings(BaseSettings):
     MAIL_SERVER: str = "smtp.gmail.com"
     MAIL_STARTTLS: bool = True
     MAIL_SSL_TLS: bool = False
+    PRICE_FEED: str = "binance"  # "binance" lub "fake" (lokalne źródło do testów/pracy offline)
+    PRICE_MAX_AGE: float = 5.0  # po ilu sekundach cena z tabeli jest nieaktualna
+    PRICE_STREAM: str = "miniTicker"  # typ strumienia Binance: miniTicker, ticker, trade, aggTrade
+    PRICE_STREAM_MAX_STREAMS: int = 1024  # limit strumieni na jedno połączenie Binance
+    PRICE_STREAM_RESYNC: float = 2.0  # co ile sekund uzgadniać listę symboli strumienia (zmiany są łączone)
+    PRICE_LOOKUP_TTL: float = 300.0  # ile sekund symbol z pojedynczego odczytu ceny zostaje w strumieniu
+    EXCHANGE_INFO_TTL: float = 3600.0  # co ile sekund odświeżać metadane giełdy (exchangeInfo)
+    EXCHANGE_INFO_RETRY: float = 60.0  # ponowienie po nieudanym odświeżeniu
+    CONVERSION_PRICE_REFRESH: float = 30.0  # co ile sekund odświeżać ceny wszystkich par w grafie przeliczeń
+    SNAPSHOT_INTERVAL: float = 300.0  # co ile sekund zapisywać wartość wszystkich portfeli
+    SNAPSHOT_CURRENCY: str = "USDT"  # waluta, w której zapisywane są wartości portfeli
+    EQUITY_MAX_POINTS: int = 2000  # górny limit punktów krzywej kapitału w jednej odpowiedzi
+    READ_MODEL_IDLE_TTL: float = 900.0  # po ilu sekundach bez odczytu usuwać salda i pozycje użytkownika z pamięci
+    READ_MODEL_MAX_USERS: int = 10000
+    READ_MODEL_CHECK_INTERVAL: float = 300.0  # co ile sekund porównywać model odczytu z bazą
+    TRANSFER_RATE_TOLERANCE: float = 0.01  # dopuszczalne względne odchylenie kursu podanego przez klienta przy transferze
+    TRANSFER_MAX_RATE_AGE: float = 60.0  # najstarsza cena (w sekundach), po której kursie wolno wykonać transfer
+    WS_SEND_QUEUE_SIZE: int = 8  # ile wiadomości może czekać na wysłanie do jednego klienta WebSocket
+    WS_MAX_CONFLATED: int = 300  # po tylu zastąpionych z rzędu wiadomościach wolny klient jest odłączany
+    WS_CONFLATION_MS: int = 250  # domyślny odstęp między paczkami na /crypto/ws
+    WS_MAX_SYMBOLS: int = 100  # limit symboli na jedno połączenie /crypto/ws
+    KLINE_STORE_DIR: str = "./data/klines"  # lokalny magazyn zamkniętych świec
+    KLINE_MAX_GAP: int = 5000  # ile świec można dociągnąć do magazynu jednym zapytaniem (większe idą wprost do Binance)
+    KLINE_TAIL_TTL: float = 2.0  # jak długo bieżąca świeca jest aktualna bez ponownego pobrania ogona
+    BINANCE_API_URL: Optional[str] = None  # inny adres REST API Binance (np. lokalny serwer testowy)
+    BINANCE_STREAM_URL: Optional[str] = None  # inny adres strumieni WebSocket (np. services.market_replay)
+    BINANCE_WEIGHT_LIMIT: int = 6000  # budżet wagi zapytań REST na minutę (limit REQUEST_WEIGHT Binance)
+    REDIS_URL: str = "redis://localhost:6379"
+    HISTORY_CACHE_TTL: int = 3600  # czas życia historii w Redis
+    HISTORY_LOCAL_CACHE_SIZE: int = 256  # liczba wpisów LRU w procesie przed Redisem
+    HISTORY_LOCAL_CACHE_TTL: float = 60.0
+    HISTORY_STALE_TTL: int = 300  # jak długo po HISTORY_CACHE_TTL zwracać nieaktualną historię, odświeżając ją w tle
+    HISTORY_HOT_KEYS: int = 20  # ile najpopularniejszych kluczy historii odświeżać z wyprzedzeniem
+    HISTORY_HOT_HALF_LIFE: float = 600.0  # okres połowicznego zaniku licznika popularności klucza
+    HISTORY_REFRESH_AHEAD: float = 120.0  # ile sekund przed zestarzeniem odświeżać popularne klucze
+    HISTORY_REFRESH_INTERVAL: float = 30.0
+    ANALYTICS_BASE_INTERVAL: str = "1h"  # wspólne okno świec, z którego przepróbkowywane są grubsze interwały
+    ANALYTICS_CACHE_SIZE: int = 512  # liczba serii wskaźników trzymanych w pamięci
+    ANALYTICS_CACHE_TTL: float = 3600.0
+    ORDER_ENGINE_MODE: str = "stream"  # "stream" (zdarzenia z cen) lub "poll" (cykliczne odpytywanie)
+    ORDER_ENGINE_POLL_INTERVAL: float = 1.0
+    ORDER_ENGINE_CONCURRENCY: int = 32  # ile aktywowanych zleceń może się wykonywać jednocześnie
+    DATABASE_URL: str = "sqlite:///./users.db"
+    DB_PROFILE: str = "wal"  # profil pragm SQLite: legacy, wal, wal_unsafe (models/database.py)
+    SQLITE_JOURNAL_MODE: Optional[str] = None  # nadpisania pojedynczych pragm profilu
+    SQLITE_SYNCHRONOUS: Optional[str] = None
+    SQLITE_BUSY_TIMEOUT_MS: Optional[int] = None
+    SQLITE_CACHE_SIZE: Optional[int] = None
+    SQLITE_MMAP_SIZE: Optional[int] = None
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
 
     class Config:
         env_file = ".env"
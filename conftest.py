@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from models.user import User
+from services import orders_service
+from services.migrations import migrate
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    Plikowa baza SQLite ze schematem po migracjach i użytkownikiem 1.
+    Zwraca sesję synchroniczną (przygotowanie danych i asercje), silnik async i fabrykę sesji async.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db")
+    migrate(engine)
+    # NullPool: połączenia aiosqlite nie mogą przechodzić między kolejnymi asyncio.run
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/test.db", poolclass=NullPool)
+    session = sessionmaker(bind=engine)()
+    session.add(User(id=1, username="tester", hashed_password="x", email="tester@example.com"))
+    session.commit()
+
+    yield SimpleNamespace(session=session, async_engine=async_engine,
+                          factory=async_sessionmaker(bind=async_engine, expire_on_commit=False))
+
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def no_notifications(monkeypatch):
+    """Wyłącza wysyłkę powiadomień o wykonanych zleceniach."""
+    async def fake_notify(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(orders_service, "notify_order_execution", fake_notify)
@@ -2,6 +2,13 @@
 from fastapi import FastAPI
 
 from services.orders_service import process_orders_in_background
+from services.price_feed import price_feed
+from services.exchange_info import exchange_info
+from services.conversion import conversion_graph
+from services.snapshots import portfolio_snapshotter
+from services.read_model import read_model
+from services.history_service import history_cache
+from services.binance_client import close_async_client
 from services.db import init_db
 from routers import crypto_history, crypto_websocket, auth, portfolio, orders, notifications
 import asyncio
@@ -20,8 +27,24 @@ app.include_router(notifications.router, prefix="/api", tags=["Notifications"])
 
 @app.on_event("startup")
 async def startup_event():
+    await exchange_info.start()
+    await price_feed.start()
+    await conversion_graph.start()
+    await portfolio_snapshotter.start()
+    await read_model.start()
+    await history_cache.start()
     asyncio.create_task(process_orders_in_background())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await history_cache.stop()
+    await read_model.stop()
+    await portfolio_snapshotter.stop()
+    await conversion_graph.stop()
+    await price_feed.stop()
+    await exchange_info.stop()
+    await close_async_client()
+
 @app.get("/")
 def root() -> dict[str, str]:
     return {"message": "Welcome to the Crypto API"}
\ No newline at end of file
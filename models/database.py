@@ -0,0 +1,113 @@
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from config import settings
+
+# Profile ustawień SQLite. "legacy" odpowiada domyślnej konfiguracji sqlite3
+# (rollback journal, pełny fsync przy każdym commit), "wal" pozwala czytelnikom
+# i zapisującemu działać równolegle, a fsync robi tylko przy checkpointach.
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -2000,
+        "mmap_size": 0,
+    },
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,  # ujemna wartość = KiB, czyli 64 MB
+        "mmap_size": 256 * 1024 * 1024,
+    },
+    # bez fsync - tylko do testów i benchmarków, awaria systemu może zgubić ostatnie transakcje
+    "wal_unsafe": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+    },
+}
+
+
+def sqlite_pragmas(profile: str = settings.DB_PROFILE) -> Dict[str, object]:
+    """Zwraca pragmy dla profilu z nadpisaniami z ustawień (SQLITE_*)."""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}, use one of {sorted(SQLITE_PROFILES)}")
+    pragmas = dict(SQLITE_PROFILES[profile])
+    overrides = {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+    }
+    pragmas.update({name: value for name, value in overrides.items() if value is not None})
+    return pragmas
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_memory(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:"
+
+
+def _engine_options(url: str) -> dict:
+    if not _is_sqlite(url):
+        return {
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+        }
+    options = {"connect_args": {"check_same_thread": False}}
+    if not _is_memory(url):
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+        )
+    return options
+
+
+def _install_pragmas(engine: Engine, pragmas: Dict[str, object]):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def to_async_url(url: str) -> str:
+    """sqlite:///./users.db -> sqlite+aiosqlite:///./users.db"""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.get_driver_name() in ("pysqlite", ""):
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    return url
+
+
+def create_db_engine(url: str = settings.DATABASE_URL, profile: Optional[str] = None) -> Engine:
+    """Tworzy synchroniczny silnik z profilem pragm SQLite i jawnie ustawioną pulą połączeń."""
+    engine = create_engine(url, **_engine_options(url))
+    if _is_sqlite(url):
+        _install_pragmas(engine, sqlite_pragmas(profile or settings.DB_PROFILE))
+    return engine
+
+
+def create_async_db_engine(url: str = settings.DATABASE_URL, profile: Optional[str] = None) -> AsyncEngine:
+    """Asynchroniczna wersja create_db_engine (dla SQLite przez aiosqlite)."""
+    async_url = to_async_url(url)
+    options = _engine_options(url)
+    options.pop("connect_args", None)
+    engine = create_async_engine(async_url, **options)
+    if _is_sqlite(url):
+        _install_pragmas(engine.sync_engine, sqlite_pragmas(profile or settings.DB_PROFILE))
+    return engine
@@ -1,17 +1,26 @@
 # user.py (rozszerzenie)
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Float, create_engine, ForeignKey, DateTime, UniqueConstraint, Enum
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, UniqueConstraint, Enum, Index
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from enum import Enum as PyEnum
 
-DATABASE_URL = "sqlite:///./users.db"
+from config import settings
+from models.database import create_db_engine, create_async_db_engine
+
+DATABASE_URL = settings.DATABASE_URL
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Asynchroniczny silnik dla handlerów async i silnika zleceń (nie blokuje pętli zdarzeń).
+# expire_on_commit=False, bo w trybie async nie ma leniwego doczytywania atrybutów po commit.
+async_engine = create_async_db_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -36,6 +45,10 @@ class CurrencyBalance(Base):
     amount = Column(Float, default=0.0)
     user = relationship("User", back_populates="currency_balances")
 
+    __table_args__ = (
+        Index("ix_currency_balances_user_currency", "user_id", "currency", unique=True),
+    )
+
 
 class Account(Base):
     __tablename__ = "accounts"
@@ -74,6 +87,27 @@ class PortfolioAsset(Base):
     buy_currency = Column(String)  # W jakiej walucie był zakup (np. "USD")
     portfolio = relationship("Portfolio", back_populates="assets")
 
+    __table_args__ = (
+        Index("ix_portfolio_assets_portfolio_symbol", "portfolio_id", "symbol", unique=True),
+    )
+
+
+class PortfolioSnapshot(Base):
+    """
+    Wartość portfela w chwili ts (sekundy od epoki) w walucie SNAPSHOT_CURRENCY;
+    ponowny zrzut w tej samej sekundzie nadpisuje wiersz.
+    """
+    __tablename__ = "portfolio_snapshots"
+
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), primary_key=True)
+    ts = Column(Integer, primary_key=True)
+    value = Column(Float, nullable=False)
+    cost = Column(Float, nullable=False)
+
+    # bez rowid wiersze leżą w B-drzewie klucza (portfolio_id, ts): zakres czasu jednego portfela
+    # to ciągły odczyt, bez osobnego indeksu
+    __table_args__ = {"sqlite_with_rowid": False}
+
 
 class OrderType(PyEnum):
     BUY = "buy"
@@ -105,7 +139,9 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     portfolio = relationship("Portfolio")
 
-
+    __table_args__ = (
+        Index("ix_orders_user_created", "user_id", "created_at"),
+    )
 
 
 class AdvancedOrderType(PyEnum):
@@ -134,5 +170,9 @@ class OrderFuture(Base):
     user = relationship("User", back_populates="orderFuture")
     portfolio = relationship("Portfolio")
 
-# Tworzenie tabel w bazie danych
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_orderFuture_status", "status"),
+        Index("ix_orderFuture_user_created", "user_id", "created_at"),
+    )
+
+# Tabele i indeksy tworzy services.migrations (wywoływane przez services.db.init_db)
@@ -1,60 +1,74 @@
-from fastapi import APIRouter
-from binance.client import Client
-import json
-import redis.asyncio as redis  
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+from services.analytics import get_analytics, indicator_cache
+from services.history_service import UnknownSymbol, get_history, history_cache
+from services.kline_store import kline_store, to_binance, encode_klines
 from services.logger import logger
+from services.upstream import UpstreamBusy, upstream
 
 router = APIRouter()
-client = Client()
 
+BINARY_MEDIA_TYPE = "application/octet-stream"
 
-redis_client = redis.from_url("redis://localhost:6379", decode_responses=True)
 
-async def get_from_cache(key: str):
-    """
-    Pobiera dane z cache Redis.
-    """
-    try:
-        data = await redis_client.get(key)
-        if data:
-            print(f"[CACHE HIT] Klucz: {key}")  
-        else:
-            print(f"[CACHE MISS] Klucz: {key}")  
-        return data
-    except Exception as e:
-        logger.error(f"failed to get cache {str(e)}", exc_info=True)
-        return None
+def _busy(e: UpstreamBusy) -> HTTPException:
+    """Historia odrzucona przez bramę Binance (budżet zarezerwowany dla zleceń)."""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
 
-async def set_to_cache(key: str, value: str, expire: int = 3600):
+
+@router.get("/crypto/history/{symbol}")
+async def get_crypto_history(symbol: str, interval: str = "1d", limit: int = 100,
+                             start_time: Optional[int] = None, end_time: Optional[int] = None,
+                             format: Optional[str] = None, accept: Optional[str] = Header(None)):
     """
-    Zapisuje dane do cache Redis z czasem wygaśnięcia.
+    Pobiera historię cen dla danego symbolu. Odpowiedź jest wycinana z okna świec
+    (symbol, interwał) w pamięci podręcznej, rozszerzanego tylko o brakujące świece.
+    start_time/end_time w ms. Dla format=binary (lub Accept: application/octet-stream)
+    zwraca świece w kodowaniu kolumnowym (services.kline_store.encode_klines) zamiast JSON.
     """
     try:
-        await redis_client.set(key, value, ex=expire)
-        print(f"[CACHE SET] Klucz: {key}, Czas wygaśnięcia: {expire}s")  
+        klines = await get_history(symbol, interval, limit, start_time, end_time)
+    except UnknownSymbol as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except UpstreamBusy as e:
+        raise _busy(e)
     except Exception as e:
-        logger.error(f"redis error: {str(e)}", exc_info=True)
-@router.get("/crypto/history/{symbol}")
-async def get_crypto_history(symbol: str, interval: str = "1d", limit: int = 100):
-    """
-    Pobiera historię cen dla danego symbolu z Binance.
-    """
-    cache_key = f"{symbol}:{interval}:{limit}"  
+        logger.error(f"Error during download from Binance: {str(e)}",exc_info=True)
+        return {"error": str(e)}
 
-    
-    cached_data = await get_from_cache(cache_key)
-    if cached_data:
-        print(f"[REDIS] Dane dla {symbol} pobrane z cache.")  
-        return {"symbol": symbol, "interval": interval, "data": json.loads(cached_data)}
+    if format == "binary" or (format is None and accept is not None and BINARY_MEDIA_TYPE in accept):
+        return Response(content=encode_klines(klines), media_type=BINARY_MEDIA_TYPE,
+                        headers={"X-Symbol": symbol, "X-Interval": interval})
+    # JSONResponse pomija jsonable_encoder - dane są już prostymi listami
+    return JSONResponse({"symbol": symbol, "interval": interval, "data": to_binance(klines)})
+
+
+@router.get("/crypto/cache/stats")
+async def get_cache_stats():
+    """Liczniki pamięci podręcznej historii (trafienia, chybienia, połączone zapytania)"""
+    return {**history_cache.stats.as_dict(), "local_entries": len(history_cache.local),
+            "upstream_calls": kline_store.upstream_calls, "analytics": indicator_cache.stats.as_dict(),
+            "upstream": {**upstream.stats.as_dict(), "used_weight": upstream.used_weight}}
 
-    try:
-        print(f"[BINANCE] Pobieranie danych dla {symbol} z Binance...")
-        klines = client.get_klines(symbol=symbol, interval=interval, limit=limit)
-        
-        await set_to_cache(cache_key, json.dumps(klines))
 
-        print(f"[BINANCE] Dane dla {symbol} zapisane w cache.")  
-        return {"symbol": symbol, "interval": interval, "data": klines}
+@router.get("/crypto/analytics/{symbol}")
+async def get_crypto_analytics(symbol: str, interval: str = "1h", limit: int = Query(100, ge=1, le=1000),
+                               indicators: List[str] = Query([]), base_interval: Optional[str] = None):
+    """
+    Świece przepróbkowane do dowolnego interwału (np. 45m, 2h, 3d) i wskaźniki liczone po stronie serwera.
+    indicators: sma:20, ema:50, rsi:14, bb:20:2, vwap:20 (parametr powtarzany lub rozdzielony przecinkami).
+    """
+    specs = [spec for value in indicators for spec in value.split(",") if spec]
+    try:
+        return await get_analytics(symbol, interval, limit, specs, base_interval)
+    except UnknownSymbol as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UpstreamBusy as e:
+        raise _busy(e)
     except Exception as e:
-        logger.error(f"Error during download from Binance: {str(e)}",exc_info=True)
+        logger.error(f"Error during analytics for {symbol}: {str(e)}", exc_info=True)
         return {"error": str(e)}
@@ -1,7 +1,14 @@
-from fastapi import APIRouter, WebSocket
-from binance import AsyncClient, BinanceSocketManager
-from services.logger import logger
 import asyncio
+import json
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from config import settings
+from services.binance_service import get_symbol_assets
+from services.logger import logger
+from services.ticker_hub import ticker_hub, Watchlist
+
+MIN_CONFLATION_MS = 50
+MAX_CONFLATION_MS = 10000
 
 router = APIRouter()
 
@@ -9,21 +16,82 @@ router = APIRouter()
 async def crypto_websocket(websocket: WebSocket, symbol: str):
     """
     WebSocket do odbierania aktualnych cen z Binance.
+    Wszyscy klienci danego symbolu współdzielą jeden strumień z Binance.
     """
     await websocket.accept()
 
-    client = await AsyncClient.create()
-    bsm = BinanceSocketManager(client)
+    try:
+        async with ticker_hub.subscription(symbol) as subscription:
+            async for payload in subscription:
+                await websocket.send_text(payload)
+        # klient nie nadążał z odbiorem i został odłączony
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"websocket error: {str(e)}",)
+        await websocket.close()
 
-    stream = bsm.symbol_ticker_socket(symbol)
 
-    async with stream as ticker_socket:
+def _conflation_interval(ms) -> float:
+    return min(max(int(ms), MIN_CONFLATION_MS), MAX_CONFLATION_MS) / 1000
+
+
+async def _receive_commands(websocket: WebSocket, watchlist: Watchlist):
+    """
+    Obsługuje polecenia klienta:
+    {"action": "subscribe" | "unsubscribe", "symbols": [...]} oraz {"action": "interval", "ms": 250}
+    """
+    while True:
         try:
-            while True:
-                msg = await ticker_socket.recv()
-                await websocket.send_json(msg)
-        except Exception as e:
-            logger.error(f"websocket error: {str(e)}",)
-        finally:
-            await client.close_connection()
-            await websocket.close()
\ No newline at end of file
+            command = json.loads(await websocket.receive_text())
+            action = command.get("action")
+            if action == "subscribe":
+                symbols = [s.upper() for s in command.get("symbols", [])]
+                unknown = [s for s in symbols if await get_symbol_assets(s) is None]
+                added = watchlist.subscribe(s for s in symbols if s not in unknown)
+                await websocket.send_json({"type": "subscribed", "symbols": added, "unknown": unknown,
+                                           "watchlist": sorted(watchlist.symbols)})
+            elif action == "unsubscribe":
+                watchlist.unsubscribe(command.get("symbols", []))
+                await websocket.send_json({"type": "unsubscribed", "watchlist": sorted(watchlist.symbols)})
+            elif action == "interval":
+                watchlist.interval = _conflation_interval(command["ms"])
+                await websocket.send_json({"type": "interval", "ms": int(watchlist.interval * 1000)})
+            else:
+                await websocket.send_json({"type": "error", "message": f"Unknown action: {action}"})
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            await websocket.send_json({"type": "error", "message": f"Invalid command: {str(e)}"})
+
+
+async def _send_batches(websocket: WebSocket, watchlist: Watchlist):
+    while True:
+        batch = await watchlist.next_batch()
+        await websocket.send_text(json.dumps({"type": "tickers", "data": batch}, separators=(",", ":")))
+
+
+@router.websocket("/crypto/ws")
+async def crypto_multi_websocket(websocket: WebSocket, interval_ms: int = settings.WS_CONFLATION_MS):
+    """
+    WebSocket dla wielu symboli naraz. Klient dodaje i usuwa symbole poleceniami,
+    a serwer co interval_ms wysyła jedną paczkę z najnowszym stanem zmienionych symboli.
+    """
+    await websocket.accept()
+    watchlist = Watchlist(ticker_hub, _conflation_interval(interval_ms))
+    tasks = [
+        asyncio.create_task(_receive_commands(websocket, watchlist)),
+        asyncio.create_task(_send_batches(websocket, watchlist)),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"websocket error: {str(e)}",)
+        await websocket.close()
+    finally:
+        for task in tasks:
+            task.cancel()
+        watchlist.close()
@@ -2,15 +2,19 @@ import asyncio
 from datetime import datetime
 
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from services.binance_service import get_binance_supported_currencies, get_current_market_price
-from models.user import Portfolio, PortfolioAsset, User, CurrencyBalance, Order, OrderType, OrderStatus, SessionLocal, \
-    AdvancedOrderType, OrderFuture
-from services.db import get_db
+from services.binance_service import get_binance_supported_currencies, get_current_market_price, \
+    is_supported_currency, get_symbol_assets
+from models.user import Portfolio, PortfolioAsset, User, CurrencyBalance, Order, OrderType, OrderStatus, \
+    AsyncSessionLocal, AdvancedOrderType, OrderFuture
+from services.db import get_db, get_async_db
 from services.auth import get_current_user
-from services.orders_service import execute_market_sell, execute_buy
+from services.orders_service import execute_market_sell, execute_buy, engine_stats
 from services.notification_service import notify_order_status_change, notify_order_execution
+from services.order_index import order_index
 
 router = APIRouter()
 
@@ -22,30 +26,33 @@ async def create_order(
         order_type: OrderType,
         amount: float,
         currency: str = "USDT",
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
     """Tworzy nowe zlecenie kupna/sprzedaży z aktualną ceną z Binance"""
     # walidacja portfela
-    portfolio = db.query(Portfolio).filter(
+    portfolio = (await db.execute(select(Portfolio).where(
         Portfolio.id == portfolio_id,
         Portfolio.user_id == current_user.id
-    ).first()
+    ))).scalars().first()
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
     # walidacja waluty
-    currencies = get_binance_supported_currencies()
-    if currency not in currencies:
+    if not await is_supported_currency(currency):
         raise HTTPException(
             status_code=400,
             detail={
                 "message": "Unsupported currency",
-                "supported_currencies": currencies,
+                "supported_currencies": await get_binance_supported_currencies(),
                 "received_currency": currency
             }
         )
 
+    # walidacja symbolu bez zapytania o cenę do Binance
+    if await get_symbol_assets(symbol) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown symbol {symbol}")
+
     # pobiera cene z binance
     try:
         current_price = await get_current_market_price(symbol)
@@ -67,8 +74,8 @@ async def create_order(
     )
 
     db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
+    await db.commit()
+    await db.refresh(new_order)
 
     asyncio.create_task(execute_market_order(new_order.id))
 
@@ -89,17 +96,21 @@ async def create_advanced_order(
         price: float = None,
         stop_price: float = None,
         currency: str = "USDT",
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
     """Tworzy zlecenie typu limit, stop-limit, take-profit itp"""
-    portfolio = db.query(Portfolio).filter(
+    portfolio = (await db.execute(select(Portfolio).where(
         Portfolio.id == portfolio_id,
         Portfolio.user_id == current_user.id
-    ).first()
+    ))).scalars().first()
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
+    # nieznany symbol w indeksie zleceń psułby zbiorcze pobieranie cen dla wszystkich zleceń
+    if await get_symbol_assets(symbol) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown symbol {symbol}")
+
     new_order = OrderFuture(
         user_id=current_user.id,
         portfolio_id=portfolio_id,
@@ -113,8 +124,9 @@ async def create_advanced_order(
     )
 
     db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
+    await db.commit()
+    await db.refresh(new_order)
+    order_index.add(new_order)
 
     return {
         "message": "Advanced order created successfully",
@@ -131,22 +143,22 @@ async def modify_order(
         new_amount: float = None,
         new_price: float = None,
         new_stop_price: float = None,  # Tylko dla zleceń advanced
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
     """
     Modyfikuje istniejące zlecenie (tylko dla zlecen  PENDING).
     """
     if order_type == "market":
-        order = db.query(Order).filter(
+        order = (await db.execute(select(Order).where(
             Order.id == order_id,
             Order.user_id == current_user.id
-        ).first()
+        ))).scalars().first()
     elif order_type == "advanced":
-        order = db.query(OrderFuture).filter(
+        order = (await db.execute(select(OrderFuture).where(
             OrderFuture.id == order_id,
             OrderFuture.user_id == current_user.id
-        ).first()
+        ))).scalars().first()
     else:
         raise HTTPException(
             status_code=400,
@@ -191,8 +203,10 @@ async def modify_order(
         if order_type == "advanced" and new_stop_price is not None:
             order.stop_price = new_stop_price
 
-        db.commit()
-        db.refresh(order)
+        await db.commit()
+        await db.refresh(order)
+        if order_type == "advanced":
+            order_index.add(order)
 
         response = {
             "message": "Order modified successfully",
@@ -211,7 +225,7 @@ async def modify_order(
         return response
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Failed to modify order: {str(e)}"
@@ -221,22 +235,22 @@ async def modify_order(
 async def cancel_order(
     order_id: int,
     order_type: str = "advanced",  # 'market' lub 'advanced'
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     Anuluje zlecenie (tylko dla zlecen PENDING).
     """
     if order_type == "market":
-        order = db.query(Order).filter(
+        order = (await db.execute(select(Order).where(
             Order.id == order_id,
             Order.user_id == current_user.id
-        ).first()
+        ))).scalars().first()
     elif order_type == "advanced":
-        order = db.query(OrderFuture).filter(
+        order = (await db.execute(select(OrderFuture).where(
             OrderFuture.id == order_id,
             OrderFuture.user_id == current_user.id
-        ).first()
+        ))).scalars().first()
     else:
         raise HTTPException(
             status_code=400,
@@ -255,7 +269,9 @@ async def cancel_order(
     try:
         order.status = OrderStatus.CANCELLED
         order.executed_at = datetime.utcnow()
-        db.commit()
+        await db.commit()
+        if order_type == "advanced":
+            order_index.remove(order.id)
 
         return {
             "message": "Order cancelled successfully",
@@ -264,7 +280,7 @@ async def cancel_order(
             "status": order.status.value
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Failed to cancel order: {str(e)}"
@@ -273,21 +289,19 @@ async def cancel_order(
 
 async def execute_market_order(order_id: int):
     """Główna funkcja wykonująca zlecenie market"""
-    db = SessionLocal()
-    try:
-        order = db.query(Order).filter(Order.id == order_id).first()
-        if not order or order.status != OrderStatus.PENDING:
-            return
+    async with AsyncSessionLocal() as db:
+        try:
+            order = await db.get(Order, order_id)
+            if not order or order.status != OrderStatus.PENDING:
+                return
 
-        if order.order_type == OrderType.BUY:
-            await execute_buy(order, db)
-        elif order.order_type == OrderType.SELL:
-            await execute_market_sell(order, db)
+            if order.order_type == OrderType.BUY:
+                await execute_buy(order, db)
+            elif order.order_type == OrderType.SELL:
+                await execute_market_sell(order, db)
 
-    except Exception as e:
-        print(f"Order execution error: {str(e)}")
-    finally:
-        db.close()
+        except Exception as e:
+            print(f"Order execution error: {str(e)}")
 
 
 @router.get("/orders")
@@ -352,3 +366,9 @@ def get_user_orders(
     result.sort(key=lambda x: x['created_at'], reverse=True)
 
     return result
+
+
+@router.get("/orders/engine/stats")
+def get_engine_stats(current_user: User = Depends(get_current_user)):
+    """Zwraca czas trwania ostatniego cyklu silnika zleceń i liczbę zapytań do Binance w tym cyklu"""
+    return engine_stats.as_dict()
@@ -1,22 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-
-from services.binance_service import get_binance_supported_currencies
-from services.crud import update_user_balance
-from models.user import Portfolio, PortfolioAsset, User, CurrencyBalance
-from services.db import get_db
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+
+from config import settings
+from services.binance_service import get_binance_supported_currencies, is_supported_currency
+from services.crud import update_user_balance_async, get_user_balance_async, debit_balance_async, \
+    credit_balance_async
+from models.user import Portfolio, User
+from services.db import get_db, get_async_db
+from services.conversion import ConversionGraph, conversion_graph
+from services.read_model import read_model
+from services.snapshots import equity_curve
+from services.valuation import normalize_currency, value_assets, value_balances
 from services.auth import get_current_user, require_role
 
 router = APIRouter()
 
 @router.post("/portfolios/")
-def create_portfolio(name: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_portfolio(name: str, db: AsyncSession = Depends(get_async_db),
+                           current_user: User = Depends(get_current_user)):
     """Tworzy portfel dla uzytkownika"""
-    db_portfolio = Portfolio(name=name, user_id=current_user.id)
-    db.add(db_portfolio)
-    db.commit()
-    db.refresh(db_portfolio)
+    with read_model.writing(current_user.id) as changes:
+        db_portfolio = Portfolio(name=name, user_id=current_user.id)
+        db.add(db_portfolio)
+        await db.commit()
+        await db.refresh(db_portfolio)
+        changes.portfolio(db_portfolio.id, name)
     return db_portfolio
 
 
@@ -27,23 +42,65 @@ def get_portfolios(db: Session = Depends(get_db), current_user: User = Depends(g
     return [{"id": p.id, "name": p.name} for p in portfolios]
 
 
+@router.get("/portfolios/overview")
+async def get_portfolios_overview(
+    target_currency: str = "USD",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Wszystkie portfele użytkownika z pozycjami i wyceną oraz salda w jednej odpowiedzi. Dane pochodzą
+    z modelu odczytu, który wczytuje je stałą liczbą zapytań niezależnie od liczby portfeli.
+    """
+    account = await read_model.get(current_user.id)
+    try:
+        valuations = [await value_assets(list(p.assets.values()), target_currency)
+                      for p in account.portfolios.values()]
+        balances = await value_balances(account.balances, target_currency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    portfolios = []
+    for portfolio, valuation in zip(account.portfolios.values(), valuations):
+        portfolios.append({
+            "id": portfolio.id,
+            "name": portfolio.name,
+            "total_value": valuation["total_value"],
+            "total_cost": valuation["total_cost"],
+            "unrealized_pnl": valuation["unrealized_pnl"],
+            "as_of": valuation["as_of"],
+            "assets": [{
+                "currency_type": asset.currency_type,
+                "buy_price": asset.buy_price,
+                "buy_currency": asset.buy_currency,
+                **priced
+            } for asset, priced in zip(portfolio.assets.values(), valuation["assets"])],
+            "unpriced": valuation["unpriced"],
+        })
+    portfolios_value = sum(p["total_value"] for p in portfolios)
+
+    return {
+        "currency": target_currency,
+        "total_value": portfolios_value + balances["total_value"],
+        "portfolios_value": portfolios_value,
+        "balances_value": balances["total_value"],
+        "portfolios": portfolios,
+        "balances": balances["balances"],
+        "unpriced_balances": balances["unpriced"],
+    }
+
+
 @router.get("/portfolios/{portfolio_id}")
-def get_portfolio_details(
+async def get_portfolio_details(
     portfolio_id: int,
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    portfolio = db.query(Portfolio).filter(
-        Portfolio.id == portfolio_id,
-        Portfolio.user_id == current_user.id
-    ).first()
+    # z modelu odczytu w pamięci, bez zapytań do bazy po pierwszym odczycie
+    portfolio = (await read_model.get(current_user.id)).portfolios.get(portfolio_id)
 
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
-    assets = db.query(PortfolioAsset).filter(
-        PortfolioAsset.portfolio_id == portfolio_id
-    ).all()
+    assets = list(portfolio.assets.values())
 
     return {
         "portfolio": {"id": portfolio.id, "name": portfolio.name},
@@ -61,7 +118,7 @@ def get_portfolio_details(
 async def get_supported_currencies():
     """Zwraca listę walut wspieranych przez Binance"""
     try:
-        currencies = get_binance_supported_currencies()
+        currencies = await get_binance_supported_currencies()
         return currencies
     except Exception as e:
         raise HTTPException(
@@ -71,52 +128,71 @@ async def get_supported_currencies():
 
 
 @router.get("/portfolio/{portfolio_id}/value")
-def get_portfolio_value(
+async def get_portfolio_value(
         portfolio_id: int,
         target_currency: str = "USD",
-        db: Session = Depends(get_db),
         current_user: User = Depends(get_current_user)
 ):
+    """Wycenia portfel po bieżących cenach w walucie docelowej (wartość, koszt i niezrealizowany zysk/strata)"""
+    portfolio = (await read_model.get(current_user.id)).portfolios.get(portfolio_id)
 
-    portfolio = db.query(Portfolio).filter(
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+
+    try:
+        valuation = await value_assets(list(portfolio.assets.values()), target_currency)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"portfolio_id": portfolio_id, **valuation}
+
+
+def _timestamp(value: datetime) -> int:
+    # daty bez strefy czasowej są traktowane jako UTC
+    return int((value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp())
+
+
+@router.get("/portfolio/{portfolio_id}/equity")
+async def get_portfolio_equity(
+        portfolio_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        points: int = 500,
+        db: AsyncSession = Depends(get_async_db),
+        current_user: User = Depends(get_current_user)
+):
+    """Krzywa kapitału portfela z okresowych zrzutów, zredukowana po stronie serwera do `points` punktów"""
+    if not 1 <= points <= settings.EQUITY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points must be between 1 and {settings.EQUITY_MAX_POINTS}")
+
+    portfolio = await db.scalar(select(Portfolio).where(
         Portfolio.id == portfolio_id,
         Portfolio.user_id == current_user.id
-    ).first()
+    ))
 
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
-    assets = db.query(PortfolioAsset).filter(
-        PortfolioAsset.portfolio_id == portfolio_id
-    ).all()
-
-    total_value = sum(
-        asset.amount * asset.buy_price
-        for asset in assets
-    )
+    end_ts = _timestamp(end) if end else int(time.time())
+    start_ts = _timestamp(start) if start else None
+    if start_ts is not None and start_ts > end_ts:
+        raise HTTPException(status_code=400, detail="start must not be after end")
 
     return {
         "portfolio_id": portfolio_id,
-        "total_value": total_value,
-        "currency": target_currency,
-        "assets_count": len(assets)
+        "currency": settings.SNAPSHOT_CURRENCY,
+        "points": await equity_curve(db, portfolio_id, start_ts, end_ts, points)
     }
 
 
 @router.get("/balances")
-def get_all_balances(
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user)
-):
+async def get_all_balances(current_user: User = Depends(get_current_user)):
     """Pobiera wszystkie balanse użytkownika"""
-    balances = db.query(CurrencyBalance).filter(
-        CurrencyBalance.user_id == current_user.id
-    ).all()
+    balances = (await read_model.get(current_user.id)).balances
 
     return [{
-        "currency": balance.currency,
-        "amount": balance.amount
-    } for balance in balances]
+        "currency": currency,
+        "amount": amount
+    } for currency, amount in balances.items()]
 
 
 
@@ -124,17 +200,16 @@ def get_all_balances(
 async def deposit_funds(
         currency: str,
         amount: float,
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
     """Wpłaca środki w określonej walucie z walidacją"""
-    currencies = get_binance_supported_currencies()
-    if currency not in currencies:
+    if not await is_supported_currency(currency):
         raise HTTPException(
             status_code=400,
             detail={
                 "message": "Unsupported currency",
-                "supported_currencies": currencies,
+                "supported_currencies": await get_binance_supported_currencies(),
                 "received_currency": currency
             }
         )
@@ -142,7 +217,9 @@ async def deposit_funds(
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
-    balance = update_user_balance(db, current_user.id, currency, amount)
+    with read_model.writing(current_user.id) as changes:
+        balance = await update_user_balance_async(db, current_user.id, currency, amount)
+        changes.balance(currency, amount)
     return {
         "message": "Funds deposited successfully",
         "currency": currency,
@@ -150,67 +227,85 @@ async def deposit_funds(
     }
 
 
+def _transfer_rate(source_currency: str, target_currency: str, exchange_rate: Optional[float],
+                   graph: ConversionGraph = conversion_graph) -> float:
+    """Kurs transferu z grafu przeliczeń; kurs podany przez klienta służy tylko do kontroli"""
+    rates, times = graph.rates([normalize_currency(source_currency)], normalize_currency(target_currency))
+    rate, priced_at = float(rates[0]), float(times[0])
+    if np.isnan(rate):
+        raise HTTPException(
+            status_code=400,
+            detail=f"No conversion rate from {source_currency} to {target_currency}"
+        )
+    # najstarsza cena na ścieżce przeliczenia - po awarii odświeżania kurs mógłby być dowolnie nieaktualny
+    if time.time() - priced_at > settings.TRANSFER_MAX_RATE_AGE:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Conversion rate from {source_currency} to {target_currency} is out of date, try again later"
+        )
+    if exchange_rate is not None and abs(exchange_rate - rate) > settings.TRANSFER_RATE_TOLERANCE * rate:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Exchange rate {exchange_rate} differs from current rate {rate}"
+        )
+    return rate
+
+
 @router.post("/balances/transfer")
 async def transfer_between_currencies(
         source_currency: str,
         target_currency: str,
         amount: float,
-        exchange_rate: float,
-        db: Session = Depends(get_db),
+        exchange_rate: Optional[float] = None,
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ):
     """Transferuje środki między walutami z walidacją"""
-    currencies = get_binance_supported_currencies()
-
     # Walidacja obu walut
     for currency in [source_currency, target_currency]:
-        if currency.upper() not in currencies:
+        if not await is_supported_currency(currency.upper()):
+            currencies = await get_binance_supported_currencies()
             raise HTTPException(
                 status_code=400,
                 detail=f"Currency {currency} not supported. Valid currencies: {currencies}"
             )
 
-    source_balance = db.query(CurrencyBalance).filter(
-        CurrencyBalance.user_id == current_user.id,
-        CurrencyBalance.currency == source_currency
-    ).first()
-
-    if not source_balance or source_balance.amount < amount:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient funds in {source_currency}"
-        )
-
-    target_balance = db.query(CurrencyBalance).filter(
-        CurrencyBalance.user_id == current_user.id,
-        CurrencyBalance.currency == target_currency
-    ).first()
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
 
-    if not target_balance:
-        target_balance = CurrencyBalance(
-            user_id=current_user.id,
-            currency=target_currency,
-            amount=0.0
-        )
-        db.add(target_balance)
+    rate = _transfer_rate(source_currency, target_currency, exchange_rate)
 
     try:
-        source_balance.amount -= amount
-        target_balance.amount += amount * exchange_rate
-        db.commit()
+        with read_model.writing(current_user.id) as changes:
+            # warunkowe UPDATE jest jednocześnie sprawdzeniem środków
+            if not await debit_balance_async(db, current_user.id, source_currency, amount):
+                await db.rollback()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Insufficient funds in {source_currency}"
+                )
+            await credit_balance_async(db, current_user.id, target_currency, amount * rate)
+            changes.balance(source_currency, -amount)
+            changes.balance(target_currency, amount * rate)
+            await db.commit()
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Transfer failed: {str(e)}"
         )
 
+    source_balance = await get_user_balance_async(db, current_user.id, source_currency)
+    target_balance = await get_user_balance_async(db, current_user.id, target_currency)
+
     return {
         "message": "Transfer completed successfully",
         "source_currency": source_currency,
         "source_new_balance": source_balance.amount,
         "target_currency": target_currency,
         "target_new_balance": target_balance.amount,
-        "exchange_rate": exchange_rate
+        "exchange_rate": rate
     }
 
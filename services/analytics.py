@@ -0,0 +1,378 @@
+"""
+Analityka historii cen: przepróbkowanie świec do dowolnego grubszego interwału
+i wskaźniki (SMA, EMA, VWAP, RSI, wstęgi Bollingera) liczone w NumPy.
+
+Wartości wskaźników dla zamkniętych świec są trzymane w pamięci podręcznej per
+(symbol, interwał bazowy, interwał, wskaźnik z parametrami) i dopisywane przyrostowo,
+gdy pojawią się nowe świece. Bieżąca (otwarta) świeca jest liczona przy każdym zapytaniu.
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import settings
+from services.history_cache import LocalLRU
+from services.history_service import get_history
+from services.kline_store import INTERVAL_MS, KLINE_DTYPE
+
+_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+WEEK_MS = _UNIT_MS["w"]
+# świece tygodniowe Binance zaczynają się w poniedziałek, a 1970-01-01 był czwartkiem
+WEEK_OFFSET_MS = 4 * _UNIT_MS["d"]
+
+
+def parse_interval(interval: str) -> int:
+    """'45m', '2h', '1d', '2w' -> długość w ms."""
+    match = re.fullmatch(r"(\d+)([mhdw])", interval)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid interval: {interval}")
+    return int(match.group(1)) * _UNIT_MS[match.group(2)]
+
+
+def resample(klines: np.ndarray, target_ms: int) -> np.ndarray:
+    """
+    Łączy świece w świece target_ms (pierwszy open, max high, min low, ostatni close, sumy wolumenów).
+    Pierwszy kubełek jest pomijany, jeśli okno zaczyna się w jego środku.
+    """
+    if not len(klines):
+        return klines
+    offset = WEEK_OFFSET_MS if target_ms % WEEK_MS == 0 else 0
+    buckets = (klines["open_time"] - offset) // target_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(klines)] - 1
+
+    out = np.empty(len(starts), dtype=KLINE_DTYPE)
+    out["open_time"] = buckets[starts] * target_ms + offset
+    out["close_time"] = out["open_time"] + target_ms - 1
+    out["open"] = klines["open"][starts]
+    out["close"] = klines["close"][ends]
+    out["high"] = np.maximum.reduceat(klines["high"], starts)
+    out["low"] = np.minimum.reduceat(klines["low"], starts)
+    for field in ("volume", "quote_volume", "trades", "taker_base_volume", "taker_quote_volume"):
+        out[field] = np.add.reduceat(klines[field], starts)
+
+    if out["open_time"][0] != klines["open_time"][0]:
+        out = out[1:]
+    return out
+
+
+def _rolling(values: np.ndarray, period: int) -> np.ndarray:
+    """Okna długości period kończące się na każdej pozycji (pierwsze period-1 pozycji bez okna)."""
+    return sliding_window_view(values, period) if len(values) >= period else np.empty((0, period))
+
+
+def _pad(values: np.ndarray, length: int, columns: int = 1) -> np.ndarray:
+    """Uzupełnia wynik NaN-ami z przodu do długości length (świece bez pełnego okna)."""
+    values = values.reshape(len(values), columns)
+    return np.vstack([np.full((length - len(values), columns), np.nan), values])
+
+
+def _ewm(values: np.ndarray, alpha: float, last: float) -> np.ndarray:
+    """
+    Rekurencja y[i] = y[i-1] + alpha * (x[i] - y[i-1]) z y[-1] = last, bez pętli w Pythonie.
+    Postać zamknięta to skumulowana suma x ważona (1 - alpha)^-i; liczona blokami,
+    aby potęgi nie wyszły poza zakres float.
+    """
+    decay = 1.0 - alpha
+    if decay <= 0:
+        return values.astype(float)
+    out = np.empty(len(values))
+    block = max(1, int(100 / -np.log10(decay)))
+    scale = decay ** -np.arange(1, min(block, len(values)) + 1)
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        weights = scale[:len(chunk)]
+        out[start:start + len(chunk)] = (last + np.cumsum(alpha * chunk * weights)) / weights
+        last = out[start + len(chunk) - 1]
+    return out
+
+
+class Indicator(ABC):
+    """
+    Wskaźnik liczony przyrostowo. compute dostaje `prefix` poprzednich świec (lookback)
+    oraz nowe świece i zwraca wartości tylko dla nowych świec oraz nowy stan.
+    """
+    name = ""
+    columns: Tuple[str, ...] = ("value",)
+
+    def __init__(self, period: int):
+        if period < 1:
+            raise ValueError(f"{self.name}: period must be positive")
+        self.period = period
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.period}"
+
+    @property
+    def lookback(self) -> int:
+        return self.period - 1
+
+    @property
+    def warmup(self) -> int:
+        return self.period
+
+    @abstractmethod
+    def compute(self, candles: np.ndarray, prefix: int, state):
+        ...
+
+
+class SMA(Indicator):
+    name = "sma"
+
+    def compute(self, candles, prefix, state):
+        values = _pad(_rolling(candles["close"], self.period).mean(axis=1), len(candles))
+        return values[prefix:], None
+
+
+class Bollinger(Indicator):
+    name = "bb"
+    columns = ("middle", "upper", "lower")
+
+    def __init__(self, period: int, width: float = 2.0):
+        super().__init__(period)
+        self.width = width
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.period}:{self.width:g}"
+
+    def compute(self, candles, prefix, state):
+        windows = _rolling(candles["close"], self.period)
+        middle = windows.mean(axis=1)
+        band = self.width * windows.std(axis=1)
+        values = _pad(np.column_stack([middle, middle + band, middle - band]), len(candles), 3)
+        return values[prefix:], None
+
+
+class VWAP(Indicator):
+    """Kroczący VWAP z ceny typowej (high + low + close) / 3 ważonej wolumenem."""
+    name = "vwap"
+
+    def compute(self, candles, prefix, state):
+        typical = (candles["high"] + candles["low"] + candles["close"]) / 3
+        volume = _rolling(candles["volume"], self.period).sum(axis=1)
+        weighted = _rolling(typical * candles["volume"], self.period).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.where(volume > 0, weighted / np.where(volume > 0, volume, 1), np.nan)
+        return _pad(values, len(candles))[prefix:], None
+
+
+class EMA(Indicator):
+    """EMA z alfa = 2 / (period + 1), zaczynająca od pierwszego zamknięcia (stan: ostatnia wartość)."""
+    name = "ema"
+    lookback = 0
+
+    @property
+    def warmup(self) -> int:
+        return 3 * self.period
+
+    def compute(self, candles, prefix, state):
+        alpha = 2 / (self.period + 1)
+        if state is None and len(candles):
+            values = _ewm(candles["close"], alpha, candles["close"][0])
+            return values.reshape(-1, 1), float(values[-1])
+        # dopisanie kilku nowych świec do stanu z pamięci podręcznej
+        closes = candles["close"].tolist()
+        values = np.empty(len(closes))
+        last = state
+        for i, close in enumerate(closes):
+            last = close if last is None else last + alpha * (close - last)
+            values[i] = last
+        return values.reshape(-1, 1), last
+
+
+class RSI(Indicator):
+    """RSI Wildera. Stan: (ostatnie zamknięcie, liczba zmian, średni wzrost, średni spadek)."""
+    name = "rsi"
+    lookback = 0
+
+    @property
+    def warmup(self) -> int:
+        return 3 * self.period
+
+    def _full(self, closes: np.ndarray):
+        period = self.period
+        values = np.full(len(closes), np.nan)
+        change = np.diff(closes)
+        gains, losses = change.clip(min=0), (-change).clip(min=0)
+        # pierwsze średnie to zwykłe średnie z `period` zmian, dalej wygładzanie Wildera (alfa = 1 / period)
+        avg_gain, avg_loss = gains[:period].sum() / period, losses[:period].sum() / period
+        if len(change) < period:
+            return values.reshape(-1, 1), (float(closes[-1]), len(change), float(avg_gain), float(avg_loss))
+        avg_gains = np.r_[avg_gain, _ewm(gains[period:], 1 / period, avg_gain)]
+        avg_losses = np.r_[avg_loss, _ewm(losses[period:], 1 / period, avg_loss)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values[period:] = np.where(avg_losses == 0, 100.0, 100 - 100 / (1 + avg_gains / avg_losses))
+        return values.reshape(-1, 1), (float(closes[-1]), len(change), float(avg_gains[-1]), float(avg_losses[-1]))
+
+    def compute(self, candles, prefix, state):
+        if state is None and len(candles):
+            return self._full(candles["close"])
+        # dopisanie kilku nowych świec do stanu z pamięci podręcznej
+        last_close, seen, avg_gain, avg_loss = state or (None, 0, 0.0, 0.0)
+        period = self.period
+        values = np.full(len(candles), np.nan)
+        for i, close in enumerate(candles["close"].tolist()):
+            if last_close is not None:
+                change = close - last_close
+                gain, loss = max(change, 0.0), max(-change, 0.0)
+                seen += 1
+                if seen <= period:
+                    # pierwsze średnie to zwykłe średnie z `period` zmian
+                    avg_gain += gain / period
+                    avg_loss += loss / period
+                else:
+                    avg_gain = (avg_gain * (period - 1) + gain) / period
+                    avg_loss = (avg_loss * (period - 1) + loss) / period
+                if seen >= period:
+                    values[i] = 100.0 if avg_loss == 0 else 100 - 100 / (1 + avg_gain / avg_loss)
+            last_close = close
+        return values.reshape(-1, 1), (last_close, seen, avg_gain, avg_loss)
+
+
+INDICATORS = {"sma": SMA, "ema": EMA, "rsi": RSI, "bb": Bollinger, "vwap": VWAP}
+DEFAULT_PERIODS = {"sma": 20, "ema": 20, "rsi": 14, "bb": 20, "vwap": 20}
+
+
+def parse_indicator(spec: str) -> Indicator:
+    """'sma:20', 'ema:50', 'rsi:14', 'bb:20:2', 'vwap:20' (okres można pominąć)."""
+    name, *params = spec.strip().lower().split(":")
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator: {name}")
+    try:
+        period = int(params[0]) if params else DEFAULT_PERIODS[name]
+        if name == "bb":
+            return Bollinger(period, float(params[1]) if len(params) > 1 else 2.0)
+        if len(params) > 1:
+            raise ValueError(f"Too many parameters for {name}")
+        return INDICATORS[name](period)
+    except (IndexError, TypeError) as e:
+        raise ValueError(f"Invalid indicator: {spec}") from e
+
+
+class _IndicatorSeries:
+    """Wartości wskaźnika dla kolejnych zamkniętych świec open_times i stan po ostatniej z nich."""
+
+    def __init__(self, open_times: np.ndarray, values: np.ndarray, state):
+        self.open_times = open_times
+        self.values = values
+        self.state = state
+
+
+class AnalyticsStats:
+    def __init__(self):
+        self.full = 0
+        self.incremental = 0
+        self.cached = 0
+
+    def as_dict(self) -> dict:
+        return {"full": self.full, "incremental": self.incremental, "cached": self.cached}
+
+
+class IndicatorCache:
+    def __init__(self, max_entries: int = settings.ANALYTICS_CACHE_SIZE, ttl: float = settings.ANALYTICS_CACHE_TTL):
+        self.series = LocalLRU(max_entries, ttl)
+        self.stats = AnalyticsStats()
+
+    def _reusable(self, entry: Optional[_IndicatorSeries], indicator: Indicator, times: np.ndarray) -> bool:
+        """Seria z pamięci pasuje, jeśli zaczyna się nie później niż okno i kończy się w nim."""
+        if entry is None or not entry.open_times[0] <= times[0] <= entry.open_times[-1] <= times[-1]:
+            return False
+        skip = int(np.searchsorted(entry.open_times, times[0]))
+        start = int(np.searchsorted(times, entry.open_times[-1], "right"))
+        # ta sama siatka świec i dość poprzednich świec dla wskaźników okienkowych
+        return entry.open_times[skip] == times[0] and (start >= indicator.lookback or start == len(times))
+
+    def values(self, key: tuple, indicator: Indicator, closed: np.ndarray, open_candles: np.ndarray) -> np.ndarray:
+        """Zwraca wartości wskaźnika dla closed + open_candles, licząc tylko nowe zamknięte świece."""
+        if not len(closed):
+            values, _ = indicator.compute(open_candles, 0, None)
+            return values
+
+        times = closed["open_time"]
+        entry: Optional[_IndicatorSeries] = self.series.get(key)
+        if not self._reusable(entry, indicator, times):
+            values, state = indicator.compute(closed, 0, None)
+            entry = _IndicatorSeries(times, values, state)
+            self.stats.full += 1
+        else:
+            # świece sprzed początku okna są odrzucane; stan (EMA, RSI) liczony od wcześniejszego początku zostaje
+            skip = int(np.searchsorted(entry.open_times, times[0]))
+            start = int(np.searchsorted(times, entry.open_times[-1], "right"))
+            values, state = entry.values[skip:], entry.state
+            if start < len(times):
+                prefix = min(indicator.lookback, start)
+                new_values, state = indicator.compute(closed[start - prefix:], prefix, state)
+                values = np.vstack([values, new_values])
+                self.stats.incremental += 1
+            else:
+                self.stats.cached += 1
+            entry = _IndicatorSeries(times, values, state)
+        self.series.set(key, entry)
+
+        if not len(open_candles):
+            return entry.values
+        prefix = min(indicator.lookback, len(closed))
+        candles = np.concatenate([closed[len(closed) - prefix:], open_candles])
+        open_values, _ = indicator.compute(candles, prefix, entry.state)
+        return np.vstack([entry.values, open_values])
+
+
+indicator_cache = IndicatorCache()
+
+
+def choose_base_interval(target_ms: int, candles_needed: int, base_interval: Optional[str] = None) -> str:
+    """
+    Interwał bazowy do przepróbkowania: podany przez klienta albo ANALYTICS_BASE_INTERVAL
+    (jedno okno historii wspólne dla wielu interwałów), jeśli dzieli docelowy interwał i okno nie będzie
+    zbyt duże; w przeciwnym razie najdłuższy standardowy interwał Binance dzielący docelowy.
+    """
+    if base_interval is not None:
+        if base_interval not in INTERVAL_MS or target_ms % INTERVAL_MS[base_interval]:
+            raise ValueError(f"Base interval {base_interval} does not divide the requested interval")
+        return base_interval
+    preferred = settings.ANALYTICS_BASE_INTERVAL
+    preferred_ms = INTERVAL_MS[preferred]
+    if target_ms % preferred_ms == 0 and candles_needed * (target_ms // preferred_ms) <= settings.KLINE_MAX_GAP:
+        return preferred
+    divisors = [name for name, ms in INTERVAL_MS.items() if target_ms % ms == 0]
+    if not divisors:
+        raise ValueError("Interval must be a multiple of 1m")
+    return max(divisors, key=INTERVAL_MS.get)
+
+
+def _column(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+async def get_analytics(symbol: str, interval: str, limit: int, indicator_specs: List[str],
+                        base_interval: Optional[str] = None, cache: IndicatorCache = indicator_cache) -> Dict:
+    target_ms = parse_interval(interval)
+    indicators = [parse_indicator(spec) for spec in indicator_specs]
+    warmup = max((indicator.warmup for indicator in indicators), default=0)
+    base = choose_base_interval(target_ms, limit + warmup + 1, base_interval)
+    ratio = target_ms // INTERVAL_MS[base]
+
+    klines = await get_history(symbol, base, (limit + warmup + 1) * ratio)
+    candles = resample(klines, target_ms) if ratio > 1 else klines
+    # ostatnia świeca (kubełek) zawiera bieżącą świecę bazową, więc nie jest jeszcze zamknięta
+    closed, open_candles = candles[:-1], candles[-1:]
+
+    shown = candles[-limit:]
+    result = {
+        "symbol": symbol,
+        "interval": interval,
+        "base_interval": base,
+        "candles": {field: shown[field].tolist() for field in ("open_time", "open", "high", "low", "close", "volume")},
+        "indicators": {},
+    }
+    for indicator in indicators:
+        values = cache.values((symbol, base, interval, indicator.key), indicator, closed, open_candles)[-limit:]
+        result["indicators"][indicator.key] = {
+            column: _column(values[:, i]) for i, column in enumerate(indicator.columns)
+        }
+    return result
@@ -0,0 +1,48 @@
+"""
+Zadanie w tle usług z metodami start/stop (pętle odświeżania, strumień cen, zrzuty portfeli).
+"""
+import asyncio
+from typing import Any, Callable, Coroutine, Optional
+
+from services.logger import logger
+
+
+class BackgroundTask:
+    """
+    Jedno zadanie asyncio uruchamiane przez start() i anulowane przez stop().
+    Wyjątek, który zakończył zadanie (inny niż anulowanie), jest logowany od razu po jego zakończeniu,
+    a nie połykany przy zatrzymaniu usługi.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, function: Callable[..., Coroutine[Any, Any, Any]], *args):
+        """Uruchamia function(*args), jeśli zadanie jeszcze nie działa (także gdy poprzednie się zakończyło)."""
+        if not self.running:
+            self._task = asyncio.create_task(function(*args), name=self.name)
+            self._task.add_done_callback(self._report)
+
+    def _report(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background task {self.name} failed: {str(task.exception())}",
+                         exc_info=task.exception())
+
+    async def stop(self):
+        """Anuluje zadanie i czeka na jego zakończenie."""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # już zalogowany przez _report
+            pass
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Optional
+
+from binance import AsyncClient, BinanceSocketManager
+
+from config import settings
+
+_client: Optional[AsyncClient] = None
+_lock: Optional[asyncio.Lock] = None
+
+
+async def get_async_client() -> AsyncClient:
+    """Zwraca współdzielonego, długo żyjącego klienta AsyncClient (jedna sesja HTTP na proces)."""
+    global _client, _lock
+    if _client is not None:
+        return _client
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        if _client is None:
+            if settings.BINANCE_API_URL:
+                # własny serwer (testy, symulator): bez ping i synchronizacji czasu z Binance
+                _client = AsyncClient()
+                _client.API_URL = settings.BINANCE_API_URL
+            else:
+                _client = await AsyncClient.create()
+    return _client
+
+
+async def close_async_client():
+    """Zamyka współdzielonego klienta (przy zamykaniu aplikacji)."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.close_connection()
+
+
+def socket_manager(client: AsyncClient) -> BinanceSocketManager:
+    """BinanceSocketManager dla klienta, z adresem strumieni z BINANCE_STREAM_URL, jeśli ustawiony."""
+    bsm = BinanceSocketManager(client)
+    if settings.BINANCE_STREAM_URL:
+        bsm.STREAM_URL = settings.BINANCE_STREAM_URL
+    return bsm
@@ -1,29 +1,39 @@
-from binance.client import Client
-from binance import AsyncClient
+from typing import Optional, Tuple
 
-def get_binance_supported_currencies():
-    client = Client()
+from services.exchange_info import exchange_info
+from services.price_feed import price_feed
+
+async def get_binance_supported_currencies():
+    """Zwraca posortowaną listę walut z pamięci podręcznej exchangeInfo"""
     try:
-        # pobiera wszystkie pary handlowe z binance
-        exchange_info = client.get_exchange_info()
-        symbols = exchange_info['symbols']
+        return (await exchange_info.get()).sorted_currencies
+    except Exception as e:
+        print(f"Error fetching currencies from Binance: {e}")
+        return []
 
-        currencies = set()
-        for symbol in symbols:
-            currencies.add(symbol['baseAsset'])
-            currencies.add(symbol['quoteAsset'])
 
-        return sorted(list(currencies))
+async def is_supported_currency(currency: str) -> bool:
+    """Sprawdza w O(1), czy waluta występuje w którejś parze handlowej Binance"""
+    try:
+        return currency in (await exchange_info.get()).currencies
     except Exception as e:
         print(f"Error fetching currencies from Binance: {e}")
-        return []
+        return False
 
-async def get_current_market_price(symbol: str):
-    """Pobiera aktualną cenę rynkową z Binance"""
 
-    client = await AsyncClient.create()
+async def get_symbol_assets(symbol: str) -> Optional[Tuple[str, str]]:
+    """Zwraca (waluta bazowa, waluta kwotowana) pary handlowej albo None dla nieznanego symbolu"""
     try:
-        ticker = await client.get_symbol_ticker(symbol=symbol)
-        return float(ticker['price'])
-    finally:
-        await client.close_connection()
\ No newline at end of file
+        return (await exchange_info.get()).symbols.get(symbol)
+    except Exception as e:
+        print(f"Error fetching symbols from Binance: {e}")
+        return None
+
+async def get_current_market_price(symbol: str):
+    """Pobiera aktualną cenę rynkową ze współdzielonej tabeli cen (REST tylko dla nieaktualnych)"""
+    return await price_feed.get_price(symbol)
+
+
+async def get_market_prices(symbols):
+    """Pobiera ceny wielu symboli naraz (jedno zbiorcze zapytanie dla nieaktualnych cen)"""
+    return await price_feed.get_prices(symbols)
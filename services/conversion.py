@@ -0,0 +1,244 @@
+"""
+Graf przeliczeń walut: waluty to wierzchołki, pary handlowe Binance - krawędzie.
+
+Po każdej zmianie exchangeInfo dla każdej pary walut wyznaczana jest najlepsza ścieżka
+(najmniej przeliczeń; przy remisie przez waluty z największą liczbą par, np. PLN -> USDT -> ETH).
+Kursy trzymane są w macierzy N x N, a zmiana ceny pary przelicza tylko te pola
+macierzy, których ścieżka przechodzi przez tę parę. Odczyt kursu to O(1) bez zapytań do sieci.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from services.background import BackgroundTask
+from services.exchange_info import ExchangeInfo, ExchangeInfoCache, exchange_info
+from services.logger import logger
+from services.price_feed import price_feed
+from services.upstream import Priority, TICKER_ALL_WEIGHT, upstream
+
+
+async def fetch_all_prices() -> Dict[str, float]:
+    """Ceny wszystkich par jednym zapytaniem ticker/price."""
+    tickers = await upstream.call("get_symbol_ticker", TICKER_ALL_WEIGHT, Priority.NORMAL)
+    return {ticker["symbol"]: float(ticker["price"]) for ticker in tickers}
+
+
+class ConversionGraph:
+    def __init__(self, fetch_prices: Optional[Callable[[], Awaitable[Dict[str, float]]]] = None,
+                 info_cache: ExchangeInfoCache = exchange_info,
+                 refresh_interval: float = settings.CONVERSION_PRICE_REFRESH, max_hops: int = 4):
+        self.fetch_prices = fetch_prices or fetch_all_prices
+        self.info_cache = info_cache
+        self.refresh_interval = refresh_interval
+        self.max_hops = max_hops
+        self.info: Optional[ExchangeInfo] = None
+        self.currencies: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.pairs: List[str] = []
+        self.pair_index: Dict[str, int] = {}
+        # cena i czas ceny każdej pary; ostatni element to krok pusty (kurs 1)
+        self.prices = np.ones(1)
+        self.price_times = np.full(1, np.inf)
+        self.rates_matrix = np.zeros((0, 0))
+        self.upstream_calls = 0
+        self._path_pairs = np.zeros((0, 0), dtype=np.int32)  # (N*N, H) indeksy par ścieżki
+        self._path_signs = np.zeros((0, 0), dtype=np.int8)  # +1 baza -> kwotowana, -1 odwrotnie
+        self._affected: Dict[int, np.ndarray] = {}  # para -> pola macierzy, których ścieżka przez nią biegnie
+        self._task = BackgroundTask("conversion graph refresh")
+
+    def __len__(self):
+        return len(self.currencies)
+
+    def _shortest_paths(self, adjacency: List[List[Tuple[int, int, int]]], empty: int) -> Tuple[np.ndarray, np.ndarray]:
+        """BFS z każdej waluty; sąsiedzi uporządkowani od walut z największą liczbą par."""
+        n, hops = len(adjacency), self.max_hops
+        # poprzednik na najkrótszej ścieżce source -> target i para, która do niego prowadzi
+        parents = np.full((n, n), -1, dtype=np.int32)
+        edges = np.full((n, n), empty, dtype=np.int32)
+        edge_signs = np.zeros((n, n), dtype=np.int8)
+        depths = np.full((n, n), -1, dtype=np.int8)
+        for source in range(n):
+            parent, edge, sign_of, depth = [-1] * n, [empty] * n, [0] * n, [-1] * n
+            depth[source] = 0
+            frontier = [source]
+            for level in range(1, hops + 1):
+                reached = []
+                for node in frontier:
+                    for neighbour, pair, sign in adjacency[node]:
+                        if depth[neighbour] < 0:
+                            depth[neighbour] = level
+                            parent[neighbour], edge[neighbour], sign_of[neighbour] = node, pair, sign
+                            reached.append(neighbour)
+                if not reached:
+                    break
+                frontier = reached
+            parents[source], edges[source], edge_signs[source], depths[source] = parent, edge, sign_of, depth
+
+        # ścieżka do celu = ścieżka do poprzednika + jedna para; poziomami, od najkrótszych
+        pairs = np.full((n, n, hops), empty, dtype=np.int32)
+        signs = np.zeros((n, n, hops), dtype=np.int8)
+        for level in range(1, hops + 1):
+            sources, targets = np.nonzero(depths == level)
+            if not len(sources):
+                break
+            previous = parents[sources, targets]
+            pairs[sources, targets, :level - 1] = pairs[sources, previous, :level - 1]
+            signs[sources, targets, :level - 1] = signs[sources, previous, :level - 1]
+            pairs[sources, targets, level - 1] = edges[sources, targets]
+            signs[sources, targets, level - 1] = edge_signs[sources, targets]
+        return pairs.reshape(n * n, hops), signs.reshape(n * n, hops)
+
+    def _build(self, info: ExchangeInfo) -> tuple:
+        """Waluty, pary i ścieżki dla exchangeInfo; nie zmienia stanu grafu, więc może działać w wątku."""
+        degree: Dict[str, int] = {}
+        for base, quote in info.symbols.values():
+            degree[base] = degree.get(base, 0) + 1
+            degree[quote] = degree.get(quote, 0) + 1
+        currencies = sorted(degree, key=lambda currency: (-degree[currency], currency))
+        index = {currency: i for i, currency in enumerate(currencies)}
+        pairs = sorted(info.symbols)
+
+        adjacency: List[List[Tuple[int, int, int]]] = [[] for _ in currencies]
+        for i, pair in enumerate(pairs):
+            base, quote = (index[c] for c in info.symbols[pair])
+            adjacency[base].append((quote, i, 1))
+            adjacency[quote].append((base, i, -1))
+        for neighbours in adjacency:
+            neighbours.sort(key=lambda edge: edge[0])
+        path_pairs, path_signs = self._shortest_paths(adjacency, len(pairs))
+
+        # pola macierzy pogrupowane po parach; w ścieżce para występuje najwyżej raz, więc bez powtórzeń
+        used = path_signs != 0
+        cells = np.nonzero(used)[0]
+        edges = path_pairs[used]
+        order = np.argsort(edges, kind="stable")
+        bounds = np.searchsorted(edges[order], np.arange(len(pairs) + 1))
+        affected = {pair: cells[order[bounds[pair]:bounds[pair + 1]]]
+                    for pair in range(len(pairs)) if bounds[pair] < bounds[pair + 1]}
+        return currencies, index, pairs, path_pairs, path_signs, affected
+
+    def _apply(self, info: ExchangeInfo, built: tuple):
+        previous = {pair: (self.prices[i], self.price_times[i]) for pair, i in self.pair_index.items()}
+        self.info = info
+        self.currencies, self.index, self.pairs, self._path_pairs, self._path_signs, self._affected = built
+        self.pair_index = {pair: i for i, pair in enumerate(self.pairs)}
+
+        self.prices = np.append(np.full(len(self.pairs), np.nan), 1.0)
+        self.price_times = np.append(np.full(len(self.pairs), np.nan), np.inf)
+        for pair, (price, at) in previous.items():
+            if pair in self.pair_index:
+                self.prices[self.pair_index[pair]] = price
+                self.price_times[self.pair_index[pair]] = at
+        self._recompute(np.arange(len(self.currencies) ** 2))
+
+    def rebuild(self, info: ExchangeInfo):
+        """Buduje graf i ścieżki od nowa; znane ceny par, które nadal istnieją, są zachowywane."""
+        self._apply(info, self._build(info))
+
+    def _recompute(self, cells: np.ndarray):
+        n = len(self.currencies)
+        if self.rates_matrix.shape != (n, n):
+            self.rates_matrix = np.full((n, n), np.nan)
+        hops = self._path_pairs[cells]
+        # iloczyn, nie suma logarytmów: kurs bezpośredniej pary jest dokładnie jej ceną
+        rates = np.prod(self.prices[hops] ** self._path_signs[cells], axis=1)
+        # bez ścieżki (poza przekątną) kursu nie ma
+        rates[(self._path_signs[cells] == 0).all(axis=1) & (cells // max(n, 1) != cells % max(n, 1))] = np.nan
+        self.rates_matrix.flat[cells] = rates
+
+    def update(self, symbol: str, price: float, timestamp: Optional[float] = None):
+        """Nowa cena pary: przelicza tylko kursy, których ścieżka przez nią przechodzi."""
+        pair = self.pair_index.get(symbol)
+        if pair is None or price <= 0:
+            return
+        self.prices[pair] = price
+        self.price_times[pair] = timestamp if timestamp is not None else time.time()
+        cells = self._affected.get(pair)
+        if cells is not None:
+            self._recompute(cells)
+
+    def update_many(self, prices: Dict[str, float], timestamp: Optional[float] = None):
+        """
+        Ceny wielu par z jednego pobrania; timestamp to chwila, z której pochodzą.
+        Pary, które mają nowszą cenę (np. ze strumienia), zostają przy niej - starsza cena
+        nie może dostać świeższego znacznika czasu.
+        """
+        at = timestamp if timestamp is not None else time.time()
+        known = [(self.pair_index[s], p) for s, p in prices.items() if s in self.pair_index and p > 0]
+        known = [(i, p) for i, p in known if not self.price_times[i] > at]
+        if not known:
+            return
+        indices, values = zip(*known)
+        self.prices[list(indices)] = values
+        self.price_times[list(indices)] = at
+        self._recompute(np.arange(len(self.currencies) ** 2))
+
+    def rate(self, source: str, target: str) -> Optional[float]:
+        """Ile jednostek target za jedną jednostkę source (None bez ścieżki lub bez cen)."""
+        i, j = self.index.get(source), self.index.get(target)
+        if i is None or j is None:
+            return 1.0 if source == target else None
+        rate = self.rates_matrix[i, j]
+        return None if np.isnan(rate) else float(rate)
+
+    def rates(self, sources: List[str], target: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Kursy wielu walut na target naraz oraz czas najstarszej ceny na każdej ścieżce (NaN bez kursu)."""
+        n = len(self.currencies)
+        j = self.index.get(target)
+        positions = np.array([self.index.get(s, -1) for s in sources], dtype=np.intp)
+        known = (positions >= 0) & (j is not None)
+        rates = np.full(len(sources), np.nan)
+        times = np.full(len(sources), np.nan)
+        if known.any():
+            cells = positions[known] * n + j
+            rates[known] = self.rates_matrix.flat[cells]
+            times[known] = self.price_times[self._path_pairs[cells]].min(axis=1)
+        same = np.array([s == target for s in sources], dtype=bool)
+        rates[same], times[same] = 1.0, np.inf
+        return rates, times
+
+    def path(self, source: str, target: str) -> Optional[List[str]]:
+        """Pary na ścieżce przeliczenia source -> target."""
+        i, j = self.index.get(source), self.index.get(target)
+        if i is None or j is None:
+            return [] if source == target else None
+        cell = i * len(self.currencies) + j
+        pairs = [self.pairs[p] for p, sign in zip(self._path_pairs[cell], self._path_signs[cell]) if sign]
+        return pairs if pairs or i == j else None
+
+    async def refresh(self) -> bool:
+        """Przebudowuje graf po zmianie exchangeInfo i odświeża ceny wszystkich par jednym zapytaniem."""
+        try:
+            info = await self.info_cache.get()
+            if info is not self.info:
+                # BFS ze wszystkich walut to kilkaset ms dla pełnej listy par Binance - poza pętlą zdarzeń
+                self._apply(info, await asyncio.to_thread(self._build, info))
+            self.upstream_calls += 1
+            # ceny są stemplowane chwilą wysłania zapytania, a nie jego przetworzenia
+            requested_at = time.time()
+            self.update_many(await self.fetch_prices(), timestamp=requested_at)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to refresh conversion rates: {str(e)}", exc_info=True)
+            return False
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def start(self):
+        """Buduje graf, pobiera ceny i nasłuchuje zmian cen ze strumienia."""
+        await self.refresh()
+        price_feed.add_listener(self.update)
+        self._task.start(self._refresh_loop)
+
+    async def stop(self):
+        price_feed.remove_listener(self.update)
+        await self._task.stop()
+
+
+conversion_graph = ConversionGraph()
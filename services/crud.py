@@ -1,6 +1,12 @@
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
-from models.user import User, CurrencyBalance
+from models.user import User, CurrencyBalance, PortfolioAsset
+
+# pozycje mniejsze od tej wartości są traktowane jako zamknięte
+POSITION_DUST = 0.000001
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -45,12 +51,243 @@ def create_user_balance(db: Session, user_id: int, currency: str, initial_amount
     return balance
 
 
+# Zapytania wspólne dla wersji synchronicznej i asynchronicznej
+
+# backendy z INSERT ... ON CONFLICT DO UPDATE; pozostałe dostają UPDATE, a przy braku wiersza INSERT
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _upsert_insert(db):
+    """insert dialektu sesji z on_conflict_do_update albo None, gdy backend go nie obsługuje."""
+    return _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+
+
+def _balance_change_stmt(user_id: int, currency: str, amount_change: float):
+    return (
+        update(CurrencyBalance)
+        .where(CurrencyBalance.user_id == user_id, CurrencyBalance.currency == currency)
+        .values(amount=CurrencyBalance.amount + amount_change)
+    )
+
+
+def _balance_upsert_stmt(insert, user_id: int, currency: str, amount_change: float):
+    # jeden INSERT ... ON CONFLICT DO UPDATE: brak okna między UPDATE a INSERT,
+    # w którym równoległe pierwsze zasilenie salda kończyło się IntegrityError
+    return (
+        insert(CurrencyBalance)
+        .values(user_id=user_id, currency=currency, amount=amount_change)
+        .on_conflict_do_update(
+            index_elements=[CurrencyBalance.user_id, CurrencyBalance.currency],
+            set_={"amount": CurrencyBalance.amount + amount_change}
+        )
+    )
+
+
+def _updated_balance_stmt(insert, user_id: int, currency: str, amount_change: float):
+    # populate_existing: saldo wczytane wcześniej w tej sesji dostaje wartość z RETURNING
+    return (
+        _balance_upsert_stmt(insert, user_id, currency, amount_change)
+        .returning(CurrencyBalance)
+        .execution_options(populate_existing=True)
+    )
+
+
+def _debit_stmt(user_id: int, currency: str, amount: float):
+    return (
+        update(CurrencyBalance)
+        .where(
+            CurrencyBalance.user_id == user_id,
+            CurrencyBalance.currency == currency,
+            CurrencyBalance.amount >= amount
+        )
+        .values(amount=CurrencyBalance.amount - amount)
+    )
+
+
+def _add_position_stmt(portfolio_id: int, symbol: str, amount: float, price: float):
+    return (
+        update(PortfolioAsset)
+        .where(PortfolioAsset.portfolio_id == portfolio_id, PortfolioAsset.symbol == symbol)
+        .values(
+            buy_price=(PortfolioAsset.amount * PortfolioAsset.buy_price + amount * price)
+            / (PortfolioAsset.amount + amount),
+            amount=PortfolioAsset.amount + amount
+        )
+    )
+
+
+def _new_position(portfolio_id: int, symbol: str, amount: float, price: float, buy_currency: str,
+                  currency_type: str):
+    return PortfolioAsset(
+        portfolio_id=portfolio_id,
+        symbol=symbol,
+        currency_type=currency_type,
+        amount=amount,
+        buy_price=price,
+        buy_currency=buy_currency
+    )
+
+
+def _add_position_upsert_stmt(insert, portfolio_id: int, symbol: str, amount: float, price: float,
+                              buy_currency: str, currency_type: str):
+    return (
+        insert(PortfolioAsset)
+        .values(portfolio_id=portfolio_id, symbol=symbol, currency_type=currency_type, amount=amount,
+                buy_price=price, buy_currency=buy_currency)
+        .on_conflict_do_update(
+            index_elements=[PortfolioAsset.portfolio_id, PortfolioAsset.symbol],
+            set_={
+                "buy_price": (PortfolioAsset.amount * PortfolioAsset.buy_price + amount * price)
+                / (PortfolioAsset.amount + amount),
+                "amount": PortfolioAsset.amount + amount
+            }
+        )
+    )
+
+
+def _reduce_position_stmt(portfolio_id: int, symbol: str, amount: float):
+    return (
+        update(PortfolioAsset)
+        .where(
+            PortfolioAsset.portfolio_id == portfolio_id,
+            PortfolioAsset.symbol == symbol,
+            PortfolioAsset.amount >= amount
+        )
+        .values(amount=PortfolioAsset.amount - amount)
+    )
+
+
+def _close_position_stmt(portfolio_id: int, symbol: str):
+    return (
+        delete(PortfolioAsset)
+        .where(
+            PortfolioAsset.portfolio_id == portfolio_id,
+            PortfolioAsset.symbol == symbol,
+            PortfolioAsset.amount <= POSITION_DUST
+        )
+    )
+
+
 def update_user_balance(db: Session, user_id: int, currency: str, amount_change: float):
-    balance = get_user_balance(db, user_id, currency)
-    if not balance:
-        balance = create_user_balance(db, user_id, currency)
+    insert = _upsert_insert(db)
+    if insert is None:
+        credit_balance(db, user_id, currency, amount_change)
+        db.commit()
+        return get_user_balance(db, user_id, currency)
 
-    balance.amount += amount_change
+    balance = db.execute(_updated_balance_stmt(insert, user_id, currency, amount_change)).scalar_one()
     db.commit()
-    db.refresh(balance)
-    return balance
\ No newline at end of file
+    return balance
+
+
+def debit_balance(db: Session, user_id: int, currency: str, amount: float) -> bool:
+    """
+    Odejmuje środki jednym warunkowym UPDATE (tylko gdy saldo >= amount).
+    Zwraca False, gdy środków nie wystarcza. Nie zatwierdza transakcji.
+    """
+    return db.execute(_debit_stmt(user_id, currency, amount)).rowcount > 0
+
+
+def credit_balance(db: Session, user_id: int, currency: str, amount: float):
+    """Dodaje środki do salda (tworzy saldo, jeśli nie istnieje). Nie zatwierdza transakcji."""
+    insert = _upsert_insert(db)
+    if insert is not None:
+        db.execute(_balance_upsert_stmt(insert, user_id, currency, amount))
+    elif db.execute(_balance_change_stmt(user_id, currency, amount)).rowcount == 0:
+        db.add(CurrencyBalance(user_id=user_id, currency=currency, amount=amount))
+        db.flush()
+
+
+def add_position(db: Session, portfolio_id: int, symbol: str, amount: float, price: float, buy_currency: str,
+                 currency_type: str = "crypto"):
+    """
+    Zwiększa pozycję w portfelu i przelicza średnią cenę zakupu w jednym upsercie
+    (tworzy pozycję, jeśli nie istnieje). Nie zatwierdza transakcji.
+    """
+    insert = _upsert_insert(db)
+    if insert is not None:
+        db.execute(_add_position_upsert_stmt(insert, portfolio_id, symbol, amount, price, buy_currency,
+                                             currency_type))
+    elif db.execute(_add_position_stmt(portfolio_id, symbol, amount, price)).rowcount == 0:
+        db.add(_new_position(portfolio_id, symbol, amount, price, buy_currency, currency_type))
+        db.flush()
+
+
+def reduce_position(db: Session, portfolio_id: int, symbol: str, amount: float) -> bool:
+    """
+    Zmniejsza pozycję jednym warunkowym UPDATE (tylko gdy pozycja >= amount) i usuwa ją,
+    jeśli została zamknięta. Zwraca False, gdy aktywów nie wystarcza. Nie zatwierdza transakcji.
+    """
+    if db.execute(_reduce_position_stmt(portfolio_id, symbol, amount)).rowcount == 0:
+        return False
+    db.execute(_close_position_stmt(portfolio_id, symbol))
+    return True
+
+
+# Wersje asynchroniczne (AsyncSession) dla handlerów async i silnika zleceń
+
+async def get_user_balance_async(db: AsyncSession, user_id: int, currency: str):
+    result = await db.execute(select(CurrencyBalance).where(
+        CurrencyBalance.user_id == user_id,
+        CurrencyBalance.currency == currency
+    ))
+    return result.scalars().first()
+
+
+async def create_user_balance_async(db: AsyncSession, user_id: int, currency: str, initial_amount: float = 0.0):
+    balance = CurrencyBalance(
+        user_id=user_id,
+        currency=currency,
+        amount=initial_amount
+    )
+    db.add(balance)
+    await db.commit()
+    await db.refresh(balance)
+    return balance
+
+
+async def update_user_balance_async(db: AsyncSession, user_id: int, currency: str, amount_change: float):
+    insert = _upsert_insert(db)
+    if insert is None:
+        await credit_balance_async(db, user_id, currency, amount_change)
+        await db.commit()
+        return await get_user_balance_async(db, user_id, currency)
+
+    balance = (await db.execute(_updated_balance_stmt(insert, user_id, currency, amount_change))).scalar_one()
+    await db.commit()
+    return balance
+
+
+async def debit_balance_async(db: AsyncSession, user_id: int, currency: str, amount: float) -> bool:
+    """Asynchroniczna wersja debit_balance."""
+    return (await db.execute(_debit_stmt(user_id, currency, amount))).rowcount > 0
+
+
+async def credit_balance_async(db: AsyncSession, user_id: int, currency: str, amount: float):
+    """Asynchroniczna wersja credit_balance."""
+    insert = _upsert_insert(db)
+    if insert is not None:
+        await db.execute(_balance_upsert_stmt(insert, user_id, currency, amount))
+    elif (await db.execute(_balance_change_stmt(user_id, currency, amount))).rowcount == 0:
+        db.add(CurrencyBalance(user_id=user_id, currency=currency, amount=amount))
+        await db.flush()
+
+
+async def add_position_async(db: AsyncSession, portfolio_id: int, symbol: str, amount: float, price: float,
+                             buy_currency: str, currency_type: str = "crypto"):
+    """Asynchroniczna wersja add_position."""
+    insert = _upsert_insert(db)
+    if insert is not None:
+        await db.execute(_add_position_upsert_stmt(insert, portfolio_id, symbol, amount, price, buy_currency,
+                                                   currency_type))
+    elif (await db.execute(_add_position_stmt(portfolio_id, symbol, amount, price))).rowcount == 0:
+        db.add(_new_position(portfolio_id, symbol, amount, price, buy_currency, currency_type))
+        await db.flush()
+
+
+async def reduce_position_async(db: AsyncSession, portfolio_id: int, symbol: str, amount: float) -> bool:
+    """Asynchroniczna wersja reduce_position."""
+    if (await db.execute(_reduce_position_stmt(portfolio_id, symbol, amount))).rowcount == 0:
+        return False
+    await db.execute(_close_position_stmt(portfolio_id, symbol))
+    return True
@@ -1,10 +1,10 @@
 
-from sqlalchemy.orm import sessionmaker
-from models.user import Base, engine, SessionLocal
+from models.user import engine, SessionLocal, AsyncSessionLocal
+from services.migrations import migrate
 
 def init_db():
-    """Inicjalizuje bazę danych i tworzy tabele"""
-    Base.metadata.create_all(bind=engine)
+    """Inicjalizuje bazę danych: tworzy tabele i stosuje brakujące migracje"""
+    return migrate(engine)
 
 def get_db():
     """
@@ -16,4 +16,9 @@ def get_db():
     finally:
         db.close()
 
-init_db()
\ No newline at end of file
+async def get_async_db():
+    """
+    Dependency to provide an async database session (for async def handlers).
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
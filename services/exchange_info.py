@@ -0,0 +1,96 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from config import settings
+from services.background import BackgroundTask
+from services.logger import logger
+from services.upstream import EXCHANGE_INFO_WEIGHT, Priority, upstream
+
+TRADING = "TRADING"
+
+
+async def fetch_binance_exchange_info() -> dict:
+    return await upstream.call("get_exchange_info", EXCHANGE_INFO_WEIGHT, Priority.NORMAL)
+
+
+class ExchangeInfo:
+    """Niezmienny zrzut metadanych giełdy z indeksami do wyszukiwania w O(1)."""
+
+    def __init__(self, payload: dict, fetched_at: Optional[float] = None):
+        # tylko pary w handlu: pary wstrzymane (BREAK) i wycofane mają nieaktualne ostatnie ceny
+        self.symbols: Dict[str, Tuple[str, str]] = {
+            s['symbol']: (s['baseAsset'], s['quoteAsset']) for s in payload['symbols']
+            if s.get('status', TRADING) == TRADING
+        }
+        self.currencies: FrozenSet[str] = frozenset(
+            asset for pair in self.symbols.values() for asset in pair
+        )
+        self.sorted_currencies: List[str] = sorted(self.currencies)
+        # (waluta bazowa, waluta kwotowana) -> para handlowa
+        self.pairs: Dict[Tuple[str, str], str] = {pair: symbol for symbol, pair in self.symbols.items()}
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+
+class ExchangeInfoCache:
+    """
+    Pamięć podręczna exchangeInfo odświeżana w tle co ttl sekund.
+    Gdy odświeżenie się nie uda, dalej serwowana jest ostatnia poprawna kopia.
+    """
+
+    def __init__(self, fetch: Optional[Callable[[], Awaitable[dict]]] = None,
+                 ttl: float = settings.EXCHANGE_INFO_TTL, retry_delay: float = settings.EXCHANGE_INFO_RETRY):
+        self.fetch = fetch or fetch_binance_exchange_info
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.info: Optional[ExchangeInfo] = None
+        self.upstream_calls = 0
+        self.failures = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._task = BackgroundTask("exchange info refresh")
+
+    @property
+    def stale(self) -> bool:
+        return self.info is None or time.time() - self.info.fetched_at > self.ttl
+
+    async def refresh(self) -> bool:
+        """Pobiera exchangeInfo. Zwraca False (i zostawia poprzednią kopię), gdy się nie uda."""
+        self.upstream_calls += 1
+        try:
+            self.info = ExchangeInfo(await self.fetch())
+            return True
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Exchange info refresh failed: {str(e)}")
+            return False
+
+    async def get(self) -> ExchangeInfo:
+        """Zwraca aktualny zrzut; przy pierwszym użyciu pobiera go (jedno zapytanie dla wielu wywołań)."""
+        if self.info is not None:
+            return self.info
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.info is None:
+                await self.refresh()
+        if self.info is None:
+            raise RuntimeError("Exchange info is not available")
+        return self.info
+
+    async def _refresh_loop(self):
+        while True:
+            delay = self.ttl if not self.stale else self.retry_delay
+            await asyncio.sleep(delay)
+            await self.refresh()
+
+    async def start(self):
+        """Rozgrzewa pamięć podręczną i uruchamia odświeżanie w tle."""
+        if self.info is None:
+            await self.refresh()
+        self._task.start(self._refresh_loop)
+
+    async def stop(self):
+        await self._task.stop()
+
+
+exchange_info = ExchangeInfoCache()
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+import redis.asyncio as redis
+
+from config import settings
+from services.background import BackgroundTask
+from services.logger import logger
+
+
+class CacheStats:
+    def __init__(self):
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.redis_errors = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "hits": self.local_hits + self.redis_hits,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "redis_errors": self.redis_errors,
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+class LocalLRU:
+    """Pamięć podręczna w procesie: najwyżej max_entries wpisów, każdy ważny ttl sekund."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+Loader = Callable[[Optional[Any]], Awaitable[Any]]
+# age(wartość) - ile sekund temu wartość została pobrana
+Age = Callable[[Any], float]
+
+
+class HotKeys:
+    """Popularność kluczy: liczba zapytań wygaszana wykładniczo (połowa wagi co half_life sekund)."""
+
+    def __init__(self, half_life: float, max_keys: int):
+        self.half_life = half_life
+        self.max_keys = max_keys
+        self._keys: Dict[str, Tuple[float, float, Loader, Age]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _score(self, key: str, now: float) -> float:
+        score, at, _, _ = self._keys[key]
+        return score * 0.5 ** ((now - at) / self.half_life)
+
+    def record(self, key: str, loader: Loader, age: Age):
+        """Zapisuje zapytanie o klucz wraz z ostatnim loaderem (używanym do odświeżania w tle)."""
+        now = time.monotonic()
+        score = self._score(key, now) if key in self._keys else 0.0
+        self._keys[key] = (score + 1, now, loader, age)
+        if len(self._keys) > self.max_keys:
+            del self._keys[min(self._keys, key=lambda k: self._score(k, now))]
+
+    def top(self, count: int) -> List[Tuple[str, Loader, Age]]:
+        now = time.monotonic()
+        keys = sorted(self._keys, key=lambda k: self._score(k, now), reverse=True)[:count]
+        return [(key, self._keys[key][2], self._keys[key][3]) for key in keys]
+
+
+class HistoryCache:
+    """
+    Dwupoziomowa pamięć podręczna historii: LRU w procesie (wartości już zdekodowane) przed Redisem
+    (wartości zakodowane przez encode). Równoczesne chybienia dla jednego klucza czekają
+    na jedno pobranie (single-flight).
+
+    Dla zapytań z funkcją age wartość starsza niż ttl jest jeszcze zwracana przez stale_ttl sekund,
+    a w tle startuje jej odświeżenie (stale-while-revalidate). Najpopularniejsze klucze (hot_keys)
+    są odświeżane z wyprzedzeniem refresh_ahead sekund, zanim się zestarzeją.
+    """
+
+    FRESH, STALE, EXPIRED = "fresh", "stale", "expired"
+
+
+    def __init__(self, redis_client=None, max_entries: int = settings.HISTORY_LOCAL_CACHE_SIZE,
+                 local_ttl: float = settings.HISTORY_LOCAL_CACHE_TTL, ttl: int = settings.HISTORY_CACHE_TTL,
+                 encode: Callable[[Any], Union[str, bytes]] = json.dumps,
+                 decode: Callable[[Union[str, bytes]], Any] = json.loads,
+                 stale_ttl: int = settings.HISTORY_STALE_TTL, hot_keys: int = settings.HISTORY_HOT_KEYS,
+                 refresh_ahead: float = settings.HISTORY_REFRESH_AHEAD,
+                 refresh_interval: float = settings.HISTORY_REFRESH_INTERVAL):
+        # bez decode_responses: wartości mogą być binarne (json.loads przyjmuje też bytes)
+        self.redis = redis_client if redis_client is not None else redis.from_url(settings.REDIS_URL)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hot_keys = hot_keys
+        self.refresh_ahead = refresh_ahead
+        self.refresh_interval = refresh_interval
+        self.hot = HotKeys(settings.HISTORY_HOT_HALF_LIFE, max(4 * hot_keys, 64))
+        self.encode = encode
+        self.decode = decode
+        self.local = LocalLRU(max_entries, min(local_ttl, ttl))
+        self.stats = CacheStats()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._task = BackgroundTask("history cache refresh")
+
+    async def _redis_get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self.redis.get(key)
+        except Exception as e:
+            self.stats.redis_errors += 1
+            logger.error(f"failed to get cache {str(e)}", exc_info=True)
+            return None
+        return self.decode(raw) if raw is not None else None
+
+    async def _redis_set(self, key: str, value: Any):
+        try:
+            # wpis żyje w Redis dłużej niż ttl, żeby nieaktualną wartość można było zwrócić od razu
+            await self.redis.set(key, self.encode(value), ex=self.ttl + self.stale_ttl)
+        except Exception as e:
+            self.stats.redis_errors += 1
+            logger.error(f"redis error: {str(e)}", exc_info=True)
+
+    def _freshness(self, value: Any, age: Optional[Age]) -> str:
+        if age is None:
+            return self.FRESH
+        seconds = age(value)
+        if seconds <= self.ttl:
+            return self.FRESH
+        return self.STALE if seconds <= self.ttl + self.stale_ttl else self.EXPIRED
+
+    async def _load(self, key: str, loader: Loader, accept: Callable[[Any], bool], age: Optional[Age]) -> Any:
+        try:
+            value = await self._redis_get(key)
+            if value is not None and accept(value) and self._freshness(value, age) != self.EXPIRED:
+                self.stats.redis_hits += 1
+            else:
+                self.stats.misses += 1
+                # bez Redisa rozszerzana jest kopia lokalna
+                value = await loader(value if value is not None else self.local.get(key))
+                await self._redis_set(key, value)
+            self.local.set(key, value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    async def _refresh(self, key: str, loader: Loader, current: Optional[Any]) -> Any:
+        try:
+            value = await loader(current)
+            await self._redis_set(key, value)
+            self.local.set(key, value)
+            return value
+        except Exception as e:
+            self.stats.refresh_errors += 1
+            logger.error(f"Background refresh of {key} failed: {str(e)}", exc_info=True)
+            if current is None:
+                # nie ma czego zwrócić - czekające zapytania dostają błąd, jak przy nieudanym _load
+                raise
+            # do czasu udanego odświeżenia zwracana jest dotychczasowa wartość
+            return current
+        finally:
+            del self._inflight[key]
+
+    def _revalidate(self, key: str, loader: Loader, current: Optional[Any]) -> Optional[asyncio.Task]:
+        """Startuje odświeżenie w tle, chyba że dla klucza trwa już pobieranie."""
+        if key in self._inflight:
+            return None
+        self.stats.refreshes += 1
+        task = asyncio.create_task(self._refresh(key, loader, current))
+        self._inflight[key] = task
+        return task
+
+    def _serve(self, key: str, value: Any, loader: Loader, age: Optional[Age]) -> Any:
+        if self._freshness(value, age) == self.STALE:
+            self.stats.stale_hits += 1
+            self._revalidate(key, loader, value)
+        return value
+
+    async def get_or_load(self, key: str, loader: Loader, accept: Callable[[Any], bool] = lambda value: True,
+                          age: Optional[Age] = None) -> Any:
+        """
+        Zwraca wartość z LRU albo Redisa, jeśli accept(wartość) ją akceptuje. W przeciwnym razie
+        wywołuje loader(dotychczasowa wartość lub None) - raz dla wszystkich równoczesnych zapytań.
+        """
+        if age is not None:
+            self.hot.record(key, loader, age)
+        value = self.local.get(key)
+        if value is not None and accept(value) and self._freshness(value, age) != self.EXPIRED:
+            self.stats.local_hits += 1
+            return self._serve(key, value, loader, age)
+
+        while True:
+            task = self._inflight.get(key)
+            if task is None:
+                # osobne zadanie: anulowanie jednego z czekających nie przerywa pobierania dla pozostałych
+                task = asyncio.create_task(self._load(key, loader, accept, age))
+                self._inflight[key] = task
+                return self._serve(key, await asyncio.shield(task), loader, age)
+
+            self.stats.coalesced += 1
+            value = await asyncio.shield(task)
+            if accept(value):
+                return self._serve(key, value, loader, age)
+            # trwające pobranie nie pokryło tego zapytania - kolejne pobranie rozszerzy wynik
+
+    async def refresh_hot(self) -> int:
+        """Odświeża najpopularniejsze klucze, którym zostało mniej niż refresh_ahead sekund ważności."""
+        tasks = []
+        for key, loader, age in self.hot.top(self.hot_keys):
+            value = self.local.get(key)
+            if value is None:
+                value = await self._redis_get(key)
+            if value is None or age(value) > self.ttl - self.refresh_ahead:
+                task = self._revalidate(key, loader, value)
+                if task is not None:
+                    tasks.append(task)
+        # błędy odświeżenia są już zalogowane w _refresh
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh_hot()
+            except Exception as e:
+                logger.error(f"Hot key refresh failed: {str(e)}", exc_info=True)
+
+    async def start(self):
+        """Uruchamia odświeżanie popularnych kluczy w tle."""
+        self._task.start(self._refresh_loop)
+
+    async def stop(self):
+        await self._task.stop()
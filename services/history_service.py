@@ -0,0 +1,84 @@
+"""
+Historia cen dla /crypto/history: jedno okno świec na (symbol, interwał) w pamięci podręcznej.
+
+Okno obejmuje wszystkie świece od `start` do chwili pobrania. Mniejsze limity i podzakresy
+są wycinane z okna, a okno jest rozszerzane tylko wtedy, gdy zapytanie sięga poza nie.
+"""
+import struct
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from config import settings
+from services.exchange_info import ExchangeInfoCache, exchange_info
+from services.history_cache import HistoryCache
+from services.kline_store import kline_store, INTERVAL_MS, KLINE_DTYPE, first_open_needed, select, \
+    encode_klines, decode_klines
+
+
+class KlineWindow(NamedTuple):
+    start: int  # okno zawiera każdą świecę o open_time >= start
+    fetched_at: int  # chwila pobrania (ms); ostatnia świeca okna była wtedy bieżąca
+    klines: np.ndarray
+
+    def covers(self, first_needed: int) -> bool:
+        return self.start <= first_needed
+
+
+_WINDOW_HEADER = struct.Struct("<qq")
+
+
+def encode_window(window: KlineWindow) -> bytes:
+    """Okno w Redis: start i fetched_at (int64) oraz świece zakodowane kolumnowo."""
+    return _WINDOW_HEADER.pack(window.start, window.fetched_at) + encode_klines(window.klines)
+
+
+def decode_window(raw: bytes) -> KlineWindow:
+    start, fetched_at = _WINDOW_HEADER.unpack_from(raw)
+    return KlineWindow(start, fetched_at, decode_klines(raw, _WINDOW_HEADER.size))
+
+
+history_cache = HistoryCache(encode=encode_window, decode=decode_window)
+
+
+class UnknownSymbol(LookupError):
+    """Symbol spoza exchangeInfo Binance."""
+
+
+async def get_history(symbol: str, interval: str, limit: int = 100, start_time: Optional[int] = None,
+                      end_time: Optional[int] = None, cache: HistoryCache = history_cache,
+                      clock=time.time, info_cache: Optional[ExchangeInfoCache] = None) -> np.ndarray:
+    """Zwraca świece według semantyki get_klines Binance, wycinając je z okna (symbol, interwał)."""
+    # magazyn świec i okna w pamięci podręcznej powstają per symbol - dowolny tekst z URL nie może ich tworzyć
+    if symbol not in (await (info_cache or exchange_info).get()).symbols:
+        raise UnknownSymbol(f"Unknown symbol: {symbol}")
+    step = INTERVAL_MS.get(interval)
+    now = int(clock() * 1000)
+    if step is None or (now - first_open_needed(step, now, limit, start_time, end_time)) // step \
+            > settings.KLINE_MAX_GAP:
+        # interwały o zmiennej długości i bardzo odległe zakresy nie trafiają do okna
+        return await kline_store.get_klines(symbol, interval, limit, start_time, end_time)
+
+    def needed(window: KlineWindow) -> int:
+        # zapytania bez zakresu odnoszą się do chwili pobrania okna (akceptowana nieaktualność jak dla TTL)
+        return first_open_needed(step, window.fetched_at, limit, start_time, end_time)
+
+    def accept(window: KlineWindow) -> bool:
+        return window.covers(needed(window))
+
+    async def load(current: Optional[KlineWindow]) -> KlineWindow:
+        fetched_at = int(clock() * 1000)
+        start = first_open_needed(step, fetched_at, limit, start_time, end_time)
+        if current is not None:
+            # odświeżane w tle okno nie rośnie bez końca: najwyżej KLINE_MAX_GAP świec wstecz
+            start = min(start, max(current.start, fetched_at - settings.KLINE_MAX_GAP * step))
+        count = (fetched_at - start) // step + 2
+        klines = await kline_store.get_klines(symbol, interval, count, start_time=start)
+        return KlineWindow(start, fetched_at, klines)
+
+    def age(window: KlineWindow) -> float:
+        return clock() - window.fetched_at / 1000
+
+    window = await cache.get_or_load(f"{symbol}:{interval}", load, accept, age)
+    return select(window.klines, np.empty(0, dtype=KLINE_DTYPE), limit, start_time, end_time)
@@ -0,0 +1,299 @@
+"""
+Lokalny magazyn świec (klines) per (symbol, interwał).
+
+Zamknięte świece są trzymane w tablicy NumPy o stałej szerokości rekordu i dopisywane
+do pliku <KLINE_STORE_DIR>/<SYMBOL>-<interval>.klines (surowe rekordy KLINE_DTYPE).
+Z Binance pobierany jest tylko brakujący ogon po ostatniej zamkniętej świecy
+(wraz z bieżącą, jeszcze otwartą świecą) albo brakująca starsza historia.
+"""
+import asyncio
+import os
+import struct
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import settings
+from services.upstream import Priority, kline_weight, upstream
+
+# kolumny w kolejności, w jakiej zwraca je Binance (bez ostatniego, nieużywanego pola)
+KLINE_DTYPE = np.dtype([
+    ("open_time", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("close_time", "<i8"),
+    ("quote_volume", "<f8"),
+    ("trades", "<i8"),
+    ("taker_base_volume", "<f8"),
+    ("taker_quote_volume", "<f8"),
+])
+
+INTERVAL_MS = {
+    "1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "2h": 7_200_000, "4h": 14_400_000, "6h": 21_600_000, "8h": 28_800_000,
+    "12h": 43_200_000, "1d": 86_400_000, "3d": 259_200_000, "1w": 604_800_000,
+}
+
+MAX_PAGE = 1000  # maksymalny limit jednego zapytania get_klines
+CLOSE_GRACE_MS = 5000  # zapas na różnicę zegarów przy uznawaniu świecy za zamkniętą
+
+# fetch(symbol, interval, limit, start_time, end_time) -> lista świec w formacie Binance
+Fetch = Callable[..., Awaitable[List[list]]]
+
+
+async def fetch_binance_klines(symbol: str, interval: str, limit: int = MAX_PAGE,
+                               start_time: Optional[int] = None, end_time: Optional[int] = None) -> List[list]:
+    params = {"symbol": symbol, "interval": interval, "limit": limit}
+    if start_time is not None:
+        params["startTime"] = start_time
+    if end_time is not None:
+        params["endTime"] = end_time
+    return await upstream.call("get_klines", kline_weight(limit), Priority.LOW, **params)
+
+
+def from_binance(rows: List[list]) -> np.ndarray:
+    """Zamienia listę świec z Binance (liczby jako tekst) na tablicę KLINE_DTYPE."""
+    array = np.empty(len(rows), dtype=KLINE_DTYPE)
+    for i, field in enumerate(KLINE_DTYPE.names):
+        array[field] = [row[i] for row in rows]
+    return array
+
+
+def to_binance(array: np.ndarray) -> List[list]:
+    """Zamienia tablicę KLINE_DTYPE z powrotem na format odpowiedzi Binance."""
+    return [
+        [ot, f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", f"{v:.8f}", ct, f"{qv:.8f}", n,
+         f"{tb:.8f}", f"{tq:.8f}", "0"]
+        for ot, o, h, l, c, v, ct, qv, n, tb, tq in array.tolist()
+    ]
+
+
+# Kodowanie kolumnowe: nagłówek (magic, liczba świec) i kolejno każda kolumna KLINE_DTYPE
+# jako ciągła tablica little-endian o stałej szerokości (int64/float64).
+KLINE_CODEC_MAGIC = b"KLC1"
+_KLINE_HEADER = struct.Struct("<4sI")
+
+
+def encode_klines(array: np.ndarray) -> bytes:
+    """Koduje świece kolumnowo (bez tekstu i bez JSON)."""
+    parts = [_KLINE_HEADER.pack(KLINE_CODEC_MAGIC, len(array))]
+    parts.extend(np.ascontiguousarray(array[field]).tobytes() for field in KLINE_DTYPE.names)
+    return b"".join(parts)
+
+
+def decode_klines(data: bytes, offset: int = 0) -> np.ndarray:
+    """Dekoduje encode_klines wprost do tablicy KLINE_DTYPE."""
+    magic, count = _KLINE_HEADER.unpack_from(data, offset)
+    if magic != KLINE_CODEC_MAGIC:
+        raise ValueError("Not an encoded kline block")
+    offset += _KLINE_HEADER.size
+    array = np.empty(count, dtype=KLINE_DTYPE)
+    for field in KLINE_DTYPE.names:
+        column_dtype = KLINE_DTYPE.fields[field][0]
+        array[field] = np.frombuffer(data, dtype=column_dtype, count=count, offset=offset)
+        offset += count * column_dtype.itemsize
+    return array
+
+
+class KlineSeries:
+    """Zamknięte świece jednego (symbol, interwał): bufor z amortyzowanym dopisywaniem i plik na dysku."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = asyncio.Lock()
+        self.open_candle = np.empty(0, dtype=KLINE_DTYPE)
+        self.synced_at = 0.0
+        self.history_start: Optional[int] = None  # znany początek notowań (brak starszych świec)
+        self._data = np.empty(0, dtype=KLINE_DTYPE)
+        self._size = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        # niepełny rekord na końcu (przerwany zapis) jest pomijany
+        usable = len(raw) - len(raw) % KLINE_DTYPE.itemsize
+        self._data = np.frombuffer(raw[:usable], dtype=KLINE_DTYPE).copy()
+        self._size = len(self._data)
+
+    @property
+    def closed(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def append(self, records: np.ndarray):
+        if not len(records):
+            return
+        if self._size + len(records) > len(self._data):
+            grown = np.empty(max(2 * len(self._data), self._size + len(records), 64), dtype=KLINE_DTYPE)
+            grown[:self._size] = self.closed
+            self._data = grown
+        self._data[self._size:self._size + len(records)] = records
+        self._size += len(records)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+
+    def replace(self, records: np.ndarray):
+        """Podmienia całą zawartość (dopisanie starszej historii lub reset po dużej luce)."""
+        self._data = records.copy()
+        self._size = len(records)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(records.tobytes())
+        os.replace(tmp_path, self.path)
+
+
+class KlineStore:
+    def __init__(self, directory: str = settings.KLINE_STORE_DIR, fetch: Optional[Fetch] = None,
+                 clock: Callable[[], float] = time.time, max_gap: int = settings.KLINE_MAX_GAP,
+                 tail_ttl: float = settings.KLINE_TAIL_TTL):
+        self.directory = directory
+        self.fetch = fetch or fetch_binance_klines
+        self.clock = clock
+        self.max_gap = max_gap
+        self.tail_ttl = tail_ttl
+        self.upstream_calls = 0
+        self._series: Dict[tuple, KlineSeries] = {}
+
+    def series(self, symbol: str, interval: str) -> KlineSeries:
+        key = (symbol, interval)
+        if key not in self._series:
+            self._series[key] = KlineSeries(os.path.join(self.directory, f"{symbol}-{interval}.klines"))
+        return self._series[key]
+
+    async def _fetch(self, symbol: str, interval: str, **params) -> np.ndarray:
+        self.upstream_calls += 1
+        return from_binance(await self.fetch(symbol, interval, **params))
+
+    async def _fetch_range(self, symbol: str, interval: str, start_time: int, end_time: int) -> np.ndarray:
+        """Pobiera wszystkie świece o open_time w [start_time, end_time], stronicując po MAX_PAGE."""
+        pages = []
+        while start_time <= end_time:
+            page = await self._fetch(symbol, interval, limit=MAX_PAGE, start_time=start_time, end_time=end_time)
+            if not len(page):
+                break
+            pages.append(page)
+            if len(page) < MAX_PAGE:
+                break
+            start_time = int(page["open_time"][-1]) + 1
+        return np.concatenate(pages) if pages else np.empty(0, dtype=KLINE_DTYPE)
+
+    def _keep(self, series: KlineSeries, records: np.ndarray, now: int):
+        """Zapisuje zamknięte świece, a bieżącą (otwartą) trzyma tylko w pamięci."""
+        closed = records["close_time"] < now - CLOSE_GRACE_MS
+        series.append(records[closed])
+        series.open_candle = records[~closed]
+        series.synced_at = now / 1000
+
+    async def _sync_tail(self, series: KlineSeries, symbol: str, interval: str, step: int, now: int,
+                         first_needed: int):
+        """Dociąga świece po ostatniej zamkniętej (dla pustego magazynu: od first_needed)."""
+        if len(series):
+            if (now / 1000 - series.synced_at < self.tail_ttl and len(series.open_candle)
+                    and series.open_candle["close_time"][-1] >= now):
+                return
+            last_open = int(series.closed["open_time"][-1])
+            self._keep(series, await self._fetch_range(symbol, interval, last_open + 1, now), now)
+            return
+
+        records = await self._fetch_range(symbol, interval, first_needed, now)
+        self._keep(series, records, now)
+        if len(records) and records["open_time"][0] >= first_needed + step:
+            series.history_start = int(records["open_time"][0])
+
+    async def _backfill(self, series: KlineSeries, symbol: str, interval: str, step: int, first_needed: int):
+        """Dopisuje na początek brakującą starszą historię od first_needed."""
+        if not len(series):
+            return
+        first_open = int(series.closed["open_time"][0])
+        if first_open < first_needed + step or series.history_start == first_open:
+            return
+        older = await self._fetch_range(symbol, interval, first_needed, first_open - 1)
+        if not len(older) or older["open_time"][0] >= first_needed + step:
+            # Binance nie ma starszych świec (początek notowań)
+            series.history_start = int(older["open_time"][0]) if len(older) else first_open
+        if len(older):
+            series.replace(np.concatenate([older, series.closed]))
+
+    def _missing(self, series: KlineSeries, step: int, now: int, first_needed: int) -> int:
+        """Ile świec trzeba pobrać, żeby magazyn pokrył zakres od first_needed do teraz."""
+        if not len(series):
+            return (now - first_needed) // step
+        missing = (now - int(series.closed["open_time"][-1])) // step
+        if series.history_start is None:
+            missing += max(0, (int(series.closed["open_time"][0]) - first_needed) // step)
+        return missing
+
+    async def get_klines(self, symbol: str, interval: str, limit: int = 500,
+                         start_time: Optional[int] = None, end_time: Optional[int] = None) -> np.ndarray:
+        """
+        Zwraca świece tak jak get_klines Binance (ostatnie `limit` albo pierwsze `limit` od start_time),
+        czytając zamknięte świece z magazynu i dociągając z Binance tylko brakujące fragmenty.
+        """
+        step = INTERVAL_MS.get(interval)
+        if step is None:
+            # interwały o zmiennej długości (1M) idą bezpośrednio do Binance
+            return await self._fetch(symbol, interval, limit=min(limit, MAX_PAGE),
+                                     start_time=start_time, end_time=end_time)
+
+        now = int(self.clock() * 1000)
+        first_needed = first_open_needed(step, now, limit, start_time, end_time)
+
+        series = self.series(symbol, interval)
+        async with series.lock:
+            if len(series) and (now - int(series.closed["open_time"][-1])) // step > self.max_gap:
+                # zbyt duża luka od ostatniej świecy - magazyn zaczyna od nowa
+                series.replace(np.empty(0, dtype=KLINE_DTYPE))
+                series.history_start = None
+            if self._missing(series, step, now, first_needed) > self.max_gap:
+                # bardzo odległy zakres jest pobierany wprost z Binance, bez zapisu w magazynie
+                return await self._fetch(symbol, interval, limit=min(limit, MAX_PAGE),
+                                         start_time=start_time, end_time=end_time)
+
+            await self._sync_tail(series, symbol, interval, step, now, first_needed)
+            await self._backfill(series, symbol, interval, step, first_needed)
+            return select(series.closed, series.open_candle, limit, start_time, end_time)
+
+
+def first_open_needed(step: int, now: int, limit: int, start_time: Optional[int] = None,
+                      end_time: Optional[int] = None) -> int:
+    """Najwcześniejszy open_time potrzebny do odpowiedzi na zapytanie (stan na chwilę now)."""
+    if start_time is not None:
+        return start_time
+    # (anchor - limit * step, anchor] zawiera dokładnie `limit` otwarć świec niezależnie od wyrównania
+    return min(end_time if end_time is not None else now, now) - limit * step + 1
+
+
+def select(closed: np.ndarray, open_candle: np.ndarray, limit: int,
+           start_time: Optional[int] = None, end_time: Optional[int] = None) -> np.ndarray:
+    """Wybiera świece według semantyki Binance: od start_time pierwsze `limit`, w przeciwnym razie ostatnie."""
+    open_times = closed["open_time"]
+    lo = 0 if start_time is None else int(np.searchsorted(open_times, start_time, "left"))
+    hi = len(closed) if end_time is None else int(np.searchsorted(open_times, end_time, "right"))
+    tail = open_candle
+    if start_time is not None:
+        tail = tail[tail["open_time"] >= start_time]
+    if end_time is not None:
+        tail = tail[tail["open_time"] <= end_time]
+
+    part = closed[lo:hi]
+    if start_time is not None:
+        part = part[:limit]
+        tail = tail[:limit - len(part)]
+    else:
+        tail = tail[-limit:] if limit else tail[:0]
+        part = part[max(0, len(part) - (limit - len(tail))):] if limit > len(tail) else part[:0]
+    return np.concatenate([part, tail])
+
+
+kline_store = KlineStore()
@@ -0,0 +1,404 @@
+"""
+Nagrywanie i odtwarzanie danych rynkowych (symulator Binance do testów bez sieci i benchmarków).
+
+Zapis to strumień gzip rekordów: typ (uint8), czas odbioru w ms (int64), długość (uint32)
+i treść w zwartym JSON - zrzuty exchangeInfo i świec z chwili startu oraz zdarzenia
+strumieni <symbol>@ticker i <symbol>@kline_<interwał>.
+
+ReplayServer odtwarza zapis w tempie 1x-1000x i udostępnia używane przez aplikację
+endpointy REST (/api/v3/...) i WebSocket (/ws/<strumień>, /stream?streams=...). Aplikację
+kieruje się na niego ustawieniami BINANCE_API_URL i BINANCE_STREAM_URL.
+
+Uruchomienie:
+    python -m services.market_replay record zapis.mdr --symbols BTCUSDT,ETHUSDT --intervals 1m --duration 600
+    python -m services.market_replay replay zapis.mdr --speed 100 --port 9100
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import struct
+import time
+from collections import defaultdict
+from enum import IntEnum
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from aiohttp import WSMsgType, web
+
+from services.background import BackgroundTask
+from services.binance_client import close_async_client, get_async_client, socket_manager
+from services.kline_store import INTERVAL_MS, MAX_PAGE
+from services.logger import logger
+from services.upstream import EXCHANGE_INFO_WEIGHT, Priority, kline_weight, upstream
+
+RECORDING_MAGIC = b"XDBMD1\n"
+_RECORD_HEADER = struct.Struct("<BqI")
+MIN_SPEED, MAX_SPEED = 1.0, 1000.0
+
+
+class RecordType(IntEnum):
+    EXCHANGE_INFO = 1  # odpowiedź exchangeInfo
+    KLINES = 2  # zrzut świec {"s": symbol, "i": interwał, "data": [...]} (format REST)
+    TICKER = 3  # zdarzenie 24hrTicker
+    KLINE = 4  # zdarzenie kline ("k")
+
+
+class RecordingWriter:
+    def __init__(self, path: str):
+        self._file = gzip.open(path, "wb")
+        self._file.write(RECORDING_MAGIC)
+        self.records = 0
+
+    def write(self, record_type: RecordType, timestamp: int, payload):
+        data = json.dumps(payload, separators=(",", ":")).encode()
+        self._file.write(_RECORD_HEADER.pack(record_type, timestamp, len(data)) + data)
+        self.records += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_recording(path: str) -> Iterator[Tuple[RecordType, int, object]]:
+    with gzip.open(path, "rb") as file:
+        if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a market data recording")
+        while True:
+            header = file.read(_RECORD_HEADER.size)
+            if not header:
+                return
+            record_type, timestamp, length = _RECORD_HEADER.unpack(header)
+            yield RecordType(record_type), timestamp, json.loads(file.read(length))
+
+
+async def record(path: str, symbols: List[str], intervals: List[str], duration: float,
+                 history: int = MAX_PAGE) -> int:
+    """Nagrywa zrzuty REST i strumienie ticker/kline z Binance przez duration sekund."""
+    streams = [f"{symbol.lower()}@ticker" for symbol in symbols]
+    streams += [f"{symbol.lower()}@kline_{interval}" for symbol in symbols for interval in intervals]
+    with RecordingWriter(path) as writer:
+        now = int(time.time() * 1000)
+        info = await upstream.call("get_exchange_info", EXCHANGE_INFO_WEIGHT, Priority.NORMAL)
+        writer.write(RecordType.EXCHANGE_INFO, now, info)
+        for symbol in symbols:
+            for interval in intervals:
+                rows = await upstream.call("get_klines", kline_weight(history), Priority.LOW,
+                                           symbol=symbol, interval=interval, limit=history)
+                writer.write(RecordType.KLINES, now, {"s": symbol, "i": interval, "data": rows})
+
+        client = await get_async_client()
+        deadline = time.monotonic() + duration
+        async with socket_manager(client).multiplex_socket(streams) as socket:
+            while time.monotonic() < deadline:
+                try:
+                    msg = await asyncio.wait_for(socket.recv(), timeout=max(deadline - time.monotonic(), 0.01))
+                except asyncio.TimeoutError:
+                    break
+                data = msg.get("data", msg)
+                if data.get("e") == "error":
+                    raise ConnectionError(data.get("m"))
+                record_type = RecordType.KLINE if data.get("e") == "kline" else RecordType.TICKER
+                writer.write(record_type, int(time.time() * 1000), data)
+        return writer.records
+
+
+def write_random_walk(path: str, symbol: str = "BTCUSDT", ticks: int = 1000, step_ms: int = 100,
+                      start_price: float = 100.0, volatility: float = 0.001, history: int = 100,
+                      start: int = 1_700_000_000_000, seed: int = 0) -> int:
+    """Syntetyczny zapis (błądzenie losowe ceny) dla testów i benchmarków bez nagrania z Binance."""
+    rng = random.Random(seed)
+    minute = INTERVAL_MS["1m"]
+    first = start - start % minute
+
+    def row(open_time, o, h, l, c, volume):
+        return [open_time, f"{o:.8f}", f"{h:.8f}", f"{l:.8f}", f"{c:.8f}", f"{volume:.8f}", open_time + minute - 1,
+                f"{volume * c:.8f}", 1, f"{volume / 2:.8f}", f"{volume * c / 2:.8f}", "0"]
+
+    def kline_event(timestamp, candle, closed):
+        open_time, o, h, l, c, volume = candle
+        return {"e": "kline", "E": timestamp, "s": symbol,
+                "k": {"t": open_time, "T": open_time + minute - 1, "s": symbol, "i": "1m",
+                      "o": f"{o:.8f}", "h": f"{h:.8f}", "l": f"{l:.8f}", "c": f"{c:.8f}", "v": f"{volume:.8f}",
+                      "n": 1, "x": closed, "q": f"{volume * c:.8f}", "V": f"{volume / 2:.8f}",
+                      "Q": f"{volume * c / 2:.8f}"}}
+
+    with RecordingWriter(path) as writer:
+        writer.write(RecordType.EXCHANGE_INFO, start, {"serverTime": start, "symbols": [
+            {"symbol": symbol, "status": "TRADING", "baseAsset": symbol[:-4], "quoteAsset": symbol[-4:]}]})
+        writer.write(RecordType.KLINES, start, {"s": symbol, "i": "1m", "data": [
+            row(first - (history - i) * minute, start_price, start_price, start_price, start_price, 1.0)
+            for i in range(history)]})
+
+        price, day_open = start_price, start_price
+        candle = [first, price, price, price, price, 0.0]
+        for i in range(ticks):
+            timestamp = start + i * step_ms
+            if timestamp - timestamp % minute != candle[0]:
+                writer.write(RecordType.KLINE, timestamp, kline_event(timestamp, candle, True))
+                candle = [timestamp - timestamp % minute, price, price, price, price, 0.0]
+            price *= 1 + rng.gauss(0, volatility)
+            candle[2], candle[3], candle[4] = max(candle[2], price), min(candle[3], price), price
+            candle[5] += 0.01
+            writer.write(RecordType.TICKER, timestamp, {
+                "e": "24hrTicker", "E": timestamp, "s": symbol, "c": f"{price:.8f}", "o": f"{day_open:.8f}",
+                "h": f"{max(price, day_open):.8f}", "l": f"{min(price, day_open):.8f}", "v": f"{i * 0.01:.8f}",
+                "q": f"{i * 0.01 * price:.8f}", "P": f"{(price / day_open - 1) * 100:.3f}"})
+            writer.write(RecordType.KLINE, timestamp, kline_event(timestamp, candle, False))
+        return writer.records
+
+
+def _kline_row(k: dict) -> list:
+    return [k["t"], k["o"], k["h"], k["l"], k["c"], k["v"], k["T"], k["q"], k["n"], k["V"], k["Q"], "0"]
+
+
+# pola czasu przesuwane przy odtwarzaniu (zdarzenie, otwarcie/zamknięcie okna tickera)
+_TICKER_TIME_FIELDS = ("E", "O", "C")
+_MINI_TICKER_FIELDS = ("E", "s", "c", "o", "h", "l", "v", "q")
+
+
+class ReplayServer:
+    """
+    Odtwarza zapis jako lokalna giełda. Czas zapisu jest przesuwany tak, by odtwarzanie zaczynało się
+    "teraz"; przy speed=1 zegar serwera pokrywa się z zegarem ściennym, przy większych tempach
+    biegnie speed razy szybciej (historia świec odpowiada wtedy zegarowi serwera, /api/v3/time).
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, host: str = "127.0.0.1", port: int = 0):
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"Replay speed must be between {MIN_SPEED:g}x and {MAX_SPEED:g}x")
+        self.path = path
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.exchange_info: Optional[dict] = None
+        self.events: List[Tuple[int, RecordType, dict]] = []
+        self.klines: Dict[Tuple[str, str], Dict[int, list]] = {}
+        self.prices: Dict[str, str] = {}
+        self.emitted = 0
+        self.finished = asyncio.Event()
+        self._snapshots: List[Tuple[int, dict]] = []
+        self._subscribers: Dict[str, Set[Tuple[web.WebSocketResponse, bool]]] = defaultdict(set)
+        self._origin = 0  # czas zapisu odpowiadający chwili startu
+        self._started_wall = 0
+        self._started = 0.0
+        self._runner: Optional[web.AppRunner] = None
+        self._task = BackgroundTask("market replay")
+        self._load()
+
+    def _load(self):
+        for record_type, timestamp, payload in read_recording(self.path):
+            if record_type == RecordType.EXCHANGE_INFO:
+                self.exchange_info = payload
+            elif record_type == RecordType.KLINES:
+                self._snapshots.append((timestamp, payload))
+            else:
+                self.events.append((timestamp, record_type, payload))
+        self.events.sort(key=lambda event: event[0])
+        times = [timestamp for timestamp, _ in self._snapshots] + [event[0] for event in self.events[:1]]
+        self._origin = min(times) if times else 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def now(self) -> int:
+        """Czas serwera w ms (po przesunięciu zapisu)."""
+        if not self._started:
+            return int(time.time() * 1000)
+        return self._started_wall + int((time.monotonic() - self._started) * 1000 * self.speed)
+
+    def _shift(self, timestamp: int) -> int:
+        return timestamp + self._started_wall - self._origin
+
+    def _shift_row(self, row: list) -> list:
+        return [self._shift(row[0]), *row[1:6], self._shift(row[6]), *row[7:]]
+
+    def _apply_snapshots(self):
+        for _, payload in self._snapshots:
+            rows = self.klines.setdefault((payload["s"], payload["i"]), {})
+            for row in payload["data"]:
+                row = self._shift_row(row)
+                rows[row[0]] = row
+
+    # --- REST ---
+
+    async def _ping(self, request):
+        return web.json_response({})
+
+    async def _time(self, request):
+        return web.json_response({"serverTime": self.now()})
+
+    async def _exchange_info(self, request):
+        if self.exchange_info is None:
+            return web.json_response({"code": -1, "msg": "No exchangeInfo in recording"}, status=404)
+        return web.json_response({**self.exchange_info, "serverTime": self.now()})
+
+    async def _klines(self, request):
+        query = request.query
+        rows = self.klines.get((query.get("symbol"), query.get("interval")))
+        if rows is None:
+            return web.json_response({"code": -1121, "msg": "Invalid symbol."}, status=400)
+        limit = min(int(query.get("limit", 500)), MAX_PAGE)
+        start_time = int(query["startTime"]) if "startTime" in query else None
+        end_time = int(query.get("endTime", self.now()))
+        selected = [row for row in rows.values()
+                    if row[0] <= min(end_time, self.now()) and (start_time is None or row[0] >= start_time)]
+        selected = selected[:limit] if start_time is not None else selected[-limit:]
+        return web.json_response(selected)
+
+    async def _ticker_price(self, request):
+        if "symbol" in request.query:
+            symbol = request.query["symbol"]
+            if symbol not in self.prices:
+                return web.json_response({"code": -1121, "msg": "Invalid symbol."}, status=400)
+            return web.json_response({"symbol": symbol, "price": self.prices[symbol]})
+        symbols = json.loads(request.query["symbols"]) if "symbols" in request.query else sorted(self.prices)
+        return web.json_response([{"symbol": s, "price": self.prices[s]} for s in symbols if s in self.prices])
+
+    # --- WebSocket ---
+
+    async def _serve_socket(self, request, streams: List[str], combined: bool):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        for stream in streams:
+            self._subscribers[stream].add((ws, combined))
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            for stream in streams:
+                self._subscribers[stream].discard((ws, combined))
+        return ws
+
+    async def _single_stream(self, request):
+        return await self._serve_socket(request, [request.match_info["stream"]], False)
+
+    async def _combined_stream(self, request):
+        return await self._serve_socket(request, request.query.get("streams", "").split("/"), True)
+
+    async def _send(self, stream: str, payload: dict):
+        subscribers = self._subscribers.get(stream)
+        if not subscribers:
+            return
+        raw = json.dumps(payload, separators=(",", ":"))
+        wrapped = json.dumps({"stream": stream, "data": payload}, separators=(",", ":"))
+        for ws, combined in list(subscribers):
+            try:
+                await ws.send_str(wrapped if combined else raw)
+            except ConnectionError:
+                subscribers.discard((ws, combined))
+
+    async def _emit(self, record_type: RecordType, payload: dict):
+        symbol = payload["s"]
+        if record_type == RecordType.TICKER:
+            payload = {**payload, **{f: self._shift(payload[f]) for f in _TICKER_TIME_FIELDS if f in payload}}
+            self.prices[symbol] = payload["c"]
+            await self._send(f"{symbol.lower()}@ticker", payload)
+            mini = {"e": "24hrMiniTicker", **{f: payload[f] for f in _MINI_TICKER_FIELDS if f in payload}}
+            await self._send(f"{symbol.lower()}@miniTicker", mini)
+        else:
+            k = payload["k"]
+            k = {**k, "t": self._shift(k["t"]), "T": self._shift(k["T"])}
+            payload = {**payload, "E": self._shift(payload["E"]), "k": k}
+            self.klines.setdefault((symbol, k["i"]), {})[k["t"]] = _kline_row(k)
+            await self._send(f"{symbol.lower()}@kline_{k['i']}", payload)
+        self.emitted += 1
+
+    async def _playback(self):
+        try:
+            for timestamp, record_type, payload in self.events:
+                delay = (self._shift(timestamp) - self.now()) / 1000 / self.speed
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._emit(record_type, payload)
+        finally:
+            self.finished.set()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/v3/ping", self._ping)
+        app.router.add_get("/api/v3/time", self._time)
+        app.router.add_get("/api/v3/exchangeInfo", self._exchange_info)
+        app.router.add_get("/api/v3/klines", self._klines)
+        app.router.add_get("/api/v3/ticker/price", self._ticker_price)
+        app.router.add_get("/ws/{stream}", self._single_stream)
+        app.router.add_get("/stream", self._combined_stream)
+        return app
+
+    async def start(self):
+        """Uruchamia serwer HTTP; odtwarzanie zaczyna się dopiero po play()."""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def play(self):
+        self._started_wall = int(time.time() * 1000)
+        self._started = time.monotonic()
+        self._apply_snapshots()
+        self._task.start(self._playback)
+
+    async def stop(self):
+        await self._task.stop()
+        for subscribers in self._subscribers.values():
+            for ws, _ in list(subscribers):
+                await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _replay(path: str, speed: float, host: str, port: int):
+    server = ReplayServer(path, speed, host, port)
+    await server.start()
+    logger.info(f"Replaying {len(server.events)} events from {path} at {speed:g}x")
+    print(f"BINANCE_API_URL={server.url}/api")
+    print(f"BINANCE_STREAM_URL=ws://{server.host}:{server.port}/")
+    server.play()
+    try:
+        await server.finished.wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nagrywanie i odtwarzanie danych rynkowych Binance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rec = commands.add_parser("record")
+    rec.add_argument("path")
+    rec.add_argument("--symbols", default="BTCUSDT")
+    rec.add_argument("--intervals", default="1m")
+    rec.add_argument("--duration", type=float, default=600)
+    rep = commands.add_parser("replay")
+    rep.add_argument("path")
+    rep.add_argument("--speed", type=float, default=1.0)
+    rep.add_argument("--host", default="127.0.0.1")
+    rep.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        async def run():
+            try:
+                return await record(args.path, args.symbols.upper().split(","), args.intervals.split(","),
+                                    args.duration)
+            finally:
+                await close_async_client()
+
+        print(f"Recorded {asyncio.run(run())} records to {args.path}")
+    else:
+        asyncio.run(_replay(args.path, args.speed, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Migracje schematu bazy danych.
+
+Każda migracja ma numer wersji; zastosowane wersje są zapisywane w tabeli schema_migrations.
+Migracje muszą być idempotentne (checkfirst / IF NOT EXISTS), bo w SQLite część poleceń DDL
+wykonuje się poza transakcją - przerwaną migrację można po prostu uruchomić ponownie.
+
+Uruchomienie dla istniejącej bazy: python -m services.migrations
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from models.user import Base, CurrencyBalance, PortfolioAsset, PortfolioSnapshot, Order, OrderFuture
+from services.logger import logger
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _initial_schema(connection: Connection):
+    # Na pustej bazie tworzy od razu pełny schemat (razem z indeksami z __table_args__),
+    # na istniejącej pomija tabele, które już są.
+    Base.metadata.create_all(bind=connection)
+
+
+def _merge_duplicate_balances(connection: Connection):
+    connection.execute(text("""
+        UPDATE currency_balances
+        SET amount = (SELECT SUM(d.amount) FROM currency_balances d
+                      WHERE d.user_id = currency_balances.user_id AND d.currency = currency_balances.currency)
+        WHERE id IN (SELECT MIN(id) FROM currency_balances GROUP BY user_id, currency HAVING COUNT(*) > 1)
+    """))
+    connection.execute(text("""
+        DELETE FROM currency_balances
+        WHERE id NOT IN (SELECT MIN(id) FROM currency_balances GROUP BY user_id, currency)
+    """))
+
+
+def _merge_duplicate_positions(connection: Connection):
+    # scalone pozycje dostają średnią cenę zakupu ważoną ilością, jak w add_position;
+    # przy zerowej łącznej ilości (np. same wyzerowane pozycje) średnia nie istnieje - zostaje najniższa cena
+    connection.execute(text("""
+        UPDATE portfolio_assets
+        SET buy_price = (SELECT CASE WHEN SUM(d.amount) != 0 THEN SUM(d.amount * d.buy_price) / SUM(d.amount)
+                                     ELSE MIN(d.buy_price) END
+                         FROM portfolio_assets d
+                         WHERE d.portfolio_id = portfolio_assets.portfolio_id AND d.symbol = portfolio_assets.symbol),
+            amount = (SELECT SUM(d.amount) FROM portfolio_assets d
+                      WHERE d.portfolio_id = portfolio_assets.portfolio_id AND d.symbol = portfolio_assets.symbol)
+        WHERE id IN (SELECT MIN(id) FROM portfolio_assets GROUP BY portfolio_id, symbol HAVING COUNT(*) > 1)
+    """))
+    connection.execute(text("""
+        DELETE FROM portfolio_assets
+        WHERE id NOT IN (SELECT MIN(id) FROM portfolio_assets GROUP BY portfolio_id, symbol)
+    """))
+
+
+def _hot_path_indexes(connection: Connection):
+    # indeksy unikalne wymagają wcześniejszego scalenia zduplikowanych wierszy
+    _merge_duplicate_balances(connection)
+    _merge_duplicate_positions(connection)
+    for model in (CurrencyBalance, PortfolioAsset, Order, OrderFuture):
+        for index in model.__table__.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def _portfolio_snapshots(connection: Connection):
+    PortfolioSnapshot.__table__.create(bind=connection, checkfirst=True)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "initial schema", _initial_schema),
+    Migration(2, "hot path composite indexes", _hot_path_indexes),
+    Migration(3, "portfolio snapshots", _portfolio_snapshots),
+]
+
+
+def current_version(connection: Connection) -> int:
+    """Zwraca numer ostatniej zastosowanej migracji (0 dla bazy bez historii migracji)."""
+    schema_migrations.create(bind=connection, checkfirst=True)
+    return connection.execute(select(func.coalesce(func.max(schema_migrations.c.version), 0))).scalar()
+
+
+def migrate(engine: Engine) -> int:
+    """Stosuje brakujące migracje po kolei. Zwraca numer wersji schematu po migracji."""
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.info(f"Applying migration {migration.version}: {migration.name}")
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.utcnow()
+            ))
+        version = migration.version
+
+    return version
+
+
+if __name__ == "__main__":
+    from models.user import engine
+
+    print(f"Schema version: {migrate(engine)}")
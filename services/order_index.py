@@ -0,0 +1,156 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.user import OrderFuture, OrderStatus, AdvancedOrderType
+from services.price_feed import price_feed
+
+BUY = "buy"
+SELL = "sell"
+
+# Kierunek przecięcia ceny, przy którym zlecenie się aktywuje
+FALLING = "falling"  # cena <= próg (LIMIT kupna)
+RISING = "rising"    # cena >= próg (LIMIT sprzedaży, STOP_*, TAKE_PROFIT_*)
+
+
+def trigger_of(order) -> Optional[Tuple[str, str, float]]:
+    """
+    Zwraca (strona, kierunek, próg) dla zlecenia zgodnie z regułami process_order
+    albo None, jeśli zlecenie nie może się aktywować.
+    """
+    if not order.amount:
+        return None
+    side = BUY if order.amount > 0 else SELL
+
+    if order.order_type == AdvancedOrderType.LIMIT:
+        if not order.price:
+            return None
+        return side, FALLING if side == BUY else RISING, order.price
+
+    if not order.stop_price:
+        return None
+    return side, RISING, order.stop_price
+
+
+class _SideBook:
+    """Posortowane progi aktywacji jednej strony (kupno/sprzedaż) dla jednego symbolu."""
+
+    def __init__(self):
+        self.falling: List[Tuple[float, int]] = []
+        self.rising: List[Tuple[float, int]] = []
+
+    def _levels(self, direction: str) -> List[Tuple[float, int]]:
+        return self.falling if direction == FALLING else self.rising
+
+    def add(self, direction: str, threshold: float, order_id: int):
+        insort(self._levels(direction), (threshold, order_id))
+
+    def remove(self, direction: str, threshold: float, order_id: int):
+        levels = self._levels(direction)
+        i = bisect_left(levels, (threshold, order_id))
+        if i < len(levels) and levels[i] == (threshold, order_id):
+            del levels[i]
+
+    def crossed(self, price: float) -> List[int]:
+        # FALLING: progi >= cena, RISING: progi <= cena - oba zakresy to ciągłe wycinki listy
+        start = bisect_left(self.falling, (price, -1))
+        end = bisect_right(self.rising, (price, float("inf")))
+        return [oid for _, oid in self.falling[start:]] + [oid for _, oid in self.rising[:end]]
+
+    def __len__(self):
+        return len(self.falling) + len(self.rising)
+
+
+class OrderIndex:
+    """
+    Indeks oczekujących zleceń OrderFuture w pamięci: symbol -> strona -> progi posortowane po cenie.
+    Pozwala znaleźć tylko te zlecenia, których próg został przekroczony przez aktualną cenę.
+    """
+
+    def __init__(self, on_symbol_added: Optional[Callable[[str], None]] = None,
+                 on_symbol_removed: Optional[Callable[[str], None]] = None):
+        self._books: Dict[str, Dict[str, _SideBook]] = {}
+        self._entries: Dict[int, Tuple[str, str, str, float]] = {}
+        # wywoływane, gdy symbol pojawia się w indeksie lub znika z niego (np. subskrypcja strumienia cen)
+        self.on_symbol_added = on_symbol_added
+        self.on_symbol_removed = on_symbol_removed
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, order_id: int):
+        return order_id in self._entries
+
+    def symbols(self) -> Set[str]:
+        return set(self._books)
+
+    def add(self, order: OrderFuture):
+        """Dodaje lub aktualizuje zlecenie w indeksie (zlecenia inne niż PENDING są usuwane)."""
+        self.remove(order.id)
+        if order.status != OrderStatus.PENDING:
+            return
+        trigger = trigger_of(order)
+        if trigger is None:
+            return
+        side, direction, threshold = trigger
+        if order.symbol not in self._books and self.on_symbol_added is not None:
+            self.on_symbol_added(order.symbol)
+        book = self._books.setdefault(order.symbol, {}).setdefault(side, _SideBook())
+        book.add(direction, threshold, order.id)
+        self._entries[order.id] = (order.symbol, side, direction, threshold)
+
+    def remove(self, order_id: int):
+        entry = self._entries.pop(order_id, None)
+        if entry is None:
+            return
+        symbol, side, direction, threshold = entry
+        sides = self._books[symbol]
+        sides[side].remove(direction, threshold, order_id)
+        if not sides[side]:
+            del sides[side]
+        if not sides:
+            del self._books[symbol]
+            if self.on_symbol_removed is not None:
+                self.on_symbol_removed(symbol)
+
+    def triggered(self, symbol: str, price: float) -> List[int]:
+        """Zwraca id zleceń dla symbolu, których próg aktywacji został przekroczony."""
+        sides = self._books.get(symbol)
+        if not sides:
+            return []
+        result = []
+        for book in sides.values():
+            result.extend(book.crossed(price))
+        return result
+
+    def clear(self):
+        symbols = list(self._books)
+        self._books.clear()
+        self._entries.clear()
+        if self.on_symbol_removed is not None:
+            for symbol in symbols:
+                self.on_symbol_removed(symbol)
+
+    def rebuild(self, db: Session):
+        """Odbudowuje indeks na podstawie oczekujących zleceń w bazie."""
+        self.clear()
+        pending = db.query(OrderFuture).filter(OrderFuture.status == OrderStatus.PENDING).all()
+        for order in pending:
+            self.add(order)
+        return len(self)
+
+    async def rebuild_async(self, db: AsyncSession):
+        """Asynchroniczna wersja rebuild."""
+        self.clear()
+        result = await db.execute(select(OrderFuture).where(OrderFuture.status == OrderStatus.PENDING))
+        for order in result.scalars():
+            self.add(order)
+        return len(self)
+
+
+# symbole oczekujących zleceń są w strumieniu cen tak długo, jak są w indeksie
+order_index = OrderIndex(on_symbol_added=lambda symbol: price_feed.subscribe([symbol]),
+                         on_symbol_removed=lambda symbol: price_feed.unsubscribe([symbol]))
@@ -1,163 +1,96 @@
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Dict, Iterable, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
 from services.logger import logger
 
-from models.user import OrderFuture, OrderStatus, SessionLocal, AdvancedOrderType, CurrencyBalance, PortfolioAsset, \
-    Order
-from services.binance_service import get_current_market_price
+from models.user import OrderFuture, OrderStatus, AsyncSessionLocal, AdvancedOrderType, Order, User
+from services.crud import debit_balance_async, credit_balance_async, add_position_async, reduce_position_async
+from services.binance_service import get_current_market_price, get_market_prices
+from services.price_feed import price_feed
 from services.notification_service import notify_order_execution
+from services.order_index import order_index
+from services.read_model import read_model
 
 
-async def execute_buy(order: Order, db: Session) -> None:
-    """Realizuje zlecenie kupna"""
+async def execute_buy(order: Order, db: AsyncSession, price: float = None) -> None:
+    """Realizuje zlecenie kupna (po cenie z przekazanego zrzutu cen, jeśli jest podana)"""
     try:
-        current_price = await get_current_market_price(order.symbol)
+        current_price = price if price is not None else await get_current_market_price(order.symbol)
         total_cost = order.amount * current_price
 
-        balance = db.query(CurrencyBalance).filter(
-            CurrencyBalance.user_id == order.user_id,
-            CurrencyBalance.currency == order.currency
-        ).first()
+        with read_model.writing(order.user_id) as changes:
+            # warunkowe UPDATE jest jednocześnie sprawdzeniem środków
+            if not await debit_balance_async(db, order.user_id, order.currency, total_cost):
+                order.status = OrderStatus.FAILED
+                order.executed_at = datetime.utcnow()
+                await db.commit()
+                raise ValueError("Insufficient funds")
 
-        if not balance or balance.amount < total_cost:
-            order.status = OrderStatus.FAILED
-            order.executed_at = datetime.utcnow()
-            db.commit()
-            raise ValueError("Insufficient funds")
-
-        asset = db.query(PortfolioAsset).filter(
-            PortfolioAsset.portfolio_id == order.portfolio_id,
-            PortfolioAsset.symbol == order.symbol
-        ).first()
-
-        balance.amount -= total_cost
-
-        if asset:
-            new_amount = asset.amount + order.amount
-            total_investment = (asset.amount * asset.buy_price) + (order.amount * current_price)
-            asset.buy_price = total_investment / new_amount
-            asset.amount = new_amount
-        else:
-            asset = PortfolioAsset(
-                portfolio_id=order.portfolio_id,
-                symbol=order.symbol,
-                currency_type="crypto",
-                amount=order.amount,
-                buy_price=current_price,
-                buy_currency=order.currency
-            )
-            db.add(asset)
+            await add_position_async(db, order.portfolio_id, order.symbol, order.amount, current_price, order.currency)
+            changes.balance(order.currency, -total_cost)
+            changes.add_position(order.portfolio_id, order.symbol, order.amount, current_price, order.currency)
 
-        order.status = OrderStatus.COMPLETED
-        order.executed_at = datetime.utcnow()
-        order.price = current_price
-        db.commit()
+            order.status = OrderStatus.COMPLETED
+            order.executed_at = datetime.utcnow()
+            order.price = current_price
+            await db.commit()
 
-        await notify_order_execution(order.user, order)
+        await notify_order_execution(await db.get(User, order.user_id), order)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Buy execution failed: {str(e)}",exc_info=True)
         raise ValueError(f"Buy execution failed: {str(e)}")
 
 
-async def execute_sell(order: Order, db: Session) -> None:
-    """Realizuje zlecenie sprzedaży"""
-    amount=(0-order.amount)
-    try:
-        current_price = await get_current_market_price(order.symbol)
-        total_value = amount * current_price
-
-        asset = db.query(PortfolioAsset).filter(
-            PortfolioAsset.portfolio_id == order.portfolio_id,
-            PortfolioAsset.symbol == order.symbol
-        ).first()
+async def _execute_sell(order: Order, db: AsyncSession, quantity: float, price: float = None) -> None:
+    """Sprzedaje `quantity` jednostek pozycji i uznaje saldo w walucie zlecenia"""
+    current_price = price if price is not None else await get_current_market_price(order.symbol)
+    total_value = quantity * current_price
 
-        if not asset or asset.amount < order.amount:
+    with read_model.writing(order.user_id) as changes:
+        if not await reduce_position_async(db, order.portfolio_id, order.symbol, quantity):
             order.status = OrderStatus.FAILED
-            db.commit()
+            await db.commit()
             raise ValueError("Insufficient assets")
 
-        balance = db.query(CurrencyBalance).filter(
-            CurrencyBalance.user_id == order.user_id,
-            CurrencyBalance.currency == order.currency
-        ).first()
-
-        if not balance:
-            balance = CurrencyBalance(
-                user_id=order.user_id,
-                currency=order.currency,
-                amount=0.0
-            )
-            db.add(balance)
-
-        asset.amount -= amount
-        if asset.amount <= 0.000001:
-            db.delete(asset)
-
-        balance.amount += total_value
+        await credit_balance_async(db, order.user_id, order.currency, total_value)
+        changes.reduce_position(order.portfolio_id, order.symbol, quantity)
+        changes.balance(order.currency, total_value)
 
         order.status = OrderStatus.COMPLETED
         order.executed_at = datetime.utcnow()
         order.price = current_price
-        db.commit()
-        await notify_order_execution(order.user, order)
+        await db.commit()
+    await notify_order_execution(await db.get(User, order.user_id), order)
 
+
+async def execute_sell(order: Order, db: AsyncSession, price: float = None) -> None:
+    """Realizuje zlecenie sprzedaży (zlecenia zaawansowane mają ujemną ilość)"""
+    try:
+        await _execute_sell(order, db, -order.amount, price)
     except Exception as e: # mozna zrobic dekoratora autorollback, value error nie jest potrzebny
-        db.rollback()
+        await db.rollback()
         logger.error(f"Sell execution failed: {str(e)}",exc_info=True)
         raise ValueError(f"Sell execution failed: {str(e)}")
 
-async def execute_market_sell(order: Order, db: Session) -> None:
+async def execute_market_sell(order: Order, db: AsyncSession) -> None:
     """Realizuje zlecenie sprzedaży"""
     try:
-        current_price = await get_current_market_price(order.symbol)
-        total_value = order.amount * current_price
-
-        asset = db.query(PortfolioAsset).filter(
-            PortfolioAsset.portfolio_id == order.portfolio_id,
-            PortfolioAsset.symbol == order.symbol
-        ).first()
-
-        if not asset or asset.amount < order.amount:
-            order.status = OrderStatus.FAILED
-            db.commit()
-            raise ValueError("Insufficient assets")
-
-        balance = db.query(CurrencyBalance).filter(
-            CurrencyBalance.user_id == order.user_id,
-            CurrencyBalance.currency == order.currency
-        ).first()
-
-        if not balance:
-            balance = CurrencyBalance(
-                user_id=order.user_id,
-                currency=order.currency,
-                amount=0.0
-            )
-            db.add(balance)
-
-        asset.amount -= order.amount
-        if asset.amount <= 0.000001:
-            db.delete(asset)
-
-        balance.amount += total_value
-
-        order.status = OrderStatus.COMPLETED
-        order.executed_at = datetime.utcnow()
-        order.price = current_price
-        db.commit()
-        await notify_order_execution(order.user, order)
-
+        await _execute_sell(order, db, order.amount)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Sell execution failed: {str(e)}",exc_info=True)
         raise ValueError(f"Sell execution failed: {str(e)}")
 
 
-async def process_order(order, current_price, db: Session):
+async def process_order(order, current_price, db: AsyncSession):
     """
     Obsługuje różne typy zleceń, zapisuje zmiany w bazie i usuwa zrealizowane zlecenia.
 
@@ -168,92 +101,298 @@ async def process_order(order, current_price, db: Session):
         execute_sell: Funkcja realizacji sprzedaży.
         db: Sesja bazy danych.
     """
+    order_id = order.id
     try:
         # Obsługa zleceń LIMIT
         if order.order_type == AdvancedOrderType.LIMIT:
             if order.price and current_price <= order.price and order.amount > 0:
-                await execute_buy(order, db)
-                db.delete(order)
-                db.commit()
+                await execute_buy(order, db, current_price)
+                await db.delete(order)
+                await db.commit()
                 return True
             elif order.price and current_price >= order.price and order.amount < 0:
-                await execute_sell(order, db)
-                db.delete(order)
-                db.commit()
+                await execute_sell(order, db, current_price)
+                await db.delete(order)
+                await db.commit()
                 return True
 
         # Obsługa zleceń STOP_LIMIT
         elif order.order_type == AdvancedOrderType.STOP_LIMIT:
             if order.stop_price and current_price >= order.stop_price:
                 order.order_type = AdvancedOrderType.LIMIT
-                db.commit()
-                return process_order(order, current_price, db)
+                await db.commit()
+                return await process_order(order, current_price, db)
 
         # Obsługa zleceń STOP_MARKET
         elif order.order_type == AdvancedOrderType.STOP_MARKET:
             if order.stop_price and current_price >= order.stop_price:
                 if order.amount > 0:
-                    await execute_buy(order, db)
+                    await execute_buy(order, db, current_price)
                 elif order.amount < 0:
-                    await execute_sell(order, db)
-                db.delete(order)
-                db.commit()
+                    await execute_sell(order, db, current_price)
+                await db.delete(order)
+                await db.commit()
                 return True
 
         # Obsługa zleceń TAKE_PROFIT_LIMIT
         elif order.order_type == AdvancedOrderType.TAKE_PROFIT_LIMIT:
             if order.stop_price and current_price >= order.stop_price:
                 order.order_type = AdvancedOrderType.LIMIT
-                db.commit()
-                return process_order(order, current_price, db)
+                await db.commit()
+                return await process_order(order, current_price, db)
 
         # Obsługa zleceń TAKE_PROFIT_MARKET
         elif order.order_type == AdvancedOrderType.TAKE_PROFIT_MARKET:
             if order.stop_price and current_price >= order.stop_price:
                 if order.amount > 0:
-                    await execute_buy(order, db)
+                    await execute_buy(order, db, current_price)
                 elif order.amount < 0:
-                    await execute_sell(order, db)
-                db.delete(order)
-                db.commit()
+                    await execute_sell(order, db, current_price)
+                await db.delete(order)
+                await db.commit()
                 return True
 
         return False
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Processing order error: {str(e)}", exc_info=True)
-        print(f"Error processing order {order.id}: {e}")
+        print(f"Error processing order {order_id}: {e}")
         return False
 
 
 
 
-async def process_orders_in_background():
+async def rebuild_order_index() -> int:
+    """Odbudowuje indeks zleceń oczekujących na podstawie bazy danych."""
+    async with AsyncSessionLocal() as db:
+        return await order_index.rebuild_async(db)
+
+
+class EngineStats:
+    """Statystyki ostatniego cyklu silnika zleceń."""
+
+    def __init__(self):
+        self.ticks = 0
+        self.tick_duration_ms = 0.0
+        self.upstream_calls = 0
+        self.symbols = 0
+        self.triggered = 0
+
+    def as_dict(self):
+        return {
+            "ticks": self.ticks,
+            "tick_duration_ms": self.tick_duration_ms,
+            "upstream_calls": self.upstream_calls,
+            "symbols": self.symbols,
+            "triggered": self.triggered,
+        }
+
+
+engine_stats = EngineStats()
+
+
+class OrderExecutor:
     """
-    Funkcja działająca w tle, która co sekundę przetwarza zlecenia w tabeli OrdersFuture.
+    Współbieżne wykonywanie aktywowanych zleceń: najwyżej `concurrency` naraz,
+    ale zlecenia dotyczące tego samego użytkownika lub portfela wykonują się po kolei,
+    żeby saldo CurrencyBalance nie zostało wydane dwukrotnie.
     """
-    while True:
-        db: Session = SessionLocal()
+
+    def __init__(self, concurrency: int = settings.ORDER_ENGINE_CONCURRENCY):
+        self.concurrency = concurrency
+        self._loop = None
+        self._semaphore = None
+        self._semaphore_size = 0
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+        self._holders: Dict[Tuple[str, int], int] = {}
+
+    def _bind(self):
+        # semafor i blokady asyncio należą do pętli zdarzeń, w której zostały użyte
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = None
+            self._locks.clear()
+            self._holders.clear()
+        # zmiana limitu obowiązuje, gdy nic się akurat nie wykonuje
+        if self._semaphore is None or (not self._holders and self._semaphore_size != self.concurrency):
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_size = self.concurrency
+
+    @asynccontextmanager
+    async def account(self, keys: Iterable[Tuple[str, int]]):
+        """Blokuje konta (w stałej kolejności, bez zakleszczeń), a potem miejsce w limicie współbieżności."""
+        self._bind()
+        keys = sorted(set(keys))
+        for key in keys:
+            self._holders[key] = self._holders.get(key, 0) + 1
+        acquired = []
         try:
-            pending_orders = db.query(OrderFuture).filter(OrderFuture.status == OrderStatus.PENDING).all()
+            for key in keys:
+                lock = self._locks.setdefault(key, asyncio.Lock())
+                await lock.acquire()
+                acquired.append(lock)
+            async with self._semaphore:
+                yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key in keys:
+                self._holders[key] -= 1
+                if not self._holders[key]:
+                    del self._holders[key]
+                    self._locks.pop(key, None)
 
-            for order in pending_orders:
 
-                current_price = await get_current_market_price(order.symbol)
+order_executor = OrderExecutor()
 
 
+async def execute_triggered_order(order_id: int, user_id: int, portfolio_id: int, current_price: float) -> bool:
+    """Wykonuje jedno aktywowane zlecenie we własnej sesji i synchronizuje z nim indeks."""
+    async with order_executor.account([("user", user_id), ("portfolio", portfolio_id)]):
+        async with AsyncSessionLocal() as db:
+            try:
+                order = await db.get(OrderFuture, order_id)
+                if order is None or order.status != OrderStatus.PENDING:
+                    order_index.remove(order_id)
+                    return False
+
                 result = await process_order(order, current_price, db)
 
                 if result:
-                    print(f"Order {order.id} processed successfully.")
+                    order_index.remove(order_id)
+                    print(f"Order {order_id} processed successfully.")
                 else:
-                    print(f"Order {order.id} not executed.")
+                    # zlecenie mogło zmienić typ (STOP_LIMIT -> LIMIT) albo status (FAILED)
+                    order = await db.get(OrderFuture, order_id, populate_existing=True)
+                    if order is None:
+                        order_index.remove(order_id)
+                    else:
+                        order_index.add(order)
+                    print(f"Order {order_id} not executed.")
+                return result
+            except Exception as e:
+                logger.error(f"Error executing order {order_id}: {str(e)}", exc_info=True)
+                return False
+
+
+async def process_symbol(symbol: str, current_price: float) -> int:
+    """
+    Przetwarza tylko te zlecenia symbolu, których próg aktywacji przekroczyła cena,
+    i synchronizuje indeks z ich stanem po przetworzeniu. Zwraca liczbę aktywowanych zleceń.
+    """
+    triggered_ids = order_index.triggered(symbol, current_price)
+    if not triggered_ids:
+        return 0
+
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(OrderFuture.id, OrderFuture.user_id, OrderFuture.portfolio_id).where(
+                OrderFuture.id.in_(triggered_ids),
+                OrderFuture.status == OrderStatus.PENDING
+            )
+        )).all()
+    for missing_id in set(triggered_ids) - {row.id for row in rows}:
+        order_index.remove(missing_id)
+
+    await asyncio.gather(*(
+        execute_triggered_order(row.id, row.user_id, row.portfolio_id, current_price)
+        for row in rows
+    ))
+
+    return len(triggered_ids)
+
+
+async def process_tick():
+    """
+    Jeden cykl silnika: pobiera ceny wszystkich symboli z indeksu jednym zbiorczym zapytaniem
+    i sprawdza każde zlecenie względem tego samego, spójnego zrzutu cen.
+    """
+    started = time.perf_counter()
+    calls_before = price_feed.upstream_calls
+
+    symbols = order_index.symbols()
+    snapshot = await get_market_prices(symbols) if symbols else {}
+    # symbole przetwarzane właśnie po zdarzeniu ze strumienia są pomijane
+    counts = await asyncio.gather(*(
+        process_symbol(symbol, current_price)
+        for symbol, current_price in snapshot.items()
+        if symbol not in _streaming_symbols
+    ))
+    triggered = sum(counts)
+
+    engine_stats.ticks += 1
+    engine_stats.tick_duration_ms = (time.perf_counter() - started) * 1000
+    engine_stats.upstream_calls = price_feed.upstream_calls - calls_before
+    engine_stats.symbols = len(symbols)
+    engine_stats.triggered = triggered
+    logger.debug(
+        f"Engine tick: {engine_stats.tick_duration_ms:.1f} ms, "
+        f"{engine_stats.upstream_calls} upstream calls, {len(symbols)} symbols, {triggered} triggered"
+    )
+
+
+_streaming_prices: dict = {}
+_streaming_symbols: set = set()
+
+
+def on_price_update(symbol: str, price: float):
+    """
+    Wywoływana przez strumień cen przy każdej zmianie ceny. Jeśli cena przekroczyła
+    próg któregoś zlecenia, planuje przetworzenie symbolu; w przeciwnym razie nic nie robi.
+    """
+    if not order_index.triggered(symbol, price):
+        return
+    _streaming_prices[symbol] = price
+    if symbol not in _streaming_symbols:
+        _streaming_symbols.add(symbol)
+        asyncio.create_task(_drain_symbol(symbol))
+
+
+async def _drain_symbol(symbol: str):
+    """Przetwarza symbol po najnowszej cenie; ceny, które przyszły w trakcie, są scalane."""
+    try:
+        while symbol in _streaming_prices:
+            current_price = _streaming_prices.pop(symbol)
+            await process_symbol(symbol, current_price)
+    except Exception as e:
+        logger.error(f"Error processing orders for {symbol}: {str(e)}", exc_info=True)
+    finally:
+        _streaming_symbols.discard(symbol)
+
+
+async def process_orders_in_background():
+    """
+    Funkcja działająca w tle przetwarzająca zlecenia z tabeli OrdersFuture.
+    Zlecenia są wybierane z indeksu cen aktywacji, a nie przez skanowanie całej tabeli.
+    W trybie "stream" aktywują je zmiany cen ze strumienia, a odpytywanie co
+    ORDER_ENGINE_POLL_INTERVAL sekund działa tylko wtedy, gdy strumień jest niedostępny.
+    """
+    indexed = await rebuild_order_index()
+    logger.info(f"Order index rebuilt with {indexed} pending orders")
+
+    streaming = settings.ORDER_ENGINE_MODE == "stream"
+    if streaming:
+        price_feed.add_listener(on_price_update)
+
+    while True:
+        if streaming and price_feed.connected:
+            symbols = order_index.symbols()
+            # zlecenia złożone po cenie już przekroczonej nie doczekają się zmiany ceny,
+            # więc sprawdzamy je w pamięci względem ostatniej znanej ceny
+            for symbol in symbols:
+                entry = price_feed.get(symbol)
+                if entry is not None:
+                    on_price_update(symbol, entry[0])
+            await asyncio.sleep(settings.ORDER_ENGINE_POLL_INTERVAL)
+            continue
+
+        try:
+            await process_tick()
 
         except Exception as e:
             logger.error(f"Error processing orders: {str(e)}", exc_info=True) 
             print(f"Error processing orders: {e}")
-        finally:
-            db.close()
 
-        await asyncio.sleep(1)
\ No newline at end of file
+        await asyncio.sleep(settings.ORDER_ENGINE_POLL_INTERVAL)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from binance.exceptions import BinanceAPIException
+
+from config import settings
+from services.background import BackgroundTask
+from services.binance_client import get_async_client, socket_manager
+from services.logger import logger
+from services.upstream import Priority, TICKER_PRICE_WEIGHT, TICKER_PRICES_WEIGHT, upstream
+
+
+# kody błędów Binance dla nieznanego symbolu i niepoprawnej nazwy symbolu
+INVALID_SYMBOL_CODES = (-1121, -1100)
+
+
+class InvalidSymbol(ValueError):
+    """Źródło odrzuciło zapytanie z powodu nieznanego symbolu (w zapytaniu zbiorczym - całe zapytanie)."""
+
+
+def assign_streams(current: List[FrozenSet[str]], symbols: Set[str], max_streams: int) -> List[FrozenSet[str]]:
+    """
+    Przydział symboli do połączeń strumienia (najwyżej max_streams na połączenie). Połączenia, z których
+    nic nie ubyło, zostają bez zmian; nowe symbole dopełniają jedno połączenie z wolnym miejscem albo
+    trafiają do nowych, więc zmiana listy symboli otwiera ponownie tylko pojedyncze połączenia.
+    """
+    shards = [shard & symbols for shard in current]
+    shards = [set(shard) for shard in shards if shard]
+    new = sorted(symbols.difference(*shards))
+    if new:
+        room = [shard for shard in shards if len(shard) < max_streams]
+        target = room[0] if room else set()
+        if not room:
+            shards.append(target)
+        for symbol in new:
+            if len(target) >= max_streams:
+                target = set()
+                shards.append(target)
+            target.add(symbol)
+    return [frozenset(shard) for shard in shards]
+
+
+class BinanceTickerSource:
+    """
+    Źródło cen z Binance: multipleksowane strumienie <symbol>@<stream_type> dla subskrybowanych symboli
+    (najwyżej max_streams na połączenie) oraz REST jako awaryjne źródło. Lista symboli jest uzgadniana
+    co resync_interval sekund, więc wiele zmian w tym czasie daje najwyżej jedno przełączenie połączenia.
+    """
+
+    RECONNECT_DELAY = 5
+
+    def __init__(self, stream_type: str = settings.PRICE_STREAM, max_streams: int = settings.PRICE_STREAM_MAX_STREAMS,
+                 resync_interval: float = settings.PRICE_STREAM_RESYNC):
+        self.stream_type = stream_type
+        self.max_streams = max_streams
+        self.resync_interval = resync_interval
+        self.reconnects = 0
+        self._connections: Dict[FrozenSet[str], asyncio.Task] = {}
+        self._live: Set[FrozenSet[str]] = set()
+
+    async def fetch_price(self, symbol: str) -> float:
+        ticker = await upstream.call("get_symbol_ticker", TICKER_PRICE_WEIGHT, Priority.HIGH, symbol=symbol)
+        return float(ticker['price'])
+
+    async def fetch_prices(self, symbols: List[str]) -> Dict[str, float]:
+        try:
+            tickers = await upstream.call("get_symbol_ticker", TICKER_PRICES_WEIGHT, Priority.HIGH,
+                                          symbols=json.dumps(symbols, separators=(",", ":")))
+        except BinanceAPIException as e:
+            if e.code in INVALID_SYMBOL_CODES:
+                raise InvalidSymbol(e.message) from e
+            raise
+        return {ticker['symbol']: float(ticker['price']) for ticker in tickers}
+
+    def _update_connected(self, feed: "PriceFeed"):
+        # strumień jest kompletny dopiero, gdy działają wszystkie połączenia
+        feed.connected = bool(self._connections) and self._live >= set(self._connections)
+
+    async def _stream(self, feed: "PriceFeed", symbols: FrozenSet[str]):
+        streams = [f"{symbol.lower()}@{self.stream_type}" for symbol in sorted(symbols)]
+        while True:
+            try:
+                client = await get_async_client()
+                bsm = socket_manager(client)
+                async with bsm.multiplex_socket(streams) as socket:
+                    self._live.add(symbols)
+                    self._update_connected(feed)
+                    while True:
+                        msg = await socket.recv()
+                        data = msg.get("data", msg)
+                        if data.get("e") == "error":
+                            raise ConnectionError(data.get("m"))
+                        # tickery podają cenę w "c", strumienie transakcji w "p"
+                        price = data.get("c", data.get("p"))
+                        if "s" in data and price is not None:
+                            feed.update(data["s"], float(price))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Price stream error: {str(e)}")
+            finally:
+                self._live.discard(symbols)
+                self._update_connected(feed)
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def _resync(self, feed: "PriceFeed"):
+        shards = assign_streams(list(self._connections), feed.symbols, self.max_streams)
+        for shard in set(self._connections) - set(shards):
+            self._connections.pop(shard).cancel()
+        for shard in shards:
+            if shard not in self._connections:
+                self.reconnects += 1
+                self._connections[shard] = asyncio.create_task(self._stream(feed, shard))
+        self._update_connected(feed)
+
+    async def run(self, feed: "PriceFeed"):
+        try:
+            while True:
+                self._resync(feed)
+                await asyncio.sleep(self.resync_interval)
+        finally:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            self._live.clear()
+            feed.connected = False
+
+
+class FakePriceSource:
+    """Lokalne źródło cen (testy, praca offline). Ceny ustawia się przez push()."""
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None):
+        self.prices: Dict[str, float] = dict(prices or {})
+        self._feed: Optional["PriceFeed"] = None
+
+    def push(self, symbol: str, price: float):
+        self.prices[symbol] = price
+        if self._feed is not None:
+            self._feed.update(symbol, price)
+
+    async def fetch_price(self, symbol: str) -> float:
+        if symbol not in self.prices:
+            raise InvalidSymbol(f"Unknown symbol {symbol}")
+        return self.prices[symbol]
+
+    async def fetch_prices(self, symbols: List[str]) -> Dict[str, float]:
+        # jak Binance: jeden nieznany symbol odrzuca całe zapytanie zbiorcze
+        if any(symbol not in self.prices for symbol in symbols):
+            raise InvalidSymbol("Invalid symbol.")
+        return {symbol: self.prices[symbol] for symbol in symbols}
+
+    async def run(self, feed: "PriceFeed"):
+        self._feed = feed
+        for symbol, price in self.prices.items():
+            feed.update(symbol, price)
+        feed.connected = True
+        try:
+            await asyncio.Event().wait()
+        finally:
+            feed.connected = False
+            self._feed = None
+
+
+def create_price_source(name: str):
+    if name == "fake":
+        return FakePriceSource()
+    return BinanceTickerSource()
+
+
+class PriceFeed:
+    """
+    Współdzielona tabela ostatnich cen (symbol -> cena, znacznik czasu) zasilana strumieniem.
+    Po cenę przez REST sięga tylko wtedy, gdy ta w tabeli jest nieaktualna.
+    """
+
+    def __init__(self, source=None, max_age: float = settings.PRICE_MAX_AGE,
+                 lookup_ttl: float = settings.PRICE_LOOKUP_TTL):
+        self.source = source or BinanceTickerSource()
+        self.max_age = max_age
+        self.lookup_ttl = lookup_ttl
+        # symbole odrzucone przez źródło; pomijane w zapytaniach zbiorczych do pierwszej ceny ze strumienia
+        self.invalid_symbols: Set[str] = set()
+        self.connected = False
+        self.upstream_calls = 0
+        self._prices: Dict[str, Tuple[float, float]] = {}
+        self._listeners: List[Callable[[str, float], None]] = []
+        # liczba subskrypcji symbolu (np. indeks zleceń) i czas ostatniego odczytu symboli bez subskrypcji
+        self._refs: Dict[str, int] = {}
+        self._lookups: Dict[str, float] = {}
+        self._task = BackgroundTask("price feed")
+
+    @property
+    def symbols(self) -> Set[str]:
+        """Symbole strumienia: subskrybowane oraz odczytywane w ciągu ostatnich lookup_ttl sekund."""
+        now = time.time()
+        self._lookups = {symbol: at for symbol, at in self._lookups.items() if now - at <= self.lookup_ttl}
+        return (set(self._refs) | set(self._lookups)) - self.invalid_symbols
+
+    def set_source(self, source):
+        self.source = source
+        self._prices.clear()
+        self.invalid_symbols.clear()
+
+    def subscribe(self, symbols: Iterable[str]):
+        """Utrzymuje symbole w strumieniu do odpowiadającego im unsubscribe."""
+        for symbol in symbols:
+            self._refs[symbol] = self._refs.get(symbol, 0) + 1
+
+    def unsubscribe(self, symbols: Iterable[str]):
+        for symbol in symbols:
+            count = self._refs.get(symbol, 0) - 1
+            if count > 0:
+                self._refs[symbol] = count
+            else:
+                self._refs.pop(symbol, None)
+
+    def _looked_up(self, symbols: Iterable[str]):
+        now = time.time()
+        for symbol in symbols:
+            self._lookups[symbol] = now
+
+    def add_listener(self, callback: Callable[[str, float], None]):
+        """Rejestruje funkcję wywoływaną przy każdej zmianie ceny symbolu."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, float], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def update(self, symbol: str, price: float, timestamp: Optional[float] = None):
+        previous = self._prices.get(symbol)
+        self.invalid_symbols.discard(symbol)
+        self._prices[symbol] = (price, timestamp if timestamp is not None else time.time())
+        if previous is not None and previous[0] == price:
+            return
+        for callback in self._listeners:
+            try:
+                callback(symbol, price)
+            except Exception as e:
+                logger.error(f"Price listener error: {str(e)}", exc_info=True)
+
+    def get(self, symbol: str) -> Optional[Tuple[float, float]]:
+        """Zwraca (cena, znacznik czasu) albo None, jeśli brak ceny lub jest nieaktualna."""
+        entry = self._prices.get(symbol)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            return None
+        return entry
+
+    async def get_price(self, symbol: str) -> float:
+        self._looked_up([symbol])
+        entry = self.get(symbol)
+        if entry is not None:
+            return entry[0]
+
+        self.upstream_calls += 1
+        price = await self.source.fetch_price(symbol)
+        self.update(symbol, price)
+        return price
+
+    async def get_quotes(self, symbols: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+        """
+        Zwraca spójny zrzut (cena, znacznik czasu) dla wielu symboli. Aktualne ceny pochodzą z tabeli,
+        a wszystkie nieaktualne są pobierane jednym zbiorczym zapytaniem.
+        """
+        symbols = set(symbols)
+        self._looked_up(symbols)
+        snapshot = {}
+        stale = []
+        for symbol in symbols:
+            entry = self.get(symbol)
+            if entry is not None:
+                snapshot[symbol] = entry
+            elif symbol not in self.invalid_symbols:
+                stale.append(symbol)
+
+        if stale:
+            fetched = await self._fetch_prices(sorted(stale))
+            now = time.time()
+            for symbol, price in fetched.items():
+                self.update(symbol, price, now)
+                snapshot[symbol] = (price, now)
+        return snapshot
+
+    async def _fetch_prices(self, symbols: List[str]) -> Dict[str, float]:
+        """
+        Zbiorcze pobranie cen odporne na nieznane symbole. Binance odrzuca całe zapytanie i nie mówi,
+        który symbol jest zły, więc lista jest dzielona na połowy, aż złe symbole zostaną wskazane
+        i odłożone do invalid_symbols - pozostałe ceny są zwracane normalnie.
+        """
+        self.upstream_calls += 1
+        try:
+            return await self.source.fetch_prices(symbols)
+        except InvalidSymbol:
+            if len(symbols) == 1:
+                logger.warning(f"Price source rejected symbol {symbols[0]}, skipping it in bulk fetches")
+                self.invalid_symbols.add(symbols[0])
+                return {}
+            middle = len(symbols) // 2
+            return {**await self._fetch_prices(symbols[:middle]), **await self._fetch_prices(symbols[middle:])}
+
+    async def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """Jak get_quotes, ale same ceny."""
+        return {symbol: price for symbol, (price, _) in (await self.get_quotes(symbols)).items()}
+
+    async def start(self):
+        self._task.start(self.source.run, self)
+
+    async def stop(self):
+        await self._task.stop()
+
+
+price_feed = PriceFeed(source=create_price_source(settings.PRICE_FEED))
@@ -0,0 +1,311 @@
+"""
+Model odczytu sald (CurrencyBalance) i pozycji (PortfolioAsset) użytkowników w pamięci procesu.
+
+Stan użytkownika jest wczytywany z bazy przy pierwszym odczycie, a potem aktualizowany zdarzeniami
+z zapisów (zlecenia, wpłaty, transfery), więc odczyty /balances i portfeli nie sięgają do bazy.
+Każdy zapis otwiera writing(user_id) i rejestruje w nim swoje zmiany, które trafiają do modelu
+dopiero po udanym commit; wczytanie, które nałożyło się na zapis tego samego użytkownika,
+nie jest zapamiętywane. Okresowo model porównywany jest z bazą, a nieaktywni użytkownicy usuwani.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from config import settings
+from models.user import AsyncSessionLocal, CurrencyBalance, Portfolio
+from services.background import BackgroundTask
+from services.crud import POSITION_DUST
+from services.logger import logger
+
+
+class Position:
+    """Pozycja w portfelu; te same pola co PortfolioAsset, więc pasuje do value_assets."""
+
+    __slots__ = ("symbol", "currency_type", "amount", "buy_price", "buy_currency")
+
+    def __init__(self, symbol: str, currency_type: Optional[str], amount: float, buy_price: Optional[float],
+                 buy_currency: Optional[str]):
+        self.symbol = symbol
+        self.currency_type = currency_type
+        self.amount = amount
+        self.buy_price = buy_price
+        self.buy_currency = buy_currency
+
+    def as_tuple(self) -> tuple:
+        return self.symbol, self.currency_type, self.amount, self.buy_price, self.buy_currency
+
+
+class PortfolioView:
+    __slots__ = ("id", "name", "assets")
+
+    def __init__(self, portfolio_id: int, name: str):
+        self.id = portfolio_id
+        self.name = name
+        self.assets: Dict[str, Position] = {}
+
+
+class AccountView:
+    __slots__ = ("user_id", "balances", "portfolios", "last_access")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.balances: Dict[str, float] = {}
+        self.portfolios: Dict[int, PortfolioView] = {}
+        self.last_access = 0.0
+
+
+class Changes:
+    """Zmiany jednej transakcji zapisu, odwzorowujące zapytania z services.crud."""
+
+    def __init__(self):
+        self.operations: List[Callable[[AccountView], None]] = []
+
+    def balance(self, currency: str, amount_change: float):
+        def apply(account: AccountView):
+            account.balances[currency] = account.balances.get(currency, 0.0) + amount_change
+        self.operations.append(apply)
+
+    def add_position(self, portfolio_id: int, symbol: str, amount: float, price: float, buy_currency: str,
+                     currency_type: str = "crypto"):
+        def apply(account: AccountView):
+            assets = account.portfolios[portfolio_id].assets
+            position = assets.get(symbol)
+            if position is None:
+                assets[symbol] = Position(symbol, currency_type, amount, price, buy_currency)
+            else:
+                # średnia cena zakupu ważona ilością, jak w _add_position_stmt
+                position.buy_price = (position.amount * position.buy_price + amount * price) / (position.amount + amount)
+                position.amount += amount
+        self.operations.append(apply)
+
+    def reduce_position(self, portfolio_id: int, symbol: str, amount: float):
+        def apply(account: AccountView):
+            assets = account.portfolios[portfolio_id].assets
+            position = assets[symbol]
+            position.amount -= amount
+            if position.amount <= POSITION_DUST:
+                del assets[symbol]
+        self.operations.append(apply)
+
+    def portfolio(self, portfolio_id: int, name: str):
+        def apply(account: AccountView):
+            account.portfolios[portfolio_id] = PortfolioView(portfolio_id, name)
+        self.operations.append(apply)
+
+
+class ReadModelStats:
+    def __init__(self):
+        self.hits = 0
+        self.loads = 0
+        self.discarded_loads = 0
+        self.events = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.mismatches = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _snapshot(account: AccountView) -> tuple:
+    """Porównywalny zapis stanu (kwoty zaokrąglone, bo zdarzenia i SQL liczą w innej kolejności)."""
+    return (
+        {currency: round(amount, 8) for currency, amount in account.balances.items()},
+        {pid: (p.name, {s: tuple(round(v, 8) if isinstance(v, float) else v for v in a.as_tuple())
+                        for s, a in p.assets.items()})
+         for pid, p in account.portfolios.items()},
+    )
+
+
+class AccountReadModel:
+    def __init__(self, session_factory=None, idle_ttl: float = settings.READ_MODEL_IDLE_TTL,
+                 max_users: int = settings.READ_MODEL_MAX_USERS,
+                 check_interval: float = settings.READ_MODEL_CHECK_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.check_interval = check_interval
+        self.clock = clock
+        self.stats = ReadModelStats()
+        self._accounts: "OrderedDict[int, AccountView]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._writes: Dict[int, int] = {}  # użytkownik -> zapisy w toku
+        self._epochs: Dict[int, int] = {}  # użytkownik -> licznik rozpoczętych i zakończonych zapisów
+        self._watchers: Dict[int, int] = {}  # użytkownik -> wczytania i porównania z bazą w toku
+        self._task = BackgroundTask("read model maintenance")
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def clear(self):
+        self._accounts.clear()
+
+    async def _load_many(self, user_ids: List[int]) -> Dict[int, AccountView]:
+        """Stan wielu użytkowników stałą liczbą zapytań: salda, portfele i ich pozycje (selectinload)."""
+        accounts = {user_id: AccountView(user_id) for user_id in user_ids}
+        async with self.session_factory() as session:
+            balances = await session.execute(select(
+                CurrencyBalance.user_id, CurrencyBalance.currency, CurrencyBalance.amount
+            ).where(CurrencyBalance.user_id.in_(user_ids)))
+            for user_id, currency, amount in balances:
+                accounts[user_id].balances[currency] = amount
+            portfolios = await session.scalars(select(Portfolio).where(Portfolio.user_id.in_(user_ids))
+                                               .options(selectinload(Portfolio.assets)))
+            for portfolio in portfolios:
+                view = accounts[portfolio.user_id].portfolios[portfolio.id] = PortfolioView(portfolio.id, portfolio.name)
+                for asset in portfolio.assets:
+                    view.assets[asset.symbol] = Position(asset.symbol, asset.currency_type, asset.amount,
+                                                         asset.buy_price, asset.buy_currency)
+        return accounts
+
+    def _quiet(self, user_id: int, epoch: int) -> bool:
+        """Czy od chwili, gdy licznik zapisów wynosił epoch, żaden zapis użytkownika się nie zaczął ani nie skończył."""
+        return self._epochs.get(user_id, 0) == epoch and not self._writes.get(user_id)
+
+    def _store(self, account: AccountView):
+        account.last_access = self.clock()
+        self._accounts[account.user_id] = account
+        self._accounts.move_to_end(account.user_id)
+        while len(self._accounts) > self.max_users:
+            self._accounts.popitem(last=False)
+            self.stats.evictions += 1
+
+    @contextmanager
+    def _watch(self, user_ids: List[int]):
+        """Na czas odczytu z bazy liczniki zapisów tych użytkowników nie są usuwane."""
+        for user_id in user_ids:
+            self._watchers[user_id] = self._watchers.get(user_id, 0) + 1
+        try:
+            yield {user_id: self._epochs.get(user_id, 0) for user_id in user_ids}
+        finally:
+            for user_id in user_ids:
+                self._watchers[user_id] -= 1
+                self._forget_epoch(user_id)
+
+    async def _load(self, user_id: int) -> AccountView:
+        try:
+            with self._watch([user_id]) as epochs:
+                self.stats.loads += 1
+                account = (await self._load_many([user_id]))[user_id]
+                if self._quiet(user_id, epochs[user_id]):
+                    self._store(account)
+                else:
+                    # w trakcie wczytywania zmienił się stan w bazie - zdarzenie mogło już być w wyniku albo nie
+                    self.stats.discarded_loads += 1
+                return account
+        finally:
+            del self._loading[user_id]
+
+    async def get(self, user_id: int) -> AccountView:
+        """Salda i portfele użytkownika; z bazy tylko przy pierwszym odczycie."""
+        account = self._accounts.get(user_id)
+        if account is not None:
+            self.stats.hits += 1
+            account.last_access = self.clock()
+            self._accounts.move_to_end(user_id)
+            return account
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+        return await asyncio.shield(loading)
+
+    def _forget_epoch(self, user_id: int):
+        if not self._writes.get(user_id) and not self._watchers.get(user_id):
+            self._writes.pop(user_id, None)
+            self._epochs.pop(user_id, None)
+            self._watchers.pop(user_id, None)
+
+    @contextmanager
+    def writing(self, user_id: int):
+        """
+        Obejmuje transakcję zapisu sald lub pozycji użytkownika (łącznie z commit). Zmiany zarejestrowane
+        w zwróconym Changes trafiają do modelu po wyjściu bez wyjątku; po wyjątku stan jest unieważniany.
+        """
+        changes = Changes()
+        self._writes[user_id] = self._writes.get(user_id, 0) + 1
+        self._epochs[user_id] = self._epochs.get(user_id, 0) + 1
+        try:
+            yield changes
+        except BaseException:
+            self.invalidate(user_id)
+            raise
+        else:
+            self._apply(user_id, changes)
+        finally:
+            self._writes[user_id] -= 1
+            self._epochs[user_id] += 1
+            self._forget_epoch(user_id)
+
+    def _apply(self, user_id: int, changes: Changes):
+        account = self._accounts.get(user_id)
+        if account is None or not changes.operations:
+            return
+        try:
+            for operation in changes.operations:
+                operation(account)
+            self.stats.events += len(changes.operations)
+        except Exception as e:
+            logger.warning(f"Read model event for user {user_id} did not apply ({e!r}), reloading on next read")
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: int):
+        if self._accounts.pop(user_id, None) is not None:
+            self.stats.invalidations += 1
+
+    def evict_idle(self) -> int:
+        """Usuwa użytkowników bez odczytu od idle_ttl sekund."""
+        deadline = self.clock() - self.idle_ttl
+        idle = [user_id for user_id, account in self._accounts.items() if account.last_access < deadline]
+        for user_id in idle:
+            del self._accounts[user_id]
+        self.stats.evictions += len(idle)
+        return len(idle)
+
+    async def verify(self, user_ids: Optional[Iterable[int]] = None, batch: int = 500) -> List[int]:
+        """
+        Porównuje stan w pamięci z bazą (domyślnie dla wszystkich wczytanych użytkowników).
+        Rozbieżny stan jest zastępowany stanem z bazy; zwraca użytkowników z rozbieżnościami.
+        """
+        user_ids = [u for u in (user_ids if user_ids is not None else list(self._accounts)) if u in self._accounts]
+        mismatched = []
+        for start in range(0, len(user_ids), batch):
+            chunk = user_ids[start:start + batch]
+            with self._watch(chunk) as epochs:
+                fresh = await self._load_many(chunk)
+                for user_id in chunk:
+                    account = self._accounts.get(user_id)
+                    # stan zmieniany w trakcie porównania zostanie sprawdzony przy następnym przebiegu
+                    if account is None or not self._quiet(user_id, epochs[user_id]):
+                        continue
+                    if _snapshot(account) != _snapshot(fresh[user_id]):
+                        mismatched.append(user_id)
+                        fresh[user_id].last_access = account.last_access
+                        self._accounts[user_id] = fresh[user_id]
+        if mismatched:
+            self.stats.mismatches += len(mismatched)
+            logger.warning(f"Read model out of sync with the database for users {mismatched}, reloaded")
+        return mismatched
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.evict_idle()
+                await self.verify()
+            except Exception as e:
+                logger.error(f"Read model check failed: {str(e)}", exc_info=True)
+
+    async def start(self):
+        self._task.start(self._maintenance_loop)
+
+    async def stop(self):
+        await self._task.stop()
+
+
+read_model = AccountReadModel()
@@ -0,0 +1,131 @@
+"""
+Okresowe zrzuty wartości portfeli (krzywa kapitału).
+
+Co SNAPSHOT_INTERVAL sekund wszystkie pozycje wszystkich portfeli są wyceniane jednym przebiegiem:
+jedno zapytanie o pozycje, kursy z grafu przeliczeń (services.conversion) i sumy per portfel
+(np.bincount), a wynik trafia do tabeli portfolio_snapshots jednym wsadowym INSERT-em.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+
+from config import settings
+from models.user import AsyncSessionLocal, Portfolio, PortfolioAsset, PortfolioSnapshot
+from services.background import BackgroundTask
+from services.conversion import ConversionGraph, conversion_graph
+from services.crud import _upsert_insert
+from services.logger import logger
+from services.valuation import mark_to_market, normalize_currency
+
+
+def downsample(times: np.ndarray, values: np.ndarray, costs: np.ndarray, start: int, end: int,
+               points: int) -> List[Dict]:
+    """
+    Dzieli [start, end] na `points` równych przedziałów i z każdego niepustego zwraca ostatni zrzut
+    (jak cena zamknięcia świecy) - krzywa kończy się zawsze najnowszą wartością z zakresu.
+    """
+    if not len(times):
+        return []
+    buckets = (times - start) * points // max(end - start + 1, 1)
+    last = np.append(np.flatnonzero(np.diff(buckets)), len(times) - 1)
+    return [{"time": datetime.fromtimestamp(int(ts), timezone.utc).isoformat(), "value": float(value),
+             "cost": float(cost)}
+            for ts, value, cost in zip(times[last], values[last], costs[last])]
+
+
+class PortfolioSnapshotter:
+    def __init__(self, interval: float = settings.SNAPSHOT_INTERVAL, currency: str = settings.SNAPSHOT_CURRENCY,
+                 graph: ConversionGraph = conversion_graph, session_factory=None):
+        self.interval = interval
+        self.currency = normalize_currency(currency)
+        self.graph = graph
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.snapshots = 0
+        self._task = BackgroundTask("portfolio snapshots")
+
+    async def snapshot(self, timestamp: Optional[int] = None) -> int:
+        """Zapisuje wartość wszystkich portfeli; zwraca liczbę zapisanych wierszy."""
+        info = self.graph.info
+        if info is None:
+            logger.warning("Conversion graph is not built yet, skipping portfolio snapshot")
+            return 0
+        ts = int(timestamp if timestamp is not None else time.time())
+
+        async with self.session_factory() as session:
+            portfolio_ids = np.array((await session.scalars(select(Portfolio.id).order_by(Portfolio.id))).all(),
+                                     dtype=np.int64)
+            if not len(portfolio_ids):
+                return 0
+            rows = (await session.execute(select(
+                PortfolioAsset.portfolio_id, PortfolioAsset.symbol, PortfolioAsset.amount,
+                PortfolioAsset.buy_price, PortfolioAsset.buy_currency
+            ))).all()
+            owners, symbols, amounts, buy_prices, buy_currencies = zip(*rows) if rows else ((), (), (), (), ())
+
+            _, values, costs, _ = mark_to_market(
+                self.graph, info, symbols, np.array([a or 0.0 for a in amounts], dtype=float),
+                np.array([p or 0.0 for p in buy_prices], dtype=float), buy_currencies, self.currency)
+            # pozycje bez kursu nie wchodzą do sum, jak w wycenie portfela
+            priced = ~np.isnan(values - costs)
+            position = np.searchsorted(portfolio_ids, np.array(owners, dtype=np.int64))
+            totals = np.bincount(position[priced], weights=values[priced], minlength=len(portfolio_ids))
+            total_costs = np.bincount(position[priced], weights=costs[priced], minlength=len(portfolio_ids))
+
+            records = [{"portfolio_id": portfolio_id, "ts": ts, "value": value, "cost": cost}
+                       for portfolio_id, value, cost in zip(portfolio_ids.tolist(), totals.tolist(),
+                                                            total_costs.tolist())]
+            # zrzut ręczny i planowy w tej samej sekundzie trafiają w ten sam klucz (portfolio_id, ts):
+            # późniejsza wycena zastępuje wcześniejszą zamiast przerywać zadanie błędem IntegrityError
+            upsert = _upsert_insert(session)
+            if upsert is not None:
+                stmt = upsert(PortfolioSnapshot)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[PortfolioSnapshot.portfolio_id, PortfolioSnapshot.ts],
+                    set_={"value": stmt.excluded.value, "cost": stmt.excluded.cost}), records)
+            else:
+                await session.execute(delete(PortfolioSnapshot).where(PortfolioSnapshot.ts == ts))
+                await session.execute(insert(PortfolioSnapshot), records)
+            await session.commit()
+        self.snapshots += 1
+        return len(portfolio_ids)
+
+    async def _snapshot_loop(self):
+        while True:
+            # zrzuty wyrównane do wielokrotności interwału, aby krzywe różnych portfeli miały te same punkty
+            await asyncio.sleep(self.interval - time.time() % self.interval)
+            try:
+                await self.snapshot()
+            except Exception as e:
+                logger.error(f"Portfolio snapshot failed: {str(e)}", exc_info=True)
+
+    async def start(self):
+        self._task.start(self._snapshot_loop)
+
+    async def stop(self):
+        await self._task.stop()
+
+
+async def equity_curve(session, portfolio_id: int, start: Optional[int], end: int, points: int) -> List[Dict]:
+    """
+    Krzywa kapitału portfela z zakresu [start, end] (sekundy od epoki), najwyżej `points` punktów.
+    Bez start zakres zaczyna się od pierwszego zrzutu.
+    """
+    rows = (await session.execute(
+        select(PortfolioSnapshot.ts, PortfolioSnapshot.value, PortfolioSnapshot.cost)
+        .where(PortfolioSnapshot.portfolio_id == portfolio_id,
+               PortfolioSnapshot.ts >= (start or 0), PortfolioSnapshot.ts <= end)
+        .order_by(PortfolioSnapshot.ts)
+    )).all()
+    if not rows:
+        return []
+    times, values, costs = (np.array(column) for column in zip(*rows))
+    times = times.astype(np.int64)
+    return downsample(times, values.astype(float), costs.astype(float),
+                      int(times[0]) if start is None else start, end, points)
+
+
+portfolio_snapshotter = PortfolioSnapshotter()
@@ -0,0 +1,249 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from config import settings
+from services.binance_client import get_async_client, socket_manager
+from services.logger import logger
+
+# upstream(symbol, publish) - czyta strumień jednego symbolu i przekazuje każdą wiadomość do publish
+Upstream = Callable[[str, Callable[[dict], None]], Awaitable[None]]
+
+RECONNECT_DELAY = 5
+
+
+async def binance_ticker_upstream(symbol: str, publish: Callable[[dict], None]):
+    """Jeden strumień <symbol>@ticker z Binance, wznawiany po błędzie."""
+    while True:
+        try:
+            client = await get_async_client()
+            bsm = socket_manager(client)
+            async with bsm.symbol_ticker_socket(symbol) as socket:
+                while True:
+                    msg = await socket.recv()
+                    if msg.get("e") == "error":
+                        raise ConnectionError(msg.get("m"))
+                    publish(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ticker stream error for {symbol}: {str(e)}")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+class Subscription:
+    """
+    Ograniczona kolejka wiadomości jednego klienta. Gdy klient nie nadąża, najstarsza wiadomość
+    jest zastępowana najnowszą (konflacja); po max_conflated takich zastąpieniach z rzędu
+    klient jest odłączany.
+    """
+
+    def __init__(self, symbol: str, queue_size: int, max_conflated: int):
+        self.symbol = symbol
+        self.max_conflated = max_conflated
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.conflated = 0
+        self.closed = False
+        self._lagging = 0
+
+    def offer(self, payload: str):
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.conflated += 1
+            self._lagging += 1
+            if self._lagging > self.max_conflated:
+                logger.warning(f"Dropping slow ticker subscriber for {self.symbol}")
+                self.close()
+                return
+        else:
+            self._lagging = 0
+        self.queue.put_nowait(payload)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        payload = await self.queue.get()
+        if payload is None:
+            raise StopAsyncIteration
+        return payload
+
+
+class _Channel:
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.listeners: List[Callable[[str, dict], None]] = []
+        self.task: Optional[asyncio.Task] = None
+        self.message: Optional[dict] = None
+        self.last: Optional[str] = None
+
+    def __len__(self):
+        return len(self.subscribers) + len(self.listeners)
+
+
+class TickerHub:
+    """
+    Jedna subskrypcja upstream na symbol, rozsyłana do wszystkich lokalnych klientów.
+    Wiadomość jest serializowana raz; strumień zamyka się, gdy odejdzie ostatni klient.
+    """
+
+    def __init__(self, upstream: Optional[Upstream] = None, queue_size: int = settings.WS_SEND_QUEUE_SIZE,
+                 max_conflated: int = settings.WS_MAX_CONFLATED):
+        self.upstream = upstream or binance_ticker_upstream
+        self.queue_size = queue_size
+        self.max_conflated = max_conflated
+        self._channels: Dict[str, _Channel] = {}
+
+    @property
+    def upstream_count(self) -> int:
+        return sum(1 for channel in self._channels.values() if channel.task is not None)
+
+    def subscriber_counts(self) -> Dict[str, int]:
+        return {symbol: len(channel) for symbol, channel in self._channels.items()}
+
+    def _acquire(self, symbol: str) -> _Channel:
+        channel = self._channels.setdefault(symbol, _Channel())
+        if channel.task is None:
+            channel.task = asyncio.create_task(self.upstream(symbol, lambda msg: self.publish(symbol, msg)))
+        return channel
+
+    def _release(self, symbol: str):
+        channel = self._channels.get(symbol)
+        if channel is not None and not channel:
+            if channel.task is not None:
+                channel.task.cancel()
+            del self._channels[symbol]
+
+    def subscribe(self, symbol: str) -> Subscription:
+        symbol = symbol.upper()
+        channel = self._acquire(symbol)
+        subscription = Subscription(symbol, self.queue_size, self.max_conflated)
+        channel.subscribers.add(subscription)
+        if channel.message is not None:
+            if channel.last is None:
+                channel.last = json.dumps(channel.message)
+            subscription.offer(channel.last)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        channel = self._channels.get(subscription.symbol)
+        if channel is not None:
+            channel.subscribers.discard(subscription)
+            self._release(subscription.symbol)
+
+    def add_listener(self, symbol: str, callback: Callable[[str, dict], None]):
+        """Rejestruje funkcję wywoływaną z każdą wiadomością symbolu (liczy się jak subskrybent)."""
+        channel = self._acquire(symbol)
+        if callback not in channel.listeners:
+            channel.listeners.append(callback)
+            if channel.message is not None:
+                callback(symbol, channel.message)
+
+    def remove_listener(self, symbol: str, callback: Callable[[str, dict], None]):
+        channel = self._channels.get(symbol)
+        if channel is not None and callback in channel.listeners:
+            channel.listeners.remove(callback)
+            self._release(symbol)
+
+    @asynccontextmanager
+    async def subscription(self, symbol: str):
+        subscription = self.subscribe(symbol)
+        try:
+            yield subscription
+        finally:
+            self.unsubscribe(subscription)
+
+    def publish(self, symbol: str, message: dict):
+        channel = self._channels.get(symbol)
+        if channel is None:
+            return
+        channel.message = message
+        # serializacja tylko dla subskrybentów kolejkowych (raz na wiadomość)
+        channel.last = json.dumps(message) if channel.subscribers else None
+        for subscription in list(channel.subscribers):
+            subscription.offer(channel.last)
+        for callback in list(channel.listeners):
+            try:
+                callback(symbol, message)
+            except Exception as e:
+                logger.error(f"Ticker listener error: {str(e)}", exc_info=True)
+
+
+# pola tickera wysyłane w paczkach Watchlist: ostatnia cena, zmiana %, max, min, wolumen, czas zdarzenia
+COMPACT_FIELDS = ("c", "P", "h", "l", "v", "E")
+
+
+def compact_ticker(message: dict) -> dict:
+    return {field: message[field] for field in COMPACT_FIELDS if field in message}
+
+
+class Watchlist:
+    """
+    Subskrypcja wielu symboli jednym połączeniem. Między wysyłkami przechowywany jest tylko
+    najnowszy stan każdego symbolu, a next_batch zwraca je najwyżej raz na interval sekund.
+    """
+
+    def __init__(self, hub: "TickerHub", interval: float, max_symbols: int = settings.WS_MAX_SYMBOLS):
+        self.hub = hub
+        self.interval = interval
+        self.max_symbols = max_symbols
+        self.symbols: Set[str] = set()
+        self._latest: Dict[str, dict] = {}
+        self._ready = asyncio.Event()
+        self._last_sent = 0.0
+
+    def _on_message(self, symbol: str, message: dict):
+        self._latest[symbol] = message
+        self._ready.set()
+
+    def subscribe(self, symbols: Iterable[str]) -> List[str]:
+        """Dodaje symbole do listy. Zwraca dodane symbole (bez przekraczania max_symbols)."""
+        added = []
+        for symbol in symbols:
+            symbol = symbol.upper()
+            if symbol in self.symbols or len(self.symbols) >= self.max_symbols:
+                continue
+            self.symbols.add(symbol)
+            self.hub.add_listener(symbol, self._on_message)
+            added.append(symbol)
+        return added
+
+    def unsubscribe(self, symbols: Iterable[str]):
+        for symbol in symbols:
+            symbol = symbol.upper()
+            if symbol in self.symbols:
+                self.symbols.discard(symbol)
+                self.hub.remove_listener(symbol, self._on_message)
+                self._latest.pop(symbol, None)
+
+    def close(self):
+        self.unsubscribe(list(self.symbols))
+
+    async def next_batch(self) -> Dict[str, dict]:
+        """Czeka na zmiany i zwraca {symbol: skrócony ticker} nie częściej niż co interval sekund."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.wait()
+            delay = self._last_sent + self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._ready.clear()
+            batch, self._latest = self._latest, {}
+            if batch:
+                self._last_sent = loop.time()
+                return {symbol: compact_ticker(message) for symbol, message in batch.items()}
+
+
+ticker_hub = TickerHub()
@@ -0,0 +1,173 @@
+"""
+Wspólna brama do REST API Binance: budżet wagi zapytań (token bucket zsynchronizowany
+z nagłówkiem X-MBX-USED-WEIGHT-1M) i priorytety. Wykonywanie zleceń ma pierwszeństwo
+przed metadanymi giełdy, a te przed historią; przy niskim budżecie zapytania o niższym
+priorytecie czekają w kolejce albo są odrzucane (UpstreamBusy).
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from binance.exceptions import BinanceAPIException
+
+from config import settings
+from services.binance_client import get_async_client
+from services.logger import logger
+
+USED_WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1M"
+
+# wagi zapytań wg dokumentacji Binance
+EXCHANGE_INFO_WEIGHT = 20
+TICKER_PRICE_WEIGHT = 2
+TICKER_PRICES_WEIGHT = 4
+TICKER_ALL_WEIGHT = 4
+
+
+def kline_weight(limit: int) -> int:
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    return 5 if limit <= 1000 else 10
+
+
+class Priority(IntEnum):
+    HIGH = 0  # ceny dla wykonywania zleceń
+    NORMAL = 1  # metadane giełdy (exchangeInfo)
+    LOW = 2  # historia świec
+
+
+# część budżetu, której dany priorytet nie może zużyć (zostaje dla wyższych priorytetów)
+RESERVES = {Priority.HIGH: 0.0, Priority.NORMAL: 0.2, Priority.LOW: 0.4}
+# najdłuższe oczekiwanie w kolejce, po którym zapytanie jest odrzucane
+MAX_WAIT = {Priority.HIGH: 30.0, Priority.NORMAL: 5.0, Priority.LOW: 1.0}
+
+
+# odpowiedzi z bieżącego wywołania bramy; AsyncClient zapisuje ostatnią odpowiedź we wspólnym
+# atrybucie client.response, który przy współbieżnych wywołaniach może należeć do innego zapytania
+_call_responses: ContextVar[Optional[list]] = ContextVar("upstream_call_responses", default=None)
+
+
+def _capture_responses(client):
+    """Podpina do klienta zapis każdej odpowiedzi w kontekście wywołania, które ją otrzymało (raz na klienta)."""
+    if getattr(client, "_captures_responses", False):
+        return
+    handle_response = client._handle_response
+
+    async def capturing_handle_response(response):
+        responses = _call_responses.get()
+        if responses is not None:
+            responses.append(response)
+        return await handle_response(response)
+
+    client._handle_response = capturing_handle_response
+    client._captures_responses = True
+
+
+class UpstreamBusy(Exception):
+    """Zapytanie odrzucone, bo budżet wagi dla jego priorytetu wyczerpał się na dłużej niż MAX_WAIT."""
+
+    def __init__(self, priority: Priority, retry_after: float):
+        super().__init__(f"Binance weight budget exhausted for {priority.name.lower()} priority calls")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class UpstreamStats:
+    def __init__(self):
+        self.calls = {priority.name.lower(): 0 for priority in Priority}
+        self.shed = {priority.name.lower(): 0 for priority in Priority}
+        self.queued = 0
+        self.throttled = 0
+
+    def as_dict(self) -> dict:
+        return {"calls": dict(self.calls), "shed": dict(self.shed), "queued": self.queued,
+                "throttled": self.throttled}
+
+
+class UpstreamGateway:
+    """
+    Token bucket o pojemności `limit` wagi odnawiany w ciągu `window` sekund. Po każdej odpowiedzi
+    budżet jest obniżany do tego, co zostało według Binance (wagę liczy się per IP, więc mogą ją
+    zużywać też inne procesy). Po 429/418 wszystkie zapytania wstrzymują się na Retry-After.
+    """
+
+    def __init__(self, limit: int = settings.BINANCE_WEIGHT_LIMIT, window: float = 60.0,
+                 client: Callable[[], Awaitable[Any]] = get_async_client,
+                 reserves: Optional[Dict[Priority, float]] = None, max_wait: Optional[Dict[Priority, float]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = limit
+        self.rate = limit / window
+        self.client = client
+        self.reserves = reserves or RESERVES
+        self.max_wait = max_wait or MAX_WAIT
+        self.clock = clock
+        self.tokens = float(limit)
+        self.used_weight: Optional[int] = None
+        self.blocked_until = 0.0
+        self.stats = UpstreamStats()
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.limit, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, weight: int, priority: Priority) -> float:
+        """Ile sekund trzeba czekać, aby zapytanie o wadze weight zmieściło się nad rezerwą priorytetu."""
+        self._refill()
+        floor = self.reserves[priority] * self.limit
+        missing = weight + floor - self.tokens
+        blocked = max(0.0, self.blocked_until - self.clock())
+        return max(blocked, missing / self.rate if missing > 0 else 0.0)
+
+    async def acquire(self, weight: int, priority: Priority):
+        wait = self._wait_time(weight, priority)
+        if wait > self.max_wait[priority]:
+            self.stats.shed[priority.name.lower()] += 1
+            raise UpstreamBusy(priority, wait)
+        if wait > 0:
+            self.stats.queued += 1
+        # wyższe priorytety mają mniejszą rezerwę, więc przy odnawianiu budżetu dostają go pierwsze
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._wait_time(weight, priority)
+        self.tokens -= weight
+
+    def _sync(self, response):
+        """Uzgadnia budżet z nagłówkiem zużytej wagi z odpowiedzi na to wywołanie."""
+        used = response.headers.get(USED_WEIGHT_HEADER) if response is not None else None
+        if used is None:
+            return
+        self.used_weight = int(used)
+        self._refill()
+        self.tokens = min(self.tokens, self.limit - self.used_weight)
+
+    def _throttled(self, e: BinanceAPIException):
+        self.stats.throttled += 1
+        retry_after = float(e.response.headers.get("Retry-After", 60))
+        self.blocked_until = max(self.blocked_until, self.clock() + retry_after)
+        logger.warning(f"Binance rate limit hit ({e.status_code}), pausing upstream calls for {retry_after}s")
+
+    async def call(self, method: str, weight: int, priority: Priority, **params) -> Any:
+        """Wywołuje metodę AsyncClient (np. get_klines) po zarezerwowaniu wagi w budżecie."""
+        await self.acquire(weight, priority)
+        self.stats.calls[priority.name.lower()] += 1
+        client = await self.client()
+        _capture_responses(client)
+        responses = []
+        token = _call_responses.set(responses)
+        try:
+            return await getattr(client, method)(**params)
+        except BinanceAPIException as e:
+            if e.status_code in (418, 429):
+                self._throttled(e)
+            raise
+        finally:
+            _call_responses.reset(token)
+            self._sync(responses[-1] if responses else None)
+
+
+upstream = UpstreamGateway()
@@ -0,0 +1,115 @@
+"""
+Wycena portfela po bieżących cenach rynkowych (mark-to-market) w dowolnej walucie docelowej.
+
+Kursy przeliczeń pochodzą z grafu walut (services.conversion), odczytywane są wektorowo dla
+wszystkich aktywów naraz, bez zapytań do sieci na ścieżce żądania.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from services.conversion import ConversionGraph, conversion_graph
+from services.exchange_info import ExchangeInfo
+
+# Binance nie notuje USD - wyceny w USD używają USDT
+CURRENCY_ALIASES = {"USD": "USDT"}
+
+
+def normalize_currency(currency: str) -> str:
+    currency = currency.upper()
+    return CURRENCY_ALIASES.get(currency, currency)
+
+
+def asset_currency(info: ExchangeInfo, symbol: str) -> str:
+    """Waluta aktywa: dla pozycji zapisanej jako para (np. BTCUSDT) jej waluta bazowa."""
+    pair = info.symbols.get(symbol)
+    return pair[0] if pair is not None else normalize_currency(symbol)
+
+
+def _time(timestamp: float) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if np.isfinite(timestamp) else None
+
+
+def _number(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def mark_to_market(graph: ConversionGraph, info: ExchangeInfo, symbols: Sequence[str], amounts: np.ndarray,
+                   buy_prices: np.ndarray, buy_currencies: Sequence[Optional[str]], target: str) -> tuple:
+    """
+    Kursy, wartości, koszty i czasy cen pozycji w walucie target (NaN dla pozycji bez kursu).
+    Kursy odczytywane są z grafu raz na walutę, więc koszt rośnie liniowo z liczbą pozycji.
+    """
+    # wartość: waluta aktywa -> docelowa, koszt: waluta zakupu -> docelowa
+    currencies = [asset_currency(info, s) for s in symbols] + [normalize_currency(c or target) for c in buy_currencies]
+    unique, inverse = np.unique(np.array(currencies, dtype=object), return_inverse=True)
+    unique_rates, unique_times = graph.rates(list(unique), target)
+    rates, times = unique_rates[inverse], unique_times[inverse]
+    count = len(symbols)
+    values = amounts * rates[:count]
+    costs = amounts * buy_prices * rates[count:]
+    return rates[:count], values, costs, times[:count]
+
+
+async def _target(graph: ConversionGraph, target_currency: str) -> tuple:
+    if graph.info is None:
+        # graf nie został jeszcze zbudowany (np. start bez dostępu do Binance)
+        await graph.refresh()
+    info = graph.info
+    target = normalize_currency(target_currency)
+    if info is None or target not in info.currencies:
+        raise ValueError(f"Unsupported currency {target_currency}")
+    return info, target
+
+
+async def value_assets(assets: Sequence, target_currency: str, graph: ConversionGraph = conversion_graph) -> Dict:
+    """
+    Wycenia pozycje (symbol, amount, buy_price, buy_currency) w target_currency. Aktywa bez ścieżki
+    przeliczenia lub bez ceny trafiają do "unpriced" i nie wchodzą do sum.
+    """
+    info, target = await _target(graph, target_currency)
+
+    amounts = np.array([a.amount or 0.0 for a in assets])
+    rates, values, costs, price_times = mark_to_market(
+        graph, info, [a.symbol for a in assets], amounts, np.array([a.buy_price or 0.0 for a in assets]),
+        [a.buy_currency for a in assets], target)
+    pnl = values - costs
+    priced = ~np.isnan(pnl)
+
+    return {
+        "currency": target_currency,
+        "total_value": float(values[priced].sum()),
+        "total_cost": float(costs[priced].sum()),
+        "unrealized_pnl": float(pnl[priced].sum()),
+        "assets_count": len(assets),
+        "as_of": _time(price_times[priced].min()) if priced.any() else None,
+        "assets": [{
+            "symbol": asset.symbol,
+            "amount": asset.amount,
+            "price": _number(rates[i]),
+            "value": _number(values[i]),
+            "cost_basis": _number(costs[i]),
+            "unrealized_pnl": _number(pnl[i]),
+            "price_time": _time(price_times[i]) if not np.isnan(price_times[i]) else None,
+        } for i, asset in enumerate(assets)],
+        "unpriced": [asset.symbol for asset, ok in zip(assets, priced) if not ok],
+    }
+
+
+async def value_balances(balances: Dict[str, float], target_currency: str,
+                         graph: ConversionGraph = conversion_graph) -> Dict:
+    """Wycenia salda walut w target_currency; waluty bez kursu trafiają do "unpriced"."""
+    _, target = await _target(graph, target_currency)
+    currencies = list(balances)
+    rates, _ = graph.rates([normalize_currency(currency) for currency in currencies], target)
+    values = np.array([balances[currency] or 0.0 for currency in currencies]) * rates
+    priced = ~np.isnan(values)
+
+    return {
+        "currency": target_currency,
+        "total_value": float(values[priced].sum()),
+        "balances": [{"currency": currency, "amount": balances[currency], "value": _number(values[i])}
+                     for i, currency in enumerate(currencies)],
+        "unpriced": [currency for currency, ok in zip(currencies, priced) if not ok],
+    }
@@ -0,0 +1,153 @@
+import asyncio
+from functools import partial
+
+import numpy as np
+import pytest
+
+from services import analytics, history_service
+from services.analytics import IndicatorCache, parse_indicator, parse_interval, resample
+from services.history_cache import HistoryCache
+from services.kline_store import KLINE_DTYPE, KlineStore
+from test_history_cache import FakeRedis, known_symbols
+from test_kline_store import FakeExchange, MINUTE
+
+
+def random_klines(count, start=7 * MINUTE, seed=1):
+    rng = np.random.default_rng(seed)
+    klines = np.zeros(count, dtype=KLINE_DTYPE)
+    klines["open_time"] = start + np.arange(count) * MINUTE
+    klines["close_time"] = klines["open_time"] + MINUTE - 1
+    close = 100 + np.cumsum(rng.normal(0, 1, count))
+    klines["open"] = np.r_[100, close[:-1]]
+    klines["close"] = close
+    klines["high"] = np.maximum(klines["open"], close) + rng.random(count)
+    klines["low"] = np.minimum(klines["open"], close) - rng.random(count)
+    klines["volume"] = rng.random(count) * 10
+    klines["quote_volume"] = klines["volume"] * close
+    klines["trades"] = rng.integers(1, 100, count)
+    return klines
+
+
+def test_resample_matches_naive_aggregation():
+    klines = random_klines(103)
+    out = resample(klines, parse_interval("5m"))
+
+    # okno zaczyna się w 7. minucie - niepełny kubełek [5m, 10m) jest pomijany
+    assert out["open_time"][0] == 10 * MINUTE
+    for candle in out:
+        group = klines[(klines["open_time"] >= candle["open_time"]) & (klines["open_time"] <= candle["close_time"])]
+        assert candle["open"] == group["open"][0] and candle["close"] == group["close"][-1]
+        assert candle["high"] == group["high"].max() and candle["low"] == group["low"].min()
+        assert candle["volume"] == pytest.approx(group["volume"].sum())
+        assert candle["trades"] == group["trades"].sum()
+    assert parse_interval("1w") == 7 * 24 * 60 * MINUTE
+    with pytest.raises(ValueError):
+        parse_interval("1x")
+
+
+def test_indicators_match_reference_implementations():
+    klines = random_klines(60)
+    close = klines["close"]
+
+    def values(spec):
+        return parse_indicator(spec).compute(klines, 0, None)[0]
+
+    sma = values("sma:5")[:, 0]
+    assert np.isnan(sma[:4]).all()
+    assert np.allclose(sma[4:], [close[i - 4:i + 1].mean() for i in range(4, 60)])
+
+    bands = values("bb:10:2")
+    std = np.array([close[i - 9:i + 1].std() for i in range(9, 60)])
+    assert np.allclose(bands[9:, 1] - bands[9:, 0], 2 * std)
+    assert np.allclose(bands[9:, 0] - bands[9:, 2], 2 * std)
+
+    expected, ema = [], None
+    for price in close:
+        ema = price if ema is None else ema + (price - ema) * 2 / 6
+        expected.append(ema)
+    assert np.allclose(values("ema:5")[:, 0], expected)
+
+    typical = (klines["high"] + klines["low"] + close) / 3
+    vwap = values("vwap:3")[:, 0]
+    assert np.allclose(vwap[2:], [np.average(typical[i - 2:i + 1], weights=klines["volume"][i - 2:i + 1])
+                                  for i in range(2, 60)])
+
+    rsi = values("rsi:14")[:, 0]
+    change = np.diff(close)
+    gain, loss = change.clip(min=0)[:14].mean(), (-change).clip(min=0)[:14].mean()
+    assert np.isnan(rsi[:14]).all()
+    assert rsi[14] == pytest.approx(100 - 100 / (1 + gain / loss))
+    gain = (gain * 13 + max(change[14], 0)) / 14
+    loss = (loss * 13 + max(-change[14], 0)) / 14
+    assert rsi[15] == pytest.approx(100 - 100 / (1 + gain / loss))
+    assert ((rsi[14:] >= 0) & (rsi[14:] <= 100)).all()
+
+
+@pytest.mark.parametrize("spec", ["ema:1", "ema:5", "rsi:1", "rsi:14"])
+def test_vectorized_full_computation_matches_per_candle_recurrence(spec):
+    # dość świec, by wygładzanie liczone blokami przeszło przez kilka granic bloków
+    klines = random_klines(3000)
+    indicator = parse_indicator(spec)
+
+    full, state = indicator.compute(klines, 0, None)
+    head, head_state = indicator.compute(klines[:1], 0, None)
+    tail, tail_state = indicator.compute(klines[1:], 0, head_state)
+
+    assert np.allclose(full, np.vstack([head, tail]), equal_nan=True)
+    assert np.allclose(state, tail_state)
+    with pytest.raises(TypeError):
+        analytics.Indicator(5)
+
+
+@pytest.mark.parametrize("spec", ["sma:20", "ema:10", "rsi:14", "bb:20:2", "vwap:5"])
+def test_incremental_update_matches_full_computation(spec):
+    klines = random_klines(200)
+    indicator = parse_indicator(spec)
+    cache = IndicatorCache()
+    key = ("BTCUSDT", "1m", "1m", indicator.key)
+
+    cache.values(key, indicator, klines[:150], klines[150:151])
+    updated = cache.values(key, indicator, klines[:199], klines[199:])
+    full, _ = indicator.compute(klines, 0, None)
+    assert np.allclose(updated, full, equal_nan=True)
+
+    # okno przesunięte do przodu: wartości dla jego świec pochodzą z tej samej serii
+    moved = cache.values(key, indicator, klines[60:199], klines[199:])
+    assert np.allclose(moved, full[60:], equal_nan=True)
+    assert cache.stats.as_dict() == {"full": 1, "incremental": 1, "cached": 1}
+
+
+def test_coarser_intervals_share_one_base_window(tmp_path, monkeypatch):
+    exchange = FakeExchange(now_ms=5_000 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=60)
+    monkeypatch.setattr(history_service, "kline_store", store)
+    history_cache = HistoryCache(redis_client=FakeRedis(), encode=history_service.encode_window,
+                                 decode=history_service.decode_window)
+    monkeypatch.setattr(analytics, "get_history",
+                        partial(history_service.get_history, cache=history_cache, clock=exchange.clock,
+                                info_cache=known_symbols("BTCUSDT")))
+    cache = IndicatorCache()
+
+    def request(interval, limit=20):
+        return asyncio.run(analytics.get_analytics("BTCUSDT", interval, limit, ["sma:5", "rsi:14"],
+                                                   base_interval="1m", cache=cache))
+
+    wide = request("15m")
+    calls = len(exchange.calls)
+    narrow = request("5m")
+    assert len(exchange.calls) == calls
+    assert wide["base_interval"] == narrow["base_interval"] == "1m"
+    assert len(wide["candles"]["open_time"]) == len(narrow["indicators"]["sma:5"]["value"]) == 20
+    assert narrow["candles"]["open_time"][-1] == 5_000 * MINUTE
+    # świece FakeExchange mają close = numer minuty, więc SMA z 5 świec 5m jest znana
+    assert narrow["indicators"]["sma:5"]["value"][-1] == pytest.approx(
+        np.mean([4_984, 4_989, 4_994, 4_999, 5_000]))
+    assert narrow["indicators"]["rsi:14"]["value"][-1] == 100.0
+
+    request("5m")
+    exchange.now_ms += 5 * MINUTE
+    history_cache.local.clear()
+    history_cache.redis.data.clear()
+    # nowe okno zaczyna się później, ale policzone świece są wykorzystane ponownie
+    request("5m")
+    assert cache.stats.as_dict() == {"full": 4, "incremental": 2, "cached": 2}
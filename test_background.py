@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from services.background import BackgroundTask
+
+
+def test_failure_is_logged_and_stopped_task_can_be_restarted(caplog):
+    runs = []
+
+    async def crash():
+        runs.append("crash")
+        raise RuntimeError("loop broke")
+
+    async def forever():
+        runs.append("forever")
+        await asyncio.Event().wait()
+
+    async def scenario():
+        task = BackgroundTask("test loop")
+        task.start(crash)
+        await asyncio.sleep(0.01)
+        # zakończone zadanie nie blokuje ponownego startu, a błąd widać w logu bez czekania na stop()
+        assert not task.running
+        task.start(forever)
+        task.start(forever)
+        await asyncio.sleep(0)
+        assert task.running
+        await task.stop()
+        assert not task.running
+        await task.stop()
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(scenario())
+
+    assert runs == ["crash", "forever"]
+    assert [r.getMessage() for r in caplog.records] == ["Background task test loop failed: loop broke"]
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from services.conversion import ConversionGraph
+from routers.portfolio import _transfer_rate
+from services.exchange_info import ExchangeInfo, ExchangeInfoCache
+
+PAYLOAD = {"symbols": [
+    {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT"},
+    {"symbol": "ETHUSDT", "baseAsset": "ETH", "quoteAsset": "USDT"},
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+    {"symbol": "USDTPLN", "baseAsset": "USDT", "quoteAsset": "PLN"},
+    {"symbol": "BNBUSDT", "baseAsset": "BNB", "quoteAsset": "USDT"},
+    {"symbol": "SOLBNB", "baseAsset": "SOL", "quoteAsset": "BNB"},
+]}
+PRICES = {"BTCUSDT": 100.0, "ETHUSDT": 4.0, "ETHBTC": 0.04, "USDTPLN": 4.0, "BNBUSDT": 10.0, "SOLBNB": 0.5}
+
+
+def build_graph():
+    graph = ConversionGraph()
+    graph.rebuild(ExchangeInfo(PAYLOAD))
+    graph.update_many(PRICES, timestamp=1000.0)
+    return graph
+
+
+def test_cross_rates_follow_the_best_path():
+    graph = build_graph()
+
+    assert graph.path("PLN", "ETH") == ["USDTPLN", "ETHUSDT"]
+    assert graph.rate("PLN", "ETH") == pytest.approx(1 / 16)
+    assert graph.rate("SOL", "PLN") == pytest.approx(0.5 * 10 * 4)
+    assert graph.path("SOL", "PLN") == ["SOLBNB", "BNBUSDT", "USDTPLN"]
+    assert graph.rate("ETH", "ETH") == 1.0
+    assert graph.rate("PLN", "XYZ") is None
+
+    rates, times = graph.rates(["BTC", "SOL", "USDT", "XYZ"], "USDT")
+    assert rates[:3] == pytest.approx([100.0, 5.0, 1.0])
+    assert times[0] == 1000.0 and times[2] == float("inf")
+    assert rates[3] != rates[3]
+
+
+def test_price_update_recomputes_only_cells_on_affected_paths():
+    graph = build_graph()
+    before = graph.rates_matrix.copy()
+
+    graph.update("BNBUSDT", 20.0, timestamp=2000.0)
+
+    changed = ~((graph.rates_matrix == before) | (before != before))
+    bnb, sol = graph.index["BNB"], graph.index["SOL"]
+    assert {frozenset(graph.currencies[i] for i in cell) for cell in zip(*changed.nonzero())} >= {
+        frozenset({"BNB", "USDT"}), frozenset({"SOL", "PLN"})}
+    assert not changed[graph.index["BTC"], graph.index["ETH"]]
+    assert changed[bnb].sum() == len(graph) - 2  # poza przekątną i SOL
+    assert graph.rate("SOL", "USDT") == pytest.approx(10.0)
+    assert graph.rates(["SOL"], "USDT")[1][0] == 1000.0  # najstarsza cena na ścieżce (SOLBNB)
+
+
+def test_refresh_builds_the_graph_with_a_single_price_call():
+    calls = []
+
+    async def fetch_info():
+        return PAYLOAD
+
+    async def fetch_prices():
+        calls.append(1)
+        return PRICES
+
+    graph = ConversionGraph(fetch_prices=fetch_prices, info_cache=ExchangeInfoCache(fetch=fetch_info))
+    assert asyncio.run(graph.refresh())
+    assert len(calls) == 1 and len(graph) == 6
+    # odczyty kursów nie wywołują zapytań
+    for _ in range(100):
+        graph.rate("PLN", "SOL")
+    assert len(calls) == 1
+    assert graph.rate("PLN", "SOL") == pytest.approx(1 / 20)
+
+
+def test_transfer_is_refused_when_a_price_on_the_path_is_stale():
+    graph = build_graph()
+    graph.update_many(PRICES, timestamp=time.time())
+
+    assert _transfer_rate("PLN", "ETH", None, graph=graph) == pytest.approx(1 / 16)
+    with pytest.raises(HTTPException) as deviating:
+        _transfer_rate("PLN", "ETH", 0.1, graph=graph)
+    assert deviating.value.status_code == 400
+
+    # jedna z par na ścieżce PLN -> USDT -> ETH nie była odświeżana od godziny
+    graph.update("ETHUSDT", 4.0, timestamp=time.time() - 3600)
+    with pytest.raises(HTTPException) as stale:
+        _transfer_rate("PLN", "ETH", None, graph=graph)
+    assert stale.value.status_code == 503
+    assert _transfer_rate("USD", "PLN", None, graph=graph) == pytest.approx(4.0)
+
+
+def test_pairs_outside_trading_are_not_used_as_paths():
+    payload = {"symbols": [
+        {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT", "status": "TRADING"},
+        {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC", "status": "TRADING"},
+        {"symbol": "ETHUSDT", "baseAsset": "ETH", "quoteAsset": "USDT", "status": "BREAK"},
+        {"symbol": "LUNAUSDT", "baseAsset": "LUNA", "quoteAsset": "USDT", "status": "BREAK"},
+    ]}
+    graph = ConversionGraph()
+    graph.rebuild(ExchangeInfo(payload))
+    graph.update_many({"BTCUSDT": 100.0, "ETHBTC": 0.04, "ETHUSDT": 1.0, "LUNAUSDT": 0.1}, timestamp=1000.0)
+
+    # wstrzymana para z ostatnią, nieaktualną ceną nie jest krawędzią grafu
+    assert graph.path("ETH", "USDT") == ["ETHBTC", "BTCUSDT"]
+    assert graph.rate("ETH", "USDT") == pytest.approx(4.0)
+    assert graph.rate("LUNA", "USDT") is None and "ETHUSDT" not in graph.pair_index
+
+
+def test_bulk_prices_do_not_refresh_newer_stream_prices():
+    graph = build_graph()
+    graph.update("BTCUSDT", 110.0, timestamp=3000.0)
+
+    graph.update_many({"BTCUSDT": 105.0, "ETHUSDT": 5.0}, timestamp=2000.0)
+
+    assert graph.rate("BTC", "USDT") == pytest.approx(110.0)
+    assert graph.rates(["BTC", "ETH"], "USDT")[1].tolist() == [3000.0, 2000.0]
@@ -1,6 +1,23 @@
-from services.crud import verify_password, create_user, get_user_balance, update_user_balance
-from models.user import User, CurrencyBalance
-from sqlalchemy.orm import Session
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, sessionmaker
+
+from services import crud
+from services.crud import verify_password, create_user, get_user_balance, update_user_balance, debit_balance, \
+    credit_balance, add_position, reduce_position, credit_balance_async, add_position_async, \
+    update_user_balance_async
+from models.user import Base, User, CurrencyBalance, PortfolioAsset
+
+class DummyResult:
+    rowcount = 0
+
+    def scalar_one(self):
+        # upsert salda zwraca zapisany wiersz przez RETURNING
+        return CurrencyBalance(user_id=1, currency="USD", amount=100.0)
+
 
 class DummyDB:
     def __init__(self):
@@ -17,6 +34,12 @@ class DummyDB:
     def first(self):
         return None
 
+    def execute(self, statement):
+        return DummyResult()
+
+    def get_bind(self):
+        return create_engine("sqlite://")
+
     def add(self, obj):
         pass
 
@@ -41,4 +64,84 @@ def test_update_user_balance_creates_balance():
     # update_user_balance powinno utworzyć nowy balans, jeśli nie istnieje
     result = update_user_balance(db, 1, "USD", 100.0)
     # W tym dummy DB nie ma realnej bazy, więc sprawdzamy tylko, czy nie ma wyjątku
-    assert result is not None
\ No newline at end of file
+    assert result is not None
+
+
+@pytest.fixture
+def sqlite_db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def test_debit_balance_checks_funds_in_update(sqlite_db):
+    sqlite_db.add(CurrencyBalance(user_id=1, currency="USDT", amount=100.0))
+    sqlite_db.commit()
+
+    assert debit_balance(sqlite_db, 1, "USDT", 60.0)
+    assert not debit_balance(sqlite_db, 1, "USDT", 60.0)
+    assert not debit_balance(sqlite_db, 1, "EUR", 1.0)
+    sqlite_db.commit()
+
+    assert get_user_balance(sqlite_db, 1, "USDT").amount == pytest.approx(40.0)
+
+
+def test_credit_and_update_balance_create_missing_rows(sqlite_db):
+    credit_balance(sqlite_db, 1, "BTC", 0.5)
+    credit_balance(sqlite_db, 1, "BTC", 0.25)
+    sqlite_db.commit()
+    assert get_user_balance(sqlite_db, 1, "BTC").amount == pytest.approx(0.75)
+
+    assert update_user_balance(sqlite_db, 1, "EUR", 10.0).amount == pytest.approx(10.0)
+    assert update_user_balance(sqlite_db, 1, "EUR", 5.0).amount == pytest.approx(15.0)
+
+
+def test_credits_and_new_positions_are_single_upserts(database):
+    statements = []
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    async def scenario():
+        async with database.factory() as db:
+            await credit_balance_async(db, 1, "BTC", 0.5)
+            await add_position_async(db, 1, "BTCUSDT", 1.0, 100.0, "USDT")
+            await add_position_async(db, 1, "BTCUSDT", 3.0, 200.0, "USDT")
+            await db.commit()
+            return await update_user_balance_async(db, 1, "BTC", 0.25)
+
+    balance = asyncio.run(scenario())
+    # brak wyścigu UPDATE-potem-INSERT: każda zmiana to jedno zapytanie, także dla brakującego wiersza
+    assert [s.split()[0] for s in statements if not s.startswith(("BEGIN", "COMMIT"))] == ["INSERT"] * 4
+    assert balance.amount == pytest.approx(0.75)
+    asset = database.session.query(PortfolioAsset).one()
+    assert (asset.amount, asset.buy_price) == (pytest.approx(4.0), pytest.approx(175.0))
+
+
+def test_backends_without_upsert_fall_back_to_update_then_insert(sqlite_db, monkeypatch):
+    # PostgreSQL ma ten sam upsert co SQLite; inne backendy (np. MySQL) dostają UPDATE i INSERT
+    statement = crud._add_position_upsert_stmt(postgresql.insert, 1, "BTCUSDT", 1.0, 100.0, "USDT", "crypto")
+    assert "ON CONFLICT (portfolio_id, symbol) DO UPDATE" in str(statement.compile(dialect=postgresql.dialect()))
+
+    monkeypatch.setattr(crud, "_UPSERT_INSERTS", {})
+    credit_balance(sqlite_db, 1, "BTC", 0.5)
+    add_position(sqlite_db, 1, "BTCUSDT", 1.0, 100.0, "USDT")
+    add_position(sqlite_db, 1, "BTCUSDT", 3.0, 200.0, "USDT")
+    assert update_user_balance(sqlite_db, 1, "BTC", 0.25).amount == pytest.approx(0.75)
+    asset = sqlite_db.query(PortfolioAsset).one()
+    assert (asset.amount, asset.buy_price) == (pytest.approx(4.0), pytest.approx(175.0))
+
+
+def test_positions_average_price_and_close(sqlite_db):
+    add_position(sqlite_db, 1, "BTCUSDT", 1.0, 100.0, "USDT")
+    add_position(sqlite_db, 1, "BTCUSDT", 3.0, 200.0, "USDT")
+    sqlite_db.commit()
+    asset = sqlite_db.query(PortfolioAsset).one()
+    assert asset.amount == pytest.approx(4.0)
+    assert asset.buy_price == pytest.approx(175.0)
+
+    assert not reduce_position(sqlite_db, 1, "BTCUSDT", 5.0)
+    assert reduce_position(sqlite_db, 1, "BTCUSDT", 4.0)
+    sqlite_db.commit()
+    assert sqlite_db.query(PortfolioAsset).count() == 0
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text, insert, inspect, select, update
+
+from models.database import create_db_engine, create_async_db_engine, sqlite_pragmas
+from models.user import Base, CurrencyBalance, PortfolioAsset, Order, OrderFuture, OrderStatus
+from services.migrations import migrate, MIGRATIONS
+
+
+def read_pragmas(connection):
+    return {
+        "journal_mode": connection.execute(text("PRAGMA journal_mode")).scalar(),
+        "synchronous": connection.execute(text("PRAGMA synchronous")).scalar(),
+        "busy_timeout": connection.execute(text("PRAGMA busy_timeout")).scalar(),
+        "cache_size": connection.execute(text("PRAGMA cache_size")).scalar(),
+    }
+
+
+@pytest.mark.parametrize("profile, journal_mode, synchronous", [
+    ("legacy", "delete", 2),
+    ("wal", "wal", 1),
+    ("wal_unsafe", "wal", 0),
+])
+def test_engine_applies_profile_pragmas(tmp_path, profile, journal_mode, synchronous):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/profile.db", profile=profile)
+    with engine.connect() as connection:
+        pragmas = read_pragmas(connection)
+    engine.dispose()
+
+    assert pragmas["journal_mode"] == journal_mode
+    assert pragmas["synchronous"] == synchronous
+    assert pragmas["busy_timeout"] == sqlite_pragmas(profile)["busy_timeout"]
+    assert pragmas["cache_size"] == sqlite_pragmas(profile)["cache_size"]
+
+
+def test_async_engine_uses_same_profile(tmp_path):
+    async def scenario():
+        engine = create_async_db_engine(f"sqlite:///{tmp_path}/async.db", profile="wal")
+        async with engine.connect() as connection:
+            pragmas = await connection.run_sync(read_pragmas)
+        await engine.dispose()
+        return pragmas
+
+    pragmas = asyncio.run(scenario())
+    assert pragmas["journal_mode"] == "wal"
+    assert pragmas["synchronous"] == 1
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        sqlite_pragmas("turbo")
+
+
+def legacy_database(tmp_path):
+    """Baza w schemacie sprzed migracji: tabele bez indeksów złożonych i ze zduplikowanymi saldami."""
+    engine = create_db_engine(f"sqlite:///{tmp_path}/legacy.db", profile="legacy")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for model in (CurrencyBalance, PortfolioAsset, Order, OrderFuture):
+            for index in model.__table__.indexes:
+                index.drop(bind=connection)
+        connection.execute(insert(CurrencyBalance), [
+            {"user_id": 1, "currency": "USDT", "amount": 100.0},
+            {"user_id": 1, "currency": "USDT", "amount": 50.0},
+            {"user_id": 1, "currency": "BTC", "amount": 1.0},
+        ])
+        connection.execute(insert(PortfolioAsset), [
+            {"portfolio_id": 1, "symbol": "BTCUSDT", "amount": 1.0, "buy_price": 100.0},
+            {"portfolio_id": 1, "symbol": "BTCUSDT", "amount": 3.0, "buy_price": 200.0},
+            {"portfolio_id": 1, "symbol": "ETHUSDT", "amount": 0.0, "buy_price": 20.0},
+            {"portfolio_id": 1, "symbol": "ETHUSDT", "amount": 0.0, "buy_price": 10.0},
+        ])
+    return engine
+
+
+def query_plan(connection, statement):
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    return " | ".join(row.detail for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+def test_migration_merges_duplicates_and_adds_indexes(tmp_path):
+    engine = legacy_database(tmp_path)
+
+    assert migrate(engine) == MIGRATIONS[-1].version
+    # ponowne uruchomienie niczego nie zmienia
+    assert migrate(engine) == MIGRATIONS[-1].version
+
+    with engine.connect() as connection:
+        indexes = {index["name"] for table in ("currency_balances", "portfolio_assets", "orders", "orderFuture")
+                   for index in inspect(connection).get_indexes(table)}
+        balances = connection.execute(select(CurrencyBalance.currency, CurrencyBalance.amount)).all()
+        positions = connection.execute(select(PortfolioAsset.symbol, PortfolioAsset.amount,
+                                              PortfolioAsset.buy_price)).all()
+    engine.dispose()
+
+    assert {"ix_currency_balances_user_currency", "ix_portfolio_assets_portfolio_symbol",
+            "ix_orders_user_created", "ix_orderFuture_status", "ix_orderFuture_user_created"} <= indexes
+    assert sorted(balances) == [("BTC", 1.0), ("USDT", 150.0)]
+    # wyzerowane duplikaty nie dają NULL-owej ceny z dzielenia przez zerową sumę ilości
+    assert sorted(positions) == [("BTCUSDT", 4.0, 175.0), ("ETHUSDT", 0.0, 10.0)]
+
+
+@pytest.mark.parametrize("statement, index", [
+    (select(OrderFuture).where(OrderFuture.status == OrderStatus.PENDING), "ix_orderFuture_status"),
+    (update(CurrencyBalance).where(CurrencyBalance.user_id == 1, CurrencyBalance.currency == "USDT")
+     .values(amount=CurrencyBalance.amount - 1), "ix_currency_balances_user_currency"),
+    (update(PortfolioAsset).where(PortfolioAsset.portfolio_id == 1, PortfolioAsset.symbol == "BTCUSDT")
+     .values(amount=PortfolioAsset.amount - 1), "ix_portfolio_assets_portfolio_symbol"),
+    (select(Order).where(Order.user_id == 1).order_by(Order.created_at.desc()), "ix_orders_user_created"),
+    (select(OrderFuture).where(OrderFuture.user_id == 1).order_by(OrderFuture.created_at.desc()),
+     "ix_orderFuture_user_created"),
+])
+def test_hot_queries_use_indexes(tmp_path, statement, index):
+    engine = legacy_database(tmp_path)
+    migrate(engine)
+    with engine.connect() as connection:
+        plan = query_plan(connection, statement)
+    engine.dispose()
+
+    assert f"INDEX {index}" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from services.exchange_info import ExchangeInfoCache
+
+PAYLOAD = {"symbols": [
+    {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT"},
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+]}
+
+
+class FakeExchange:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("exchange unavailable")
+        return PAYLOAD
+
+
+def test_concurrent_lookups_download_exchange_info_once():
+    exchange = FakeExchange()
+    cache = ExchangeInfoCache(fetch=exchange.fetch, ttl=60)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get() for _ in range(20)))
+
+    snapshots = asyncio.run(scenario())
+
+    assert exchange.calls == 1
+    info = snapshots[0]
+    assert all(snapshot is info for snapshot in snapshots)
+    assert info.sorted_currencies == ["BTC", "ETH", "USDT"]
+    assert "USDT" in info.currencies and "XYZ" not in info.currencies
+    assert info.symbols["ETHBTC"] == ("ETH", "BTC")
+
+
+def test_failed_refresh_keeps_last_good_copy():
+    exchange = FakeExchange()
+    cache = ExchangeInfoCache(fetch=exchange.fetch, ttl=60)
+
+    async def scenario():
+        await cache.refresh()
+        good = cache.info
+        exchange.fail = True
+        assert not await cache.refresh()
+        assert await cache.get() is good
+        assert cache.failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_background_refresh_runs_after_ttl_and_retries_after_failure():
+    exchange = FakeExchange()
+    exchange.fail = True
+    cache = ExchangeInfoCache(fetch=exchange.fetch, ttl=0.05, retry_delay=0.01)
+
+    async def scenario():
+        await cache.start()
+        assert cache.info is None
+        exchange.fail = False
+        await asyncio.sleep(0.03)
+        assert cache.info is not None
+        loaded = cache.info.fetched_at
+        await asyncio.sleep(0.1)
+        await cache.stop()
+        return loaded
+
+    loaded = asyncio.run(scenario())
+    assert cache.info.fetched_at > loaded
+
+
+def test_unavailable_exchange_info_raises():
+    exchange = FakeExchange()
+    exchange.fail = True
+    cache = ExchangeInfoCache(fetch=exchange.fetch)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get())
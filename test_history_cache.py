@@ -0,0 +1,273 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from routers import crypto_history
+from services import history_service
+from services.exchange_info import ExchangeInfo, ExchangeInfoCache
+from services.history_cache import HistoryCache
+from services.kline_store import KlineStore
+from test_kline_store import FakeExchange, MINUTE
+
+
+class FakeRedis:
+    """Lokalny odpowiednik redis.asyncio (get/set z ex) liczący wywołania."""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.fail = False
+
+    async def get(self, key):
+        self.gets += 1
+        await asyncio.sleep(0)
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.data[key] = value
+
+
+
+def known_symbols(*symbols):
+    """exchangeInfo z podanymi parami ...USDT, bez pobierania z Binance."""
+    cache = ExchangeInfoCache()
+    cache.info = ExchangeInfo({"symbols": [{"symbol": symbol, "baseAsset": symbol[:-4], "quoteAsset": "USDT"}
+                                           for symbol in symbols]})
+    return cache
+
+def test_concurrent_misses_are_coalesced_into_one_fetch():
+    fake_redis = FakeRedis()
+    cache = HistoryCache(redis_client=fake_redis)
+    fetches = []
+
+    async def loader(current):
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        return [1, 2, 3]
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("BTCUSDT:1d:100", loader) for _ in range(50)))
+
+    values = asyncio.run(scenario())
+
+    assert values == [[1, 2, 3]] * 50
+    assert len(fetches) == 1
+    assert fake_redis.data == {"BTCUSDT:1d:100": "[1, 2, 3]"}
+    assert cache.stats.as_dict()["misses"] == 1
+    assert cache.stats.coalesced == 49
+
+
+def test_local_tier_serves_hits_without_redis_round_trip():
+    fake_redis = FakeRedis()
+    fake_redis.data["ETHUSDT:1h:10"] = "[]"
+    cache = HistoryCache(redis_client=fake_redis)
+
+    async def loader(current):
+        raise AssertionError("should not fetch")
+
+    async def scenario():
+        for _ in range(10):
+            assert await cache.get_or_load("ETHUSDT:1h:10", loader) == []
+
+    asyncio.run(scenario())
+
+    assert fake_redis.gets == 1
+    assert cache.stats.redis_hits == 1
+    assert cache.stats.local_hits == 9
+
+
+def test_lru_evicts_least_recently_used_and_redis_failure_falls_back_to_loader():
+    fake_redis = FakeRedis()
+    fake_redis.fail = True
+    cache = HistoryCache(redis_client=fake_redis, max_entries=2)
+
+    async def scenario():
+        for key in ("a", "b", "a", "c"):
+            await cache.get_or_load(key, lambda current, key=key: asyncio.sleep(0, result=key))
+
+    asyncio.run(scenario())
+
+    assert cache.local.get("b") is None
+    assert cache.local.get("a") == "a" and cache.local.get("c") == "c"
+    assert cache.stats.misses == 3
+    assert cache.stats.redis_errors == 6
+
+
+def test_failed_load_reaches_all_waiters_and_is_not_cached():
+    cache = HistoryCache(redis_client=FakeRedis())
+
+    async def loader(current):
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream error")
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert await cache.get_or_load("k", lambda current: asyncio.sleep(0, result="ok")) == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_history_is_sliced_from_one_window_per_symbol_and_interval(tmp_path, monkeypatch):
+    exchange = FakeExchange(now_ms=5_000 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=60)
+    monkeypatch.setattr(history_service, "kline_store", store)
+    fake_redis = FakeRedis()
+    cache = HistoryCache(redis_client=fake_redis, encode=history_service.encode_window,
+                         decode=history_service.decode_window)
+
+    def history(**params):
+        return asyncio.run(history_service.get_history("BTCUSDT", "1m", cache=cache, clock=exchange.clock,
+                                                       info_cache=known_symbols("BTCUSDT"), **params))
+
+    full = history(limit=100)
+    assert len(full) == 100
+    calls = len(exchange.calls)
+
+    assert np.array_equal(history(limit=99), full[-99:])
+    assert np.array_equal(history(limit=10), full[-10:])
+    ranged = history(limit=5, start_time=4_950 * MINUTE, end_time=4_960 * MINUTE)
+    assert list(ranged["open_time"]) == [t * MINUTE for t in range(4_950, 4_955)]
+    assert len(exchange.calls) == calls
+    assert cache.stats.misses == 1
+    assert list(fake_redis.data) == ["BTCUSDT:1m"]
+
+    # zapytanie poza oknem rozszerza je o brakujący początek
+    wider = history(limit=300)
+    assert len(wider) == 300
+    assert np.array_equal(wider[-100:], full)
+    assert cache.stats.misses == 2
+    assert exchange.calls[-1][0] < 4_901 * MINUTE
+    assert np.array_equal(history(limit=250), wider[-250:])
+    assert cache.stats.misses == 2
+
+
+def test_unknown_symbol_is_rejected_before_touching_the_store(tmp_path, monkeypatch):
+    exchange = FakeExchange(now_ms=5_000 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=60)
+    monkeypatch.setattr(history_service, "kline_store", store)
+    monkeypatch.setattr(history_service, "exchange_info", known_symbols("BTCUSDT"))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(crypto_history.get_crypto_history("NOPE123", format=None, accept=None))
+
+    assert error.value.status_code == 404
+    # dowolne symbole z URL nie zostawiają serii w magazynie ani zapytań do Binance
+    assert store._series == {} and exchange.calls == []
+
+
+def test_waiter_not_covered_by_inflight_load_extends_it():
+    cache = HistoryCache(redis_client=FakeRedis())
+    loads = []
+
+    def request(size):
+        async def loader(current):
+            loads.append(current)
+            await asyncio.sleep(0.01)
+            return max(size, current or 0)
+        return cache.get_or_load("window", loader, accept=lambda value: value >= size)
+
+    async def scenario():
+        return await asyncio.gather(request(10), request(5), request(20))
+
+    assert asyncio.run(scenario()) == [10, 10, 20]
+    assert loads == [None, 10]
+
+
+def test_stale_entry_is_served_while_refreshing_in_background():
+    cache = HistoryCache(redis_client=FakeRedis(), ttl=10, stale_ttl=5)
+    now = [0.0]
+    loads = []
+
+    async def loader(current):
+        loads.append(current)
+        await asyncio.sleep(0.01)
+        return {"at": now[0]}
+
+    def get():
+        return cache.get_or_load("k", loader, age=lambda value: now[0] - value["at"])
+
+    async def scenario():
+        assert await get() == {"at": 0.0}
+        now[0] = 12.0
+        # nieaktualna wartość wraca od razu, odświeżenie trwa w tle (jedno dla wielu zapytań)
+        assert await asyncio.gather(get(), get()) == [{"at": 0.0}] * 2
+        await asyncio.sleep(0.02)
+        assert await get() == {"at": 12.0}
+        now[0] = 30.0
+        # po stale_ttl wartość wygasła - zapytanie czeka na pobranie
+        assert await get() == {"at": 30.0}
+
+    asyncio.run(scenario())
+
+    assert loads == [None, {"at": 0.0}, {"at": 12.0}]
+    assert cache.stats.stale_hits == 2 and cache.stats.refreshes == 1
+
+
+def test_hot_keys_are_refreshed_before_they_expire():
+    cache = HistoryCache(redis_client=FakeRedis(), ttl=100, hot_keys=2, refresh_ahead=20)
+    now = [0.0]
+    loaded = []
+
+    def get(key):
+        async def loader(current):
+            loaded.append(key)
+            return {"at": now[0]}
+        return cache.get_or_load(key, loader, age=lambda value: now[0] - value["at"])
+
+    async def scenario():
+        for key, requests in (("BTCUSDT:1m", 5), ("ETHUSDT:1m", 3), ("XRPUSDT:1m", 1)):
+            for _ in range(requests):
+                await get(key)
+        loaded.clear()
+        now[0] = 50.0
+        assert await cache.refresh_hot() == 0
+        now[0] = 85.0
+        assert await cache.refresh_hot() == 2
+
+    asyncio.run(scenario())
+
+    assert sorted(loaded) == ["BTCUSDT:1m", "ETHUSDT:1m"]
+    assert cache.local.get("BTCUSDT:1m") == {"at": 85.0}
+    assert cache.local.get("XRPUSDT:1m") == {"at": 0.0}
+
+
+def test_failed_refresh_without_a_value_fails_waiters_instead_of_returning_none():
+    redis = FakeRedis()
+    cache = HistoryCache(redis_client=redis, ttl=100, hot_keys=1, refresh_ahead=20)
+    now = [0.0]
+    failing = [False]
+
+    async def loader(current):
+        await asyncio.sleep(0.01)
+        if failing[0]:
+            raise ValueError("upstream error")
+        return {"at": now[0]}
+
+    def get():
+        return cache.get_or_load("BTCUSDT:1m", loader, accept=lambda value: value["at"] >= 0,
+                                 age=lambda value: now[0] - value["at"])
+
+    async def scenario():
+        await get()
+        # Redis niedostępny i lokalna kopia wygasła: odświeżenie popularnego klucza startuje bez wartości
+        cache.local.clear()
+        redis.fail = True
+        failing[0] = True
+        refresh = asyncio.create_task(cache.refresh_hot())
+        await asyncio.sleep(0)
+        results = await asyncio.gather(get(), get(), return_exceptions=True)
+        assert await refresh == 1
+        assert all(isinstance(result, ValueError) for result in results)
+
+        failing[0] = False
+        assert await get() == {"at": 0.0}
+
+    asyncio.run(scenario())
+    assert cache.stats.refresh_errors == 1
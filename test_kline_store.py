@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import numpy as np
+
+from services.kline_store import KlineStore, from_binance, to_binance, encode_klines, decode_klines, KLINE_DTYPE
+
+MINUTE = 60_000
+LISTED = 1_000 * MINUTE  # pierwsza świeca na "giełdzie"
+
+
+class FakeExchange:
+    """Świece 1m od LISTED do bieżącej chwili zegara; zapisuje wywołania get_klines."""
+
+    def __init__(self, now_ms):
+        self.now_ms = now_ms
+        self.calls = []
+
+    def clock(self):
+        return self.now_ms / 1000
+
+    def candle(self, open_time):
+        price = f"{open_time / MINUTE:.8f}"
+        return [open_time, price, price, price, price, "1.50000000", open_time + MINUTE - 1,
+                "2.00000000", 3, "0.50000000", "0.75000000", "0"]
+
+    async def fetch(self, symbol, interval, limit=1000, start_time=None, end_time=None):
+        self.calls.append((start_time, end_time, limit))
+        last = self.now_ms - self.now_ms % MINUTE
+        if end_time is not None:
+            last = min(last, end_time - end_time % MINUTE)
+        if start_time is not None:
+            first = max(LISTED, start_time + (-start_time) % MINUTE)
+            times = range(first, min(last, first + (limit - 1) * MINUTE) + 1, MINUTE)
+        else:
+            times = range(max(LISTED, last - (limit - 1) * MINUTE), last + 1, MINUTE)
+        return [self.candle(t) for t in times]
+
+
+def test_binance_rows_round_trip():
+    exchange = FakeExchange(0)
+    rows = [exchange.candle(LISTED), exchange.candle(LISTED + MINUTE)]
+    array = from_binance(rows)
+    assert array.dtype == KLINE_DTYPE
+    assert to_binance(array) == rows
+
+
+def test_repeated_requests_fetch_only_the_tail(tmp_path):
+    exchange = FakeExchange(now_ms=5_000 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=0)
+
+    first = asyncio.run(store.get_klines("BTCUSDT", "1m", limit=100))
+    assert len(first) == 100
+    assert first["open_time"][-1] == 5_000 * MINUTE
+    assert len(exchange.calls) == 1
+
+    # po 3 minutach pobierany jest tylko ogon od ostatniej zamkniętej świecy
+    exchange.now_ms += 3 * MINUTE
+    second = asyncio.run(store.get_klines("BTCUSDT", "1m", limit=100))
+    assert second["open_time"][-1] == 5_003 * MINUTE
+    assert exchange.calls[-1][0] == 4_999 * MINUTE + 1
+    assert len(exchange.calls) == 2
+
+    # nowy proces czyta zamknięte świece z pliku
+    reopened = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock)
+    assert len(reopened.series("BTCUSDT", "1m")) == 102
+    third = asyncio.run(reopened.get_klines("BTCUSDT", "1m", limit=50))
+    assert np.array_equal(third, second[-50:])
+    assert exchange.calls[-1][0] == 5_002 * MINUTE + 1
+
+
+def test_larger_limit_and_ranges_backfill_once_then_read_locally(tmp_path):
+    exchange = FakeExchange(now_ms=5_000 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=60)
+
+    asyncio.run(store.get_klines("BTCUSDT", "1m", limit=100))
+    wide = asyncio.run(store.get_klines("BTCUSDT", "1m", limit=1500))
+    assert len(wide) == 1500
+    assert np.all(np.diff(wide["open_time"]) == MINUTE)
+    calls = len(exchange.calls)
+
+    ranged = asyncio.run(store.get_klines("BTCUSDT", "1m", limit=10, start_time=4_000 * MINUTE,
+                                          end_time=4_004 * MINUTE))
+    assert list(ranged["open_time"]) == [t * MINUTE for t in range(4_000, 4_005)]
+    narrow = asyncio.run(store.get_klines("BTCUSDT", "1m", limit=20))
+    assert len(narrow) == 20
+    assert len(exchange.calls) == calls
+
+
+def test_history_before_listing_is_not_requested_again(tmp_path):
+    exchange = FakeExchange(now_ms=LISTED + 10 * MINUTE + 30_000)
+    store = KlineStore(str(tmp_path), fetch=exchange.fetch, clock=exchange.clock, tail_ttl=60)
+
+    assert len(asyncio.run(store.get_klines("NEWUSDT", "1m", limit=100))) == 11
+    calls = len(exchange.calls)
+    assert len(asyncio.run(store.get_klines("NEWUSDT", "1m", limit=100))) == 11
+    assert len(exchange.calls) == calls
+
+
+def test_columnar_encoding_round_trips_and_is_compact():
+    exchange = FakeExchange(0)
+    array = from_binance([exchange.candle(LISTED + i * MINUTE) for i in range(500)])
+
+    encoded = encode_klines(array)
+    decoded = decode_klines(encoded)
+
+    assert np.array_equal(decoded, array)
+    assert len(encoded) == 8 + 500 * KLINE_DTYPE.itemsize
+    assert len(encoded) < len(json.dumps(to_binance(array)))
+    assert len(decode_klines(encode_klines(array[:0]))) == 0
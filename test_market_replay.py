@@ -0,0 +1,69 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from binance.ws.reconnecting_websocket import ReconnectingWebsocket
+
+from config import settings
+from services import binance_client
+from services.kline_store import fetch_binance_klines
+from services.market_replay import RecordType, ReplayServer, read_recording, write_random_walk
+from services.price_feed import BinanceTickerSource, PriceFeed
+
+
+def test_recording_round_trip(tmp_path):
+    path = str(tmp_path / "walk.mdr")
+    count = write_random_walk(path, ticks=600, history=10)
+
+    records = list(read_recording(path))
+    assert len(records) == count
+    types = Counter(record_type for record_type, _, _ in records)
+    assert types[RecordType.TICKER] == 600 and types[RecordType.KLINES] == 1
+    # jedno zamknięcie świecy na przełomie minuty
+    assert sum(1 for t, _, payload in records if t == RecordType.KLINE and payload["k"]["x"]) == 1
+    assert [timestamp for _, timestamp, _ in records] == sorted(timestamp for _, timestamp, _ in records)
+    with pytest.raises(ValueError):
+        ReplayServer(path, speed=5000)
+
+
+def test_app_clients_run_against_replay_server(tmp_path, monkeypatch):
+    path = str(tmp_path / "walk.mdr")
+    write_random_walk(path, ticks=600, history=10)
+    last_price = [p["c"] for t, _, p in read_recording(path) if t == RecordType.TICKER][-1]
+
+    # po końcu nagrania nie ma już wiadomości - pętla odczytu klienta kończy się po tym limicie czasu
+    monkeypatch.setattr(ReconnectingWebsocket, "TIMEOUT", 0.2)
+
+    async def scenario():
+        server = ReplayServer(path, speed=100)
+        await server.start()
+        monkeypatch.setattr(settings, "BINANCE_API_URL", f"{server.url}/api")
+        monkeypatch.setattr(settings, "BINANCE_STREAM_URL", f"ws://{server.host}:{server.port}/")
+        source = BinanceTickerSource()
+        feed = PriceFeed(source=source)
+        feed.subscribe(["BTCUSDT"])
+        updates = []
+        feed.add_listener(lambda symbol, price: updates.append(price))
+        await feed.start()
+        try:
+            while server.subscriber_count == 0:
+                await asyncio.sleep(0.01)
+            server.play()
+            await asyncio.wait_for(server.finished.wait(), 5)
+            await asyncio.sleep(0.1)
+            klines = await fetch_binance_klines("BTCUSDT", "1m", limit=1000)
+            return updates, klines, await source.fetch_price("BTCUSDT"), server.emitted
+        finally:
+            await feed.stop()
+            await binance_client.close_async_client()
+            await server.stop()
+
+    updates, klines, rest_price, emitted = asyncio.run(scenario())
+
+    assert emitted == 1201
+    assert len(updates) > 500
+    assert updates[-1] == rest_price == float(last_price)
+    # 10 świec z historii, zamknięta świeca z nagrania i bieżąca
+    assert len(klines) == 12
+    assert [row[0] for row in klines] == sorted(row[0] for row in klines)
+    assert klines[-1][4] == last_price
@@ -0,0 +1,104 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, OrderFuture, OrderStatus, AdvancedOrderType
+from services.order_index import OrderIndex
+from services.price_feed import FakePriceSource, PriceFeed
+
+
+def make_order(order_id, order_type, amount, price=None, stop_price=None, symbol="BTCUSDT",
+               status=OrderStatus.PENDING):
+    return OrderFuture(
+        id=order_id,
+        user_id=1,
+        portfolio_id=1,
+        symbol=symbol,
+        order_type=order_type,
+        amount=amount,
+        price=price,
+        stop_price=stop_price,
+        currency="USDT",
+        status=status
+    )
+
+
+def test_limit_orders_trigger_only_when_crossed():
+    index = OrderIndex()
+    index.add(make_order(1, AdvancedOrderType.LIMIT, 1.0, price=100.0))   # kupno przy <= 100
+    index.add(make_order(2, AdvancedOrderType.LIMIT, 1.0, price=90.0))    # kupno przy <= 90
+    index.add(make_order(3, AdvancedOrderType.LIMIT, -1.0, price=120.0))  # sprzedaż przy >= 120
+
+    assert index.triggered("BTCUSDT", 110.0) == []
+    assert sorted(index.triggered("BTCUSDT", 95.0)) == [1]
+    assert sorted(index.triggered("BTCUSDT", 90.0)) == [1, 2]
+    assert index.triggered("BTCUSDT", 120.0) == [3]
+    assert index.triggered("ETHUSDT", 1.0) == []
+
+
+def test_stop_orders_use_stop_price():
+    index = OrderIndex()
+    index.add(make_order(1, AdvancedOrderType.STOP_MARKET, 1.0, stop_price=105.0))
+    index.add(make_order(2, AdvancedOrderType.TAKE_PROFIT_LIMIT, -1.0, price=90.0, stop_price=110.0))
+
+    assert index.triggered("BTCUSDT", 100.0) == []
+    assert index.triggered("BTCUSDT", 105.0) == [1]
+    assert sorted(index.triggered("BTCUSDT", 115.0)) == [1, 2]
+
+
+def test_modify_and_remove_keep_index_in_sync():
+    index = OrderIndex()
+    order = make_order(1, AdvancedOrderType.LIMIT, 1.0, price=100.0)
+    index.add(order)
+
+    order.price = 80.0
+    index.add(order)
+    assert index.triggered("BTCUSDT", 90.0) == []
+    assert index.triggered("BTCUSDT", 80.0) == [1]
+    assert len(index) == 1
+
+    order.status = OrderStatus.CANCELLED
+    index.add(order)
+    assert 1 not in index
+    assert index.symbols() == set()
+
+    index.add(make_order(2, AdvancedOrderType.LIMIT, 1.0, price=100.0))
+    index.remove(2)
+    index.remove(2)
+    assert len(index) == 0
+
+
+def test_rebuild_loads_only_pending_orders():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all([
+        make_order(1, AdvancedOrderType.LIMIT, 1.0, price=100.0),
+        make_order(2, AdvancedOrderType.LIMIT, 1.0, price=100.0, status=OrderStatus.CANCELLED),
+        make_order(3, AdvancedOrderType.STOP_MARKET, -1.0, stop_price=50.0, symbol="ETHUSDT"),
+    ])
+    db.commit()
+
+    index = OrderIndex()
+    assert index.rebuild(db) == 2
+    assert index.symbols() == {"BTCUSDT", "ETHUSDT"}
+    assert index.triggered("ETHUSDT", 60.0) == [3]
+    db.close()
+
+
+def test_price_stream_subscriptions_follow_the_indexed_symbols():
+    feed = PriceFeed(source=FakePriceSource(), lookup_ttl=0)
+    index = OrderIndex(on_symbol_added=lambda symbol: feed.subscribe([symbol]),
+                       on_symbol_removed=lambda symbol: feed.unsubscribe([symbol]))
+
+    index.add(make_order(1, AdvancedOrderType.LIMIT, 1.0, price=100.0))
+    index.add(make_order(2, AdvancedOrderType.LIMIT, -1.0, price=120.0))
+    index.add(make_order(3, AdvancedOrderType.LIMIT, 1.0, price=10.0, symbol="ETHUSDT"))
+    assert feed.symbols == {"BTCUSDT", "ETHUSDT"}
+
+    # symbol zostaje w strumieniu, dopóki ma choć jedno oczekujące zlecenie
+    index.remove(1)
+    assert feed.symbols == {"BTCUSDT", "ETHUSDT"}
+    index.remove(2)
+    assert feed.symbols == {"ETHUSDT"}
+    index.clear()
+    assert feed.symbols == set()
@@ -0,0 +1,177 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from models.user import OrderFuture, OrderStatus, AdvancedOrderType, CurrencyBalance, PortfolioAsset, Portfolio
+from routers import orders as orders_router
+from services import orders_service
+from services.order_index import order_index
+from services.price_feed import price_feed, FakePriceSource
+
+
+@pytest.fixture
+def db(database, no_notifications, monkeypatch):
+    source = FakePriceSource({"BTCUSDT": 100.0, "ETHUSDT": 10.0})
+    old_source = price_feed.source
+    price_feed.set_source(source)
+    monkeypatch.setattr(orders_service, "AsyncSessionLocal", database.factory)
+    session = database.session
+    session.add(Portfolio(id=1, name="main", user_id=1))
+    session.add(CurrencyBalance(user_id=1, currency="USDT", amount=1000.0))
+    session.commit()
+    order_index.clear()
+
+    yield session
+
+    order_index.clear()
+    price_feed.set_source(old_source)
+
+
+def add_order(db, order_type, amount, price=None, stop_price=None, symbol="BTCUSDT"):
+    order = OrderFuture(user_id=1, portfolio_id=1, symbol=symbol, order_type=order_type, amount=amount,
+                        price=price, stop_price=stop_price, currency="USDT", status=OrderStatus.PENDING)
+    db.add(order)
+    db.commit()
+    order_index.add(order)
+    return order.id
+
+
+def test_tick_fetches_distinct_symbols_in_one_call(db):
+    for _ in range(50):
+        add_order(db, AdvancedOrderType.LIMIT, 1.0, price=50.0)
+    add_order(db, AdvancedOrderType.LIMIT, 1.0, price=5.0, symbol="ETHUSDT")
+
+    asyncio.run(orders_service.process_tick())
+
+    stats = orders_service.engine_stats.as_dict()
+    assert stats["symbols"] == 2
+    assert stats["upstream_calls"] == 1
+    assert stats["triggered"] == 0
+    assert len(order_index) == 51
+
+
+def test_tick_executes_triggered_order_at_snapshot_price(db):
+    executed_id = add_order(db, AdvancedOrderType.LIMIT, 2.0, price=150.0)
+    resting_id = add_order(db, AdvancedOrderType.LIMIT, 1.0, price=50.0)
+
+    asyncio.run(orders_service.process_tick())
+
+    assert orders_service.engine_stats.triggered == 1
+    assert executed_id not in order_index
+    assert resting_id in order_index
+    db.expire_all()
+    balance = db.query(CurrencyBalance).filter(CurrencyBalance.user_id == 1).first()
+    assert balance.amount == pytest.approx(800.0)
+    asset = db.query(PortfolioAsset).filter(PortfolioAsset.portfolio_id == 1).first()
+    assert asset.amount == 2.0
+    assert asset.buy_price == 100.0
+
+
+def test_invalid_symbol_does_not_abort_the_polling_tick(db):
+    executed_id = add_order(db, AdvancedOrderType.LIMIT, 2.0, price=150.0)
+    invalid_id = add_order(db, AdvancedOrderType.LIMIT, 1.0, price=1.0, symbol="NOPEUSDT")
+
+    # FakePriceSource odrzuca całe zapytanie zbiorcze z nieznanym symbolem, jak Binance
+    asyncio.run(orders_service.process_tick())
+
+    assert executed_id not in order_index and invalid_id in order_index
+    assert price_feed.invalid_symbols == {"NOPEUSDT"} and "NOPEUSDT" not in price_feed.symbols
+
+    asyncio.run(orders_service.process_tick())
+    # odłożony symbol nie jest już wyszukiwany przy każdym cyklu
+    assert orders_service.engine_stats.upstream_calls == 0
+
+
+def test_advanced_order_with_unknown_symbol_is_rejected(database, monkeypatch):
+    async def get_symbol_assets(symbol):
+        return ("BTC", "USDT") if symbol == "BTCUSDT" else None
+
+    monkeypatch.setattr(orders_router, "get_symbol_assets", get_symbol_assets)
+    database.session.add(Portfolio(id=1, name="main", user_id=1))
+    database.session.commit()
+
+    async def create(symbol):
+        async with database.factory() as session:
+            return await orders_router.create_advanced_order(
+                portfolio_id=1, symbol=symbol, order_type=AdvancedOrderType.LIMIT, amount=1.0, price=50.0,
+                db=session, current_user=SimpleNamespace(id=1))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(create("NOPEUSDT"))
+    assert error.value.status_code == 400
+    assert database.session.query(OrderFuture).count() == 0
+
+    order_id = asyncio.run(create("BTCUSDT"))["order_id"]
+    assert order_id in order_index
+    order_index.clear()
+
+
+def test_price_update_triggers_orders_without_polling(db):
+    order_id = add_order(db, AdvancedOrderType.LIMIT, 1.0, price=90.0)
+
+    async def scenario():
+        await price_feed.start()
+        price_feed.add_listener(orders_service.on_price_update)
+        try:
+            await asyncio.sleep(0)
+            price_feed.source.push("BTCUSDT", 95.0)
+            assert not orders_service._streaming_symbols
+
+            price_feed.source.push("BTCUSDT", 89.0)
+            assert "BTCUSDT" in orders_service._streaming_symbols
+            for _ in range(200):
+                if not orders_service._streaming_symbols:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            price_feed.remove_listener(orders_service.on_price_update)
+            await price_feed.stop()
+
+    asyncio.run(scenario())
+
+    assert order_id not in order_index
+    assert not orders_service._streaming_symbols
+    db.expire_all()
+    asset = db.query(PortfolioAsset).filter(PortfolioAsset.portfolio_id == 1).first()
+    assert asset.buy_price == 89.0
+
+
+def test_triggered_orders_of_one_account_cannot_double_spend(db):
+    db.query(CurrencyBalance).filter(CurrencyBalance.user_id == 1).update({"amount": 150.0})
+    db.commit()
+    first = add_order(db, AdvancedOrderType.LIMIT, 1.0, price=120.0)
+    second = add_order(db, AdvancedOrderType.LIMIT, 1.0, price=110.0)
+
+    asyncio.run(orders_service.process_tick())
+
+    db.expire_all()
+    balance = db.query(CurrencyBalance).filter(CurrencyBalance.user_id == 1).first()
+    assert balance.amount == pytest.approx(50.0)
+    statuses = {o.id: o.status for o in db.query(OrderFuture).all()}
+    assert list(statuses.values()) == [OrderStatus.FAILED]
+    assert first not in order_index and second not in order_index
+
+
+def test_executor_serializes_accounts_and_limits_concurrency():
+    executor = orders_service.OrderExecutor(concurrency=3)
+    running = {"total": 0, "max": 0}
+    per_user = {}
+
+    async def job(user_id):
+        async with executor.account([("user", user_id)]):
+            running["total"] += 1
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+            running["max"] = max(running["max"], running["total"])
+            assert per_user[user_id] == 1
+            await asyncio.sleep(0.001)
+            per_user[user_id] -= 1
+            running["total"] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(job(i % 5) for i in range(40)))
+
+    asyncio.run(scenario())
+    assert running["max"] == 3
+    assert executor._locks == {}
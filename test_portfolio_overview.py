@@ -0,0 +1,80 @@
+import asyncio
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from models.user import CurrencyBalance, Portfolio, PortfolioAsset
+from routers import portfolio as portfolio_router
+from services.conversion import ConversionGraph
+from services.exchange_info import ExchangeInfo
+from services.read_model import read_model
+from services.valuation import value_assets, value_balances
+
+PAYLOAD = {"symbols": [
+    {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT"},
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+]}
+
+
+@pytest.fixture
+def overview(database, monkeypatch):
+    session = database.session
+    session.add(CurrencyBalance(user_id=1, currency="USDT", amount=50.0))
+    session.add(CurrencyBalance(user_id=1, currency="XYZ", amount=1.0))
+    session.commit()
+
+    statements = []
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    monkeypatch.setattr(read_model, "session_factory", database.factory)
+
+    graph = ConversionGraph()
+    graph.rebuild(ExchangeInfo(PAYLOAD))
+    graph.update_many({"BTCUSDT": 200.0, "ETHBTC": 0.1})
+    monkeypatch.setattr(portfolio_router, "value_assets", partial(value_assets, graph=graph))
+    monkeypatch.setattr(portfolio_router, "value_balances", partial(value_balances, graph=graph))
+
+    def add_portfolios(count):
+        for _ in range(count):
+            portfolio = Portfolio(name="p", user_id=1)
+            session.add(portfolio)
+            session.flush()
+            session.add(PortfolioAsset(portfolio_id=portfolio.id, symbol="BTCUSDT", currency_type="crypto",
+                                       amount=1.0, buy_price=100.0, buy_currency="USDT"))
+            session.add(PortfolioAsset(portfolio_id=portfolio.id, symbol="ETH", currency_type="crypto",
+                                       amount=10.0, buy_price=0.05, buy_currency="BTC"))
+        session.commit()
+
+    def fetch(cold=True):
+        if cold:
+            read_model.clear()
+        statements.clear()
+        result = asyncio.run(portfolio_router.get_portfolios_overview(current_user=SimpleNamespace(id=1)))
+        return result, len(statements)
+
+    yield add_portfolios, fetch
+    read_model.clear()
+
+
+def test_overview_uses_a_fixed_number_of_queries(overview):
+    add_portfolios, fetch = overview
+
+    add_portfolios(1)
+    small, small_queries = fetch()
+    add_portfolios(9)
+    large, large_queries = fetch()
+
+    assert len(small["portfolios"]) == 1 and len(large["portfolios"]) == 10
+    # salda, portfele i pozycje (selectinload) - niezależnie od liczby portfeli
+    assert small_queries == large_queries == 3
+
+    first = large["portfolios"][0]
+    assert first["total_value"] == pytest.approx(400.0) and first["unrealized_pnl"] == pytest.approx(200.0)
+    assert {a["symbol"]: a["buy_currency"] for a in first["assets"]} == {"BTCUSDT": "USDT", "ETH": "BTC"}
+    assert large["balances_value"] == pytest.approx(50.0) and large["unpriced_balances"] == ["XYZ"]
+    assert large["total_value"] == pytest.approx(10 * 400.0 + 50.0)
+
+    # kolejne odczyty z modelu w pamięci nie sięgają do bazy
+    assert fetch(cold=False)[1] == 0
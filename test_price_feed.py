@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+from services.price_feed import BinanceTickerSource, PriceFeed, FakePriceSource, assign_streams
+
+
+def test_fresh_price_is_served_from_table():
+    async def scenario():
+        source = FakePriceSource({"BTCUSDT": 100.0})
+        feed = PriceFeed(source=source, max_age=60)
+        await feed.start()
+        await asyncio.sleep(0)
+
+        assert feed.connected
+        assert await feed.get_price("BTCUSDT") == 100.0
+        source.push("BTCUSDT", 101.5)
+        assert await feed.get_price("BTCUSDT") == 101.5
+        assert feed.upstream_calls == 0
+
+        await feed.stop()
+        assert not feed.connected
+
+    asyncio.run(scenario())
+
+
+def test_stale_price_falls_back_to_rest():
+    async def scenario():
+        source = FakePriceSource({"ETHUSDT": 2000.0})
+        feed = PriceFeed(source=source, max_age=5)
+
+        feed.update("ETHUSDT", 1900.0, timestamp=0)
+        assert feed.get("ETHUSDT") is None
+        assert await feed.get_price("ETHUSDT") == 2000.0
+        assert feed.upstream_calls == 1
+        assert "ETHUSDT" in feed.symbols
+
+        # kolejne odczyty korzystają już z tabeli
+        assert await feed.get_price("ETHUSDT") == 2000.0
+        assert feed.upstream_calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_listeners_fire_only_on_price_change():
+    feed = PriceFeed(source=FakePriceSource(), max_age=60)
+    updates = []
+    feed.add_listener(lambda symbol, price: updates.append((symbol, price)))
+
+    feed.update("BTCUSDT", 100.0)
+    feed.update("BTCUSDT", 100.0)
+    feed.update("BTCUSDT", 101.0)
+
+    assert updates == [("BTCUSDT", 100.0), ("BTCUSDT", 101.0)]
+
+
+def test_subscriptions_are_reference_counted_and_lookups_expire(monkeypatch):
+    feed = PriceFeed(source=FakePriceSource({"BTCUSDT": 100.0, "ETHUSDT": 10.0}), lookup_ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+
+    feed.subscribe(["BTCUSDT"])
+    feed.subscribe(["BTCUSDT"])
+    asyncio.run(feed.get_price("ETHUSDT"))
+    assert feed.symbols == {"BTCUSDT", "ETHUSDT"}
+
+    feed.unsubscribe(["BTCUSDT"])
+    assert "BTCUSDT" in feed.symbols
+    feed.unsubscribe(["BTCUSDT"])
+    feed.unsubscribe(["BTCUSDT"])
+    now[0] += 61
+    # symbol z pojedynczego odczytu wypada ze strumienia po lookup_ttl bez odczytów
+    assert feed.symbols == set()
+
+
+def test_stream_changes_reconnect_only_affected_connections():
+    assert assign_streams([], {"A", "B", "C"}, 2) == [frozenset({"A", "B"}), frozenset({"C"})]
+    current = [frozenset({"A", "B"}), frozenset({"C"})]
+    # nowy symbol dopełnia połączenie z wolnym miejscem, pierwsze zostaje bez zmian
+    assert assign_streams(current, {"A", "B", "C", "D"}, 2) == [frozenset({"A", "B"}), frozenset({"C", "D"})]
+    assert assign_streams(current, {"A", "B"}, 2) == [frozenset({"A", "B"})]
+
+    async def scenario():
+        source = BinanceTickerSource(max_streams=2, resync_interval=0.01)
+        opened = []
+
+        async def stream(feed, symbols):
+            opened.append(symbols)
+            await asyncio.Event().wait()
+
+        source._stream = stream
+        feed = PriceFeed(source=source)
+        feed.subscribe(["A", "B", "C"])
+        task = asyncio.create_task(source.run(feed))
+        await asyncio.sleep(0.05)
+        # kilka zmian między uzgodnieniami daje jedno przełączenie drugiego połączenia
+        feed.subscribe(["D"])
+        feed.subscribe(["E"])
+        feed.unsubscribe(["E"])
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return opened, source.reconnects
+
+    opened, reconnects = asyncio.run(scenario())
+    assert opened == [frozenset({"A", "B"}), frozenset({"C"}), frozenset({"C", "D"})]
+    assert reconnects == 3
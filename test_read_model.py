@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from sqlalchemy import update
+
+from models.user import CurrencyBalance, Order, OrderStatus, OrderType, Portfolio, PortfolioAsset
+from services import orders_service
+from services.read_model import read_model
+
+
+@pytest.fixture
+def db(database, no_notifications, monkeypatch):
+    monkeypatch.setattr(orders_service, "AsyncSessionLocal", database.factory)
+    monkeypatch.setattr(read_model, "session_factory", database.factory)
+    read_model.clear()
+
+    session = database.session
+    session.add(Portfolio(id=1, name="main", user_id=1))
+    session.add(CurrencyBalance(user_id=1, currency="USDT", amount=1000.0))
+    session.add(PortfolioAsset(portfolio_id=1, symbol="ETHUSDT", currency_type="crypto", amount=1.0,
+                               buy_price=10.0, buy_currency="USDT"))
+    session.commit()
+    yield session
+    read_model.clear()
+
+
+def execute(order_type, amount, price):
+    async def run():
+        async with orders_service.AsyncSessionLocal() as db:
+            order = Order(user_id=1, portfolio_id=1, symbol="BTCUSDT", order_type=order_type, amount=amount,
+                          currency="USDT", status=OrderStatus.PENDING)
+            db.add(order)
+            await db.commit()
+            if order_type == OrderType.BUY:
+                await orders_service.execute_buy(order, db, price)
+            else:
+                await orders_service._execute_sell(order, db, amount, price)
+
+    asyncio.run(run())
+
+
+def test_reads_are_served_from_memory_and_follow_executions(db):
+    account = asyncio.run(read_model.get(1))
+    assert account.balances == {"USDT": 1000.0}
+    loads = read_model.stats.loads
+
+    execute(OrderType.BUY, 2.0, 100.0)
+    execute(OrderType.BUY, 2.0, 200.0)
+    execute(OrderType.SELL, 1.0, 300.0)
+
+    account = asyncio.run(read_model.get(1))
+    assert read_model.stats.loads == loads
+    assert account.balances["USDT"] == pytest.approx(1000.0 - 200.0 - 400.0 + 300.0)
+    btc = account.portfolios[1].assets["BTCUSDT"]
+    assert btc.amount == pytest.approx(3.0) and btc.buy_price == pytest.approx(150.0)
+    # stan zbudowany ze zdarzeń zgadza się z bazą
+    assert asyncio.run(read_model.verify()) == []
+
+
+def test_overlapping_loads_are_discarded_and_drift_is_repaired(db):
+    async def load_during_write():
+        with read_model.writing(1):
+            return await read_model.get(1)
+
+    asyncio.run(load_during_write())
+    assert len(read_model) == 0 and read_model.stats.discarded_loads >= 1
+
+    asyncio.run(read_model.get(1))
+    # zmiana z pominięciem modelu odczytu jest wykrywana przy porównaniu z bazą
+    db.execute(update(CurrencyBalance).where(CurrencyBalance.user_id == 1).values(amount=5.0))
+    db.commit()
+    assert asyncio.run(read_model.verify()) == [1]
+    assert asyncio.run(read_model.get(1)).balances == {"USDT": 5.0}
+
+    read_model.clock, clock = (lambda: 10_000.0), read_model.clock
+    try:
+        assert read_model.evict_idle() == 1 and len(read_model) == 0
+    finally:
+        read_model.clock = clock
@@ -0,0 +1,91 @@
+import asyncio
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from models.user import Portfolio, PortfolioAsset, PortfolioSnapshot
+from services.conversion import ConversionGraph
+from services.exchange_info import ExchangeInfo
+from services import crud
+from services.snapshots import PortfolioSnapshotter, downsample, equity_curve
+
+PAYLOAD = {"symbols": [
+    {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT"},
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+]}
+
+
+@pytest.fixture
+def snapshotter(database):
+    session = database.session
+    session.add_all([Portfolio(id=1, name="a", user_id=1), Portfolio(id=2, name="b", user_id=1),
+                     Portfolio(id=3, name="empty", user_id=1)])
+    session.add_all([
+        PortfolioAsset(portfolio_id=1, symbol="BTCUSDT", amount=2.0, buy_price=100.0, buy_currency="USDT"),
+        PortfolioAsset(portfolio_id=1, symbol="ETH", amount=10.0, buy_price=0.05, buy_currency="BTC"),
+        PortfolioAsset(portfolio_id=2, symbol="BTCUSDT", amount=1.0, buy_price=150.0, buy_currency="USDT"),
+        PortfolioAsset(portfolio_id=2, symbol="XYZ", amount=5.0, buy_price=1.0, buy_currency="USDT"),
+    ])
+    session.commit()
+
+    graph = ConversionGraph()
+    graph.rebuild(ExchangeInfo(PAYLOAD))
+    graph.update_many({"BTCUSDT": 200.0, "ETHBTC": 0.1})
+    return PortfolioSnapshotter(graph=graph, session_factory=database.factory)
+
+
+def test_snapshot_values_all_portfolios_in_one_batch(snapshotter):
+    assert asyncio.run(snapshotter.snapshot(timestamp=1000)) == 3
+    snapshotter.graph.update("BTCUSDT", 300.0)
+    asyncio.run(snapshotter.snapshot(timestamp=2000))
+
+    async def read():
+        async with snapshotter.session_factory() as session:
+            return (await session.execute(select(PortfolioSnapshot.portfolio_id, PortfolioSnapshot.ts,
+                                                 PortfolioSnapshot.value, PortfolioSnapshot.cost)
+                                          .order_by(PortfolioSnapshot.portfolio_id, PortfolioSnapshot.ts))).all()
+
+    rows = asyncio.run(read())
+    # portfel 1: 2 BTC + 10 ETH (po 0.1 BTC), portfel 2: XYZ bez kursu pominięty
+    assert rows == [(1, 1000, pytest.approx(600.0), pytest.approx(300.0)),
+                    (1, 2000, pytest.approx(900.0), pytest.approx(350.0)),
+                    (2, 1000, pytest.approx(200.0), pytest.approx(150.0)),
+                    (2, 2000, pytest.approx(300.0), pytest.approx(150.0)),
+                    (3, 1000, 0.0, 0.0), (3, 2000, 0.0, 0.0)]
+
+    async def curve():
+        async with snapshotter.session_factory() as session:
+            return await equity_curve(session, 1, None, 3000, 10)
+
+    points = asyncio.run(curve())
+    assert [p["value"] for p in points] == [pytest.approx(600.0), pytest.approx(900.0)]
+
+
+@pytest.mark.parametrize("upsert", [True, False])
+def test_snapshots_in_the_same_second_keep_the_later_valuation(snapshotter, monkeypatch, upsert):
+    if not upsert:
+        monkeypatch.setattr(crud, "_UPSERT_INSERTS", {})
+    asyncio.run(snapshotter.snapshot(timestamp=1000))
+    snapshotter.graph.update("BTCUSDT", 300.0)
+    # np. zrzut ręczny w tej samej sekundzie co planowy
+    assert asyncio.run(snapshotter.snapshot(timestamp=1000)) == 3
+
+    async def read():
+        async with snapshotter.session_factory() as session:
+            return (await session.execute(select(PortfolioSnapshot.portfolio_id, PortfolioSnapshot.value)
+                                          .where(PortfolioSnapshot.ts == 1000)
+                                          .order_by(PortfolioSnapshot.portfolio_id))).all()
+
+    assert asyncio.run(read()) == [(1, pytest.approx(900.0)), (2, pytest.approx(300.0)), (3, 0.0)]
+
+
+def test_downsample_keeps_the_last_snapshot_of_each_bucket():
+    times = np.arange(0, 1000, 10)
+    values = times.astype(float)
+
+    points = downsample(times, values, values, 0, 999, 4)
+
+    assert [p["value"] for p in points] == [240.0, 490.0, 740.0, 990.0]
+    assert len(downsample(times, values, values, 0, 999, 1000)) == 100
+    assert downsample(times[:0], values[:0], values[:0], 0, 999, 4) == []
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from services.ticker_hub import TickerHub, Watchlist
+
+
+class FakeUpstream:
+    """Strumień, który liczy otwarte połączenia; wiadomości wysyła test przez hub.publish."""
+
+    def __init__(self):
+        self.opened = 0
+        self.open = 0
+
+    async def __call__(self, symbol, publish):
+        self.opened += 1
+        self.open += 1
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.open -= 1
+
+
+def test_viewers_share_one_upstream_until_last_leaves():
+    upstream = FakeUpstream()
+    hub = TickerHub(upstream=upstream, queue_size=4, max_conflated=10)
+
+    async def scenario():
+        subscriptions = [hub.subscribe("btcusdt") for _ in range(100)]
+        await asyncio.sleep(0)
+        assert upstream.opened == 1 and upstream.open == 1
+        assert hub.subscriber_counts() == {"BTCUSDT": 100}
+
+        hub.publish("BTCUSDT", {"s": "BTCUSDT", "c": "100.0"})
+        payloads = [await s.__anext__() for s in subscriptions]
+        assert {json.loads(payload)["c"] for payload in payloads} == {"100.0"}
+
+        for subscription in subscriptions[:-1]:
+            hub.unsubscribe(subscription)
+        await asyncio.sleep(0)
+        assert upstream.open == 1
+
+        hub.unsubscribe(subscriptions[-1])
+        await asyncio.sleep(0)
+        assert upstream.open == 0
+        assert hub.upstream_count == 0
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_is_conflated_then_dropped_without_stalling_others():
+    hub = TickerHub(upstream=FakeUpstream(), queue_size=2, max_conflated=5)
+
+    async def scenario():
+        slow = hub.subscribe("BTCUSDT")
+        fast = hub.subscribe("BTCUSDT")
+        received = []
+        for i in range(5):
+            hub.publish("BTCUSDT", {"c": i})
+            received.append(json.loads(await fast.__anext__())["c"])
+
+        assert received == [0, 1, 2, 3, 4]
+        # wolny klient ma tylko najnowsze wiadomości
+        assert slow.queue.qsize() == 2
+        assert slow.conflated == 3
+        assert [json.loads(await slow.__anext__())["c"] for _ in range(2)] == [3, 4]
+
+        for i in range(10):
+            hub.publish("BTCUSDT", {"c": i})
+            await fast.__anext__()
+        assert slow.closed
+        assert [payload async for payload in slow] == []
+        assert not fast.closed
+
+    asyncio.run(scenario())
+
+
+def test_new_viewer_gets_last_message_immediately():
+    hub = TickerHub(upstream=FakeUpstream())
+
+    async def scenario():
+        first = hub.subscribe("ETHUSDT")
+        hub.publish("ETHUSDT", {"c": "2000"})
+        second = hub.subscribe("ETHUSDT")
+        assert json.loads(await second.__anext__()) == {"c": "2000"}
+        hub.unsubscribe(first)
+        hub.unsubscribe(second)
+
+    asyncio.run(scenario())
+
+
+def test_watchlist_sends_latest_state_per_symbol_once_per_interval():
+    upstream = FakeUpstream()
+    hub = TickerHub(upstream=upstream)
+
+    async def scenario():
+        watchlist = Watchlist(hub, interval=0.05)
+        assert watchlist.subscribe(["btcusdt", "ETHUSDT", "BTCUSDT"]) == ["BTCUSDT", "ETHUSDT"]
+        await asyncio.sleep(0)
+        assert upstream.open == 2
+
+        hub.publish("BTCUSDT", {"e": "24hrTicker", "s": "BTCUSDT", "c": "100", "P": "1.0", "q": "9"})
+        first = await watchlist.next_batch()
+        assert first == {"BTCUSDT": {"c": "100", "P": "1.0"}}
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(50):
+            hub.publish("BTCUSDT", {"c": str(101 + i)})
+            hub.publish("ETHUSDT", {"c": str(10 + i)})
+        second = await watchlist.next_batch()
+        assert loop.time() - started >= 0.04
+        assert second == {"BTCUSDT": {"c": "150"}, "ETHUSDT": {"c": "59"}}
+
+        watchlist.unsubscribe(["ETHUSDT"])
+        hub.publish("ETHUSDT", {"c": "1"})
+        await asyncio.sleep(0)
+        assert upstream.open == 1
+        watchlist.close()
+        await asyncio.sleep(0)
+        assert upstream.open == 0
+
+    asyncio.run(scenario())
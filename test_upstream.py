@@ -0,0 +1,159 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp import web
+from binance import AsyncClient
+from binance.exceptions import BinanceAPIException
+
+from services.upstream import Priority, UpstreamBusy, UpstreamGateway, kline_weight
+
+
+class FakeExchangeServer:
+    """Lokalny serwer REST z limitem wagi jak Binance (nagłówek X-MBX-USED-WEIGHT-1M, 429 po przekroczeniu)."""
+
+    WEIGHTS = {"/api/v3/ticker/price": 2, "/api/v3/klines": 2, "/api/v3/exchangeInfo": 20}
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.requests = []
+        # ścieżki, dla których treść odpowiedzi przychodzi z opóźnieniem po nagłówkach
+        self.slow_bodies = {}
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        self.requests.append(request.path)
+        self.used += self.WEIGHTS[request.path]
+        headers = {"X-MBX-USED-WEIGHT-1M": str(self.used)}
+        if self.used > self.limit:
+            headers["Retry-After"] = "30"
+            return web.json_response({"code": -1003, "msg": "Too many requests"}, status=429, headers=headers)
+        if request.path.endswith("ticker/price"):
+            body = {"symbol": request.query["symbol"], "price": "100.00000000"}
+        elif request.path.endswith("klines"):
+            body = []
+        else:
+            body = {"symbols": []}
+        if request.path in self.slow_bodies:
+            response = web.StreamResponse(headers={**headers, "Content-Type": "application/json"})
+            await response.prepare(request)
+            await asyncio.sleep(self.slow_bodies[request.path])
+            await response.write(json.dumps(body).encode())
+            await response.write_eof()
+            return response
+        return web.json_response(body, headers=headers)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/api/v3/{name:.*}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/api"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def run_with_gateway(scenario, server_limit=1000, **gateway_params):
+    async def main():
+        async with FakeExchangeServer(server_limit) as server:
+            client = AsyncClient()
+            client.API_URL = server.url
+
+            async def get_client():
+                return client
+
+            try:
+                return await scenario(server, UpstreamGateway(client=get_client, **gateway_params))
+            finally:
+                await client.close_connection()
+
+    return asyncio.run(main())
+
+
+def test_gateway_tracks_used_weight_reported_by_exchange():
+    async def scenario(server, gateway):
+        # inne procesy z tego samego IP zużyły już część budżetu
+        server.used = 40
+        ticker = await gateway.call("get_symbol_ticker", 2, Priority.HIGH, symbol="BTCUSDT")
+        await gateway.call("get_exchange_info", 20, Priority.NORMAL)
+        return ticker, gateway
+
+    ticker, gateway = run_with_gateway(scenario, limit=100)
+
+    assert ticker == {"symbol": "BTCUSDT", "price": "100.00000000"}
+    assert gateway.used_weight == 62
+    assert gateway.tokens == pytest.approx(38, abs=1)
+    assert kline_weight(500) == 5 and kline_weight(50) == 1
+
+
+def test_low_budget_sheds_history_but_serves_order_prices():
+    async def scenario(server, gateway):
+        server.used = 60
+        await gateway.call("get_symbol_ticker", 2, Priority.HIGH, symbol="BTCUSDT")
+        with pytest.raises(UpstreamBusy):
+            await gateway.call("get_klines", 2, Priority.LOW, symbol="BTCUSDT", interval="1m")
+        await gateway.call("get_exchange_info", 20, Priority.NORMAL)
+        with pytest.raises(UpstreamBusy):
+            await gateway.call("get_exchange_info", 20, Priority.NORMAL)
+        for _ in range(5):
+            await gateway.call("get_symbol_ticker", 2, Priority.HIGH, symbol="ETHUSDT")
+        return server, gateway
+
+    server, gateway = run_with_gateway(scenario, limit=100)
+
+    assert "/api/v3/klines" not in server.requests
+    assert gateway.stats.as_dict()["shed"] == {"high": 0, "normal": 1, "low": 1}
+    assert gateway.stats.calls["high"] == 6
+
+
+def test_low_priority_calls_queue_until_budget_refills():
+    async def scenario(server, gateway):
+        for _ in range(4):
+            await gateway.call("get_klines", 2, Priority.LOW, symbol="BTCUSDT", interval="1m")
+        return gateway
+
+    # 10 wagi na 0,5 s: czwarte zapytanie czeka na odnowienie budżetu zamiast być odrzucone
+    gateway = run_with_gateway(scenario, limit=10, window=0.5)
+
+    assert gateway.stats.queued >= 1
+    assert gateway.stats.shed["low"] == 0
+
+
+def test_rate_limit_response_pauses_upstream_calls():
+    async def scenario(server, gateway):
+        server.used = 999
+        with pytest.raises(BinanceAPIException):
+            await gateway.call("get_symbol_ticker", 2, Priority.HIGH, symbol="BTCUSDT")
+        with pytest.raises(UpstreamBusy) as busy:
+            await gateway.call("get_klines", 2, Priority.LOW, symbol="BTCUSDT", interval="1m")
+        return server, gateway, busy.value
+
+    server, gateway, busy = run_with_gateway(scenario)
+
+    assert server.requests == ["/api/v3/ticker/price"]
+    assert gateway.stats.throttled == 1
+    assert busy.retry_after == pytest.approx(30, abs=1)
+
+
+def test_concurrent_calls_sync_with_their_own_response():
+    async def scenario(server, gateway):
+        server.slow_bodies["/api/v3/exchangeInfo"] = 0.2
+        slow = asyncio.create_task(gateway.call("get_exchange_info", 20, Priority.NORMAL))
+        await asyncio.sleep(0.05)
+        # odpowiedź na ticker przychodzi, gdy treść exchangeInfo jest jeszcze czytana
+        await gateway.call("get_symbol_ticker", 2, Priority.HIGH, symbol="BTCUSDT")
+        assert gateway.used_weight == 22
+        await slow
+        return gateway
+
+    gateway = run_with_gateway(scenario)
+
+    # exchangeInfo uzgadnia budżet z własnym nagłówkiem, a nie z odpowiedzi na ticker
+    assert gateway.used_weight == 20
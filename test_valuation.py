@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.conversion import ConversionGraph
+from services.exchange_info import ExchangeInfoCache
+from services.valuation import value_assets
+
+PAYLOAD = {"symbols": [
+    {"symbol": "BTCUSDT", "baseAsset": "BTC", "quoteAsset": "USDT"},
+    {"symbol": "ETHBTC", "baseAsset": "ETH", "quoteAsset": "BTC"},
+    {"symbol": "BTCPLN", "baseAsset": "BTC", "quoteAsset": "PLN"},
+]}
+PRICES = {"BTCUSDT": 200.0, "ETHBTC": 0.1, "BTCPLN": 800.0}
+
+ASSETS = [
+    SimpleNamespace(symbol="BTCUSDT", amount=2.0, buy_price=100.0, buy_currency="USDT"),
+    SimpleNamespace(symbol="ETH", amount=10.0, buy_price=0.05, buy_currency="BTC"),
+    SimpleNamespace(symbol="XYZ", amount=1.0, buy_price=1.0, buy_currency="USDT"),
+]
+
+
+def valuation(target):
+    async def fetch_info():
+        return PAYLOAD
+
+    async def fetch_prices():
+        return PRICES
+
+    graph = ConversionGraph(fetch_prices=fetch_prices, info_cache=ExchangeInfoCache(fetch=fetch_info))
+    result = asyncio.run(value_assets(ASSETS, target, graph=graph))
+    return result, graph
+
+
+def test_assets_are_marked_to_market_from_the_conversion_graph():
+    result, graph = valuation("USD")
+
+    # jedno zapytanie przy budowie grafu; sama wycena nie sięga do sieci
+    assert graph.upstream_calls == 1
+    btc, eth, xyz = result["assets"]
+    assert btc["value"] == pytest.approx(400.0) and btc["cost_basis"] == pytest.approx(200.0)
+    assert btc["unrealized_pnl"] == pytest.approx(200.0)
+    # ETH -> BTC -> USDT przez walutę pośrednią
+    assert eth["price"] == pytest.approx(20.0)
+    assert eth["value"] == pytest.approx(200.0) and eth["cost_basis"] == pytest.approx(100.0)
+    assert btc["price_time"] is not None
+    assert xyz["value"] is None and result["unpriced"] == ["XYZ"]
+    assert result["total_value"] == pytest.approx(600.0)
+    assert result["unrealized_pnl"] == pytest.approx(300.0)
+
+
+def test_valuation_converts_into_target_currency():
+    in_btc, _ = valuation("BTC")
+    in_pln, _ = valuation("PLN")
+
+    assert in_btc["total_value"] == pytest.approx(3.0)
+    assert in_btc["assets"][1]["cost_basis"] == pytest.approx(0.5)
+    assert in_pln["total_value"] == pytest.approx(2400.0)
+    assert in_pln["assets"][1]["price"] == pytest.approx(80.0)
+    with pytest.raises(ValueError):
+        valuation("NOPE")